@@ -0,0 +1,105 @@
+import asyncio
+import itertools
+import random
+from datetime import datetime, timezone
+from typing import List, Optional
+
+# Snowflake-like ids for interactions and messages
+_ids = itertools.count(1_000_000_000_000_000_000)
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"bench-user-{user_id}"
+
+    def __str__(self):
+        return self.name
+
+class FakeMessage:
+    def __init__(self, interaction: 'FakeInteraction', message_id: Optional[int] = None):
+        self.interaction = interaction
+        self.id = message_id or next(_ids)
+
+    async def edit(self, **kwargs):
+        await self.interaction.discord_call('edit')
+        return self
+
+class FakeResponse:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self.interaction = interaction
+        self._done = False
+        self.modal = None
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, thinking: bool = False, ephemeral: bool = False):
+        await self.interaction.discord_call('defer')
+        self._done = True
+
+    async def send_message(self, content: Optional[str] = None, embed=None, view=None, ephemeral: bool = False):
+        await self.interaction.discord_call('send')
+        self.interaction.record(content, embed, ephemeral)
+        self._done = True
+
+    async def edit_message(self, content: Optional[str] = None, embed=None, view=None):
+        await self.interaction.discord_call('edit')
+        self._done = True
+
+    async def send_modal(self, modal):
+        await self.interaction.discord_call('modal')
+        self.modal = modal
+        self._done = True
+
+class FakeFollowup:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self.interaction = interaction
+
+    async def send(self, content: Optional[str] = None, embed=None, view=None, ephemeral: bool = False, wait: bool = False):
+        await self.interaction.discord_call('followup')
+        self.interaction.record(content, embed, ephemeral)
+        return FakeMessage(self.interaction)
+
+class FakeInteraction:
+    """
+    Just enough of discord.Interaction to drive the bot's handlers.
+
+    Every Discord API call waits for a jittered latency. Ephemeral replies
+    other than the finalize confirmation (posted or still queued) are
+    recorded as errors, which is how the handlers report failures to the
+    user.
+    """
+
+    def __init__(self, client, user_id: int, channel_id: int, latency: float, message: Optional[FakeMessage] = None):
+        self.id = next(_ids)
+        self.created_at = datetime.now(timezone.utc)
+        self.client = client
+        self.user = FakeUser(user_id)
+        self.guild_id = None
+        self.channel_id = channel_id
+        self.latency = latency
+        self.message = message
+        self.extras = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.errors: List[str] = []
+        self.calls = 0
+        self._original: Optional[FakeMessage] = None
+
+    async def discord_call(self, kind: str):
+        self.calls += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def record(self, content: Optional[str], embed, ephemeral: bool):
+        text = content or (embed.title if embed is not None else "")
+        if ephemeral and not text.startswith(("✅", "⏳")):
+            self.errors.append(text)
+
+    async def edit_original_response(self, **kwargs) -> FakeMessage:
+        await self.discord_call('edit_original')
+        if self._original is None:
+            self._original = FakeMessage(self)
+        return self._original
+
+    async def original_response(self) -> FakeMessage:
+        return await self.edit_original_response()
@@ -0,0 +1,263 @@
+"""
+Offline load test for the bot.
+
+Runs the real TweetBot command handlers, TweetGenerator and TweetScheduler
+against local stand-in servers for OpenAI and Typefully and fake Discord
+interactions, then reports latency percentiles per stage, throughput and
+event loop lag.
+
+Usage:
+    python -m bench.run --users 200 --openai-latency 0.8 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from bench.fake_discord import FakeInteraction, FakeMessage
+from bench.stubs import OpenAIStub, TypefullyStub
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test the bot against local stand-in services")
+    parser.add_argument('--users', type=int, default=100, help="Number of simulated create/feedback/finalize flows")
+    parser.add_argument('--concurrency', type=int, default=0, help="Maximum flows in progress at once (0 for all)")
+    parser.add_argument('--ramp', type=float, default=5.0, help="Seconds over which the flows are started")
+    parser.add_argument('--length', type=int, default=4, help="Tweets per thread")
+    parser.add_argument('--variants', type=int, default=1, help="Drafts per /create; flows page to the second one")
+    parser.add_argument('--feedback-rate', type=float, default=1.0, help="Fraction of flows that submit feedback")
+    parser.add_argument('--openai-latency', type=float, default=0.8, help="Mean OpenAI response time in seconds")
+    parser.add_argument('--typefully-latency', type=float, default=0.2, help="Mean Typefully response time in seconds")
+    parser.add_argument('--discord-latency', type=float, default=0.05, help="Mean Discord API call time in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of stub requests failing with a 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Fraction of stub requests failing with a 429")
+    parser.add_argument('--failing-model', action='append', default=[],
+                        help="Model the OpenAI stub rejects, to exercise fallbacks (repeatable)")
+    parser.add_argument('--no-stream', action='store_true', help="Disable streamed previews")
+    parser.add_argument('--max-loop-lag', type=float, default=None,
+                        help="Exit with status 1 if the p99 event loop lag exceeds this many seconds")
+    parser.add_argument('--log-level', default='ERROR', help="Log level of the bot while benchmarking")
+    return parser.parse_args(argv)
+
+def configure_environment(args: argparse.Namespace, openai_url: str, typefully_url: str, data_dir: str):
+    """Point the bot at the stubs; must run before config is imported"""
+    os.environ.update({
+        'OPENAI_BASE_URL': f"{openai_url}/v1",
+        'TYPEFULLY_API_URL': f"{typefully_url}/v1/drafts/",
+        'DATA_DIR': data_dir,
+        'LOG_FILE': os.path.join(data_dir, 'bench.log'),
+        'LOG_LEVEL': args.log_level,
+        'STREAM_PREVIEWS': 'false' if args.no_stream else 'true',
+        # Every flow must reach the stand-in OpenAI server
+        'RESPONSE_CACHE_SIZE': '0',
+        'RESPONSE_CACHE_PATH': ''
+    })
+    defaults = {
+        'DISCORD_TOKEN': 'bench',
+        'OPENAI_API_KEY': 'bench',
+        'TYPEFULLY_API_KEY': 'bench',
+        'DISCORD_CHANNEL_IDS': '',
+        # Benchmark the bot, not the client-side rate limits, unless asked to
+        'OPENAI_REQUESTS_PER_MINUTE': '1000000',
+        'OPENAI_TOKENS_PER_MINUTE': '1000000000',
+        'TYPEFULLY_REQUESTS_PER_MINUTE': '1000000'
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+class LoopLagSampler:
+    """Records how late short sleeps wake up, i.e. how long the loop was blocked"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of values (q between 0 and 100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class Recorder:
+    """Collects latencies and failures per stage"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Dict[str, int] = defaultdict(int)
+
+    async def run(self, stage: str, interaction: FakeInteraction, coro) -> bool:
+        started = time.perf_counter()
+        try:
+            await coro
+            ok = not interaction.errors
+        except Exception as e:
+            print(f"{stage} raised {type(e).__name__}: {e}", file=sys.stderr)
+            ok = False
+        self.latencies[stage].append(time.perf_counter() - started)
+        if not ok:
+            self.failures[stage] += 1
+        return ok
+
+async def user_flow(bot, bot_module, recorder: Recorder, args: argparse.Namespace, index: int):
+    """One user: /create, optionally paging and feedback on tweet 2, then finalize"""
+    user_id = 10_000 + index
+    channel_id = 42
+    create = bot.tree.get_command('create')
+
+    interaction = FakeInteraction(bot, user_id, channel_id, args.discord_latency)
+    ok = await recorder.run('create', interaction, create.callback(
+        interaction,
+        main=f"ETHTaipei benchmark announcement #{index}",
+        context="Asia's largest Ethereum community event, load test edition",
+        keywords="ETHTaipei, Ethereum",
+        length=args.length,
+        tone="normal",
+        variants=args.variants
+    ))
+    if not ok or interaction._original is None:
+        return
+    message_id = interaction._original.id
+
+    if args.variants > 1:
+        click = FakeInteraction(bot, user_id, channel_id, args.discord_latency)
+        click.message = FakeMessage(click, message_id)
+        view = bot_module.TweetPreviewView()
+
+        async def page():
+            if await view.interaction_check(click):
+                await view.next_button.callback(click)
+            else:
+                click.errors.append("interaction check failed")
+
+        await recorder.run('variant', click, page())
+
+    if random.random() < args.feedback_rate:
+        click = FakeInteraction(bot, user_id, channel_id, args.discord_latency)
+        click.message = FakeMessage(click, message_id)
+        view = bot_module.TweetPreviewView()
+        if not await view.interaction_check(click):
+            recorder.failures['feedback'] += 1
+            return
+        await view.feedback_button.callback(click)
+
+        submit = FakeInteraction(bot, user_id, channel_id, args.discord_latency)
+        modal = click.response.modal
+        modal.feedback._refresh_state(submit, {'value': "Make it a little punchier"})
+        modal.targets._refresh_state(submit, {'value': "2" if args.length >= 2 else ""})
+        if not await recorder.run('feedback', submit, modal.on_submit(submit)):
+            return
+        message_id = submit._original.id
+
+    click = FakeInteraction(bot, user_id, channel_id, args.discord_latency)
+    click.message = FakeMessage(click, message_id)
+    view = bot_module.TweetPreviewView()
+
+    async def finalize():
+        if await view.interaction_check(click):
+            await view.finalize_button.callback(click)
+        else:
+            click.errors.append("interaction check failed")
+
+    await recorder.run('finalize', click, finalize())
+
+def report(recorder: Recorder, elapsed: float, lag: List[float], flows: int, stubs: Dict[str, object]):
+    print(f"\n{flows} flows in {elapsed:.2f}s ({flows / elapsed:.1f} flows/s)\n")
+    print(f"{'stage':<10} {'count':>6} {'fail':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'ops/s':>7}")
+    for stage in ('create', 'variant', 'feedback', 'finalize'):
+        values = recorder.latencies.get(stage, [])
+        if not values:
+            continue
+        print(
+            f"{stage:<10} {len(values):>6} {recorder.failures[stage]:>5} "
+            f"{percentile(values, 50):>8.3f} {percentile(values, 95):>8.3f} "
+            f"{percentile(values, 99):>8.3f} {max(values):>8.3f} {len(values) / elapsed:>7.1f}"
+        )
+    print(
+        f"\nevent loop lag: p50 {percentile(lag, 50) * 1000:.1f}ms, "
+        f"p99 {percentile(lag, 99) * 1000:.1f}ms, max {max(lag, default=0) * 1000:.1f}ms "
+        f"({len(lag)} samples)"
+    )
+    for name, stub in stubs.items():
+        print(f"{name}: {dict(stub.stats)}")
+
+async def run(args: argparse.Namespace, recorder: Optional[Recorder] = None) -> int:
+    """
+    Run the benchmark and print its report
+
+    Args:
+        args: Options as returned by parse_args
+        recorder: Collects the results of each stage, for callers that check them
+
+    Returns:
+        The exit status
+    """
+    openai_stub = OpenAIStub(
+        args.openai_latency, args.error_rate, args.rate_limit_rate, failing_models=args.failing_model
+    )
+    typefully_stub = TypefullyStub(args.typefully_latency, args.error_rate, args.rate_limit_rate)
+    data_dir = tempfile.mkdtemp(prefix='tweetbot-bench-')
+    configure_environment(args, await openai_stub.start(), await typefully_stub.start(), data_dir)
+
+    # Imported late so config picks up the stub endpoints
+    bot_module = importlib.import_module('main')
+    bot_module.setup_logging()
+
+    bot = bot_module.TweetBot()
+    recorder = recorder or Recorder()
+    sampler = LoopLagSampler()
+    limit = asyncio.Semaphore(args.concurrency or args.users)
+
+    async def start_flow(index: int):
+        await asyncio.sleep(args.ramp * index / max(1, args.users))
+        async with limit:
+            await user_flow(bot, bot_module, recorder, args, index)
+
+    bot.post_worker.start()
+    if bot.generation is not bot.tweet_generator:
+        bot.generation.start()
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(start_flow(i) for i in range(args.users)))
+    finally:
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+        await bot.close()
+        await openai_stub.stop()
+        await typefully_stub.stop()
+
+    report(recorder, elapsed, sampler.samples, args.users, {'openai stub': openai_stub, 'typefully stub': typefully_stub})
+    print(f"bot log: {os.path.join(data_dir, 'bench.log')}")
+
+    if args.max_loop_lag is not None and percentile(sampler.samples, 99) > args.max_loop_lag:
+        print(f"FAIL: p99 event loop lag exceeds {args.max_loop_lag}s", file=sys.stderr)
+        return 1
+    return 0
+
+def main():
+    sys.exit(asyncio.run(run(parse_args())))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter
+from typing import List, Optional
+from aiohttp import web
+
+FILLER = (
+    "Builders from across Asia are meeting in Taipei to ship real products on Ethereum, "
+    "with workshops, hackathon tracks and plenty of time to meet the teams."
+)
+
+class StubServer:
+    """
+    Local aiohttp server standing in for a remote API.
+
+    Every request waits for a jittered latency and then fails with a 5xx
+    with probability error_rate or a 429 with probability rate_limit_rate.
+    Counts of requests and responses by status are kept in `stats`.
+    """
+
+    def __init__(self, latency: float, error_rate: float = 0.0, rate_limit_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stats: Counter = Counter()
+        self.app = web.Application()
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def start(self) -> str:
+        """Start listening on a free local port and return the base URL"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _delay(self) -> float:
+        return self.latency * random.uniform(0.5, 1.5)
+
+    async def _fault(self) -> Optional[web.Response]:
+        """Wait for the simulated latency and maybe return an injected failure"""
+        self.stats['requests'] += 1
+        await asyncio.sleep(self._delay())
+        roll = random.random()
+        if roll < self.error_rate:
+            self.stats['500'] += 1
+            return web.json_response(
+                {'error': {'message': 'Injected failure', 'type': 'server_error'}}, status=500
+            )
+        if roll < self.error_rate + self.rate_limit_rate:
+            self.stats['429'] += 1
+            return web.json_response(
+                {'error': {'message': 'Injected rate limit', 'type': 'rate_limit_exceeded'}},
+                status=429,
+                headers={'Retry-After': '1'}
+            )
+        self.stats['200'] += 1
+        return None
+
+class OpenAIStub(StubServer):
+    """
+    Stand-in for the chat completions API.
+
+    Answers function calls with the requested number of tweets, streams a
+    numbered list as server-sent events when asked to, and answers
+    revision prompts with only the targeted tweet numbers. Requests for
+    one of failing_models are answered with a 404, as for an unknown model.
+    """
+
+    def __init__(self, *args, failing_models: Optional[List[str]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failing_models = set(failing_models or [])
+        self.app.router.add_post('/v1/chat/completions', self.handle_completion)
+        self._ids = itertools.count(1)
+
+    async def handle_completion(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.stats[f"model {body['model']}"] += 1
+        if body['model'] in self.failing_models:
+            self.stats['404'] += 1
+            return web.json_response(
+                {'error': {'message': f"The model {body['model']} does not exist", 'type': 'invalid_request_error'}},
+                status=404
+            )
+        prompt = body['messages'][-1]['content']
+        numbers = self._tweet_numbers(body, prompt)
+        tweets = [f"{FILLER} ({number})" for number in numbers]
+
+        if body.get('stream'):
+            return await self._stream(request, body, numbers, tweets)
+
+        failure = await self._fault()
+        if failure is not None:
+            return failure
+
+        choices = []
+        for index in range(body.get('n') or 1):
+            message = {'role': 'assistant', 'content': None}
+            if body.get('tools'):
+                name = body['tools'][0]['function']['name']
+                message['tool_calls'] = [{
+                    'id': f"call_{next(self._ids)}",
+                    'type': 'function',
+                    'function': {'name': name, 'arguments': json.dumps({'tweets': tweets})}
+                }]
+            else:
+                message['content'] = self._numbered(numbers, tweets)
+            choices.append({'index': index, 'message': message, 'finish_reason': 'stop'})
+        return web.json_response({
+            'id': f"chatcmpl-{next(self._ids)}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': choices,
+            'usage': self._usage(prompt, tweets * len(choices))
+        })
+
+    async def _stream(self, request: web.Request, body, numbers: List[int], tweets: List[str]) -> web.StreamResponse:
+        # Latency until the first token; the rest arrives over the same time again
+        failure = await self._fault()
+        if failure is not None:
+            return failure
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        text = self._numbered(numbers, tweets)
+        pieces = [text[i:i + 16] for i in range(0, len(text), 16)]
+        pause = self._delay() / max(1, len(pieces))
+        chunk_id = f"chatcmpl-{next(self._ids)}"
+
+        async def send(choices, usage=None):
+            chunk = {
+                'id': chunk_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': body['model'],
+                'choices': choices,
+                'usage': usage
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+
+        for piece in pieces:
+            await send([{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}])
+            await asyncio.sleep(pause)
+        await send([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        await send([], self._usage(body['messages'][-1]['content'], tweets))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def _tweet_numbers(body, prompt: str) -> List[int]:
+        targets = re.search(r'Rewrite only tweet\(s\) ([\d, ]+)', prompt)
+        if targets:
+            return [int(n) for n in re.findall(r'\d+', targets.group(1))]
+        if body.get('tools'):
+            length = body['tools'][0]['function']['parameters']['properties']['tweets']['maxItems']
+        else:
+            match = re.search(r'exactly (\d+) tweets', prompt)
+            length = int(match.group(1)) if match else 3
+        return list(range(1, length + 1))
+
+    @staticmethod
+    def _numbered(numbers: List[int], tweets: List[str]) -> str:
+        return "\n".join(f"{number}. {tweet}" for number, tweet in zip(numbers, tweets))
+
+    @staticmethod
+    def _usage(prompt: str, tweets: List[str]) -> dict:
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = sum(len(tweet) for tweet in tweets) // 4
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+
+class TypefullyStub(StubServer):
+    """Stand-in for the Typefully drafts API"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.app.router.add_post('/v1/drafts/', self.handle_draft)
+        self._ids = itertools.count(1)
+
+    async def handle_draft(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        failure = await self._fault()
+        if failure is not None:
+            return failure
+        draft_id = next(self._ids)
+        self.stats['tweets'] += len(body['content'].split("\n\n\n\n"))
+        return web.json_response({'id': draft_id, 'share_url': f"https://typefully.com/t/bench{draft_id}"})
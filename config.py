@@ -1,5 +1,6 @@
 import os
 from dotenv import load_dotenv
+from dateutil import tz
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,31 +15,200 @@ DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 DISCORD_CHANNEL_IDS = os.getenv('DISCORD_CHANNEL_IDS', '').strip()
 ALLOWED_CHANNELS = [int(channel_id.strip()) for channel_id in DISCORD_CHANNEL_IDS.split(',') if channel_id.strip()]
 
+# Register commands for one guild only; guild commands update instantly,
+# global ones can take up to an hour to propagate. An invalid ID is reported
+# by validate() rather than failing the import
+_DISCORD_GUILD_ID = os.getenv('DISCORD_GUILD_ID', '').strip()
+DISCORD_GUILD_ID = int(_DISCORD_GUILD_ID) if _DISCORD_GUILD_ID.isdigit() else None
+
+# Sharding: 'auto' or a number of gateway shards (unset for a single
+# connection). DISCORD_SHARD_IDS runs only the listed shards in this process
+DISCORD_SHARD_COUNT = os.getenv('DISCORD_SHARD_COUNT', '').strip().lower()
+DISCORD_SHARD_IDS = [int(shard.strip()) for shard in os.getenv('DISCORD_SHARD_IDS', '').split(',') if shard.strip()]
+
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Override the API endpoint, e.g. to point at a local stand-in server
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+# Maximum number of concurrent OpenAI requests
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '4'))
+# Generate in this many worker processes instead of on the bot's event loop
+# (0 to disable); each worker runs one generation at a time
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '0'))
+# 'json' requests the thread through function calling, 'text' as a numbered list
+OPENAI_OUTPUT_MODE = os.getenv('OPENAI_OUTPUT_MODE', 'json').lower()
+# Model routing: OPENAI_MODEL serves requests no route matches, falling back
+# to OPENAI_FALLBACK_MODELS in order when it takes longer than
+# OPENAI_ROUTE_TIMEOUT seconds or fails. OPENAI_ROUTES is a JSON list of
+# rules replacing the built-in ones (see services/model_router.py) and
+# OPENAI_MODEL_PRICES a JSON object of USD per 1K prompt/completion tokens
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+OPENAI_FALLBACK_MODELS = [model.strip() for model in os.getenv('OPENAI_FALLBACK_MODELS', 'gpt-4o').split(',') if model.strip()]
+OPENAI_TEMPERATURE = float(os.getenv('OPENAI_TEMPERATURE', '0.7'))
+OPENAI_ROUTE_TIMEOUT = float(os.getenv('OPENAI_ROUTE_TIMEOUT', '60'))
+OPENAI_ROUTES = os.getenv('OPENAI_ROUTES', '').strip()
+OPENAI_MODEL_PRICES = os.getenv('OPENAI_MODEL_PRICES', '').strip()
+# Send a second, identical request when one takes longer than this
+# percentile of recent requests (0 disables hedging), once there are
+# OPENAI_HEDGE_MIN_SAMPLES of them
+OPENAI_HEDGE_PERCENTILE = float(os.getenv('OPENAI_HEDGE_PERCENTILE', '95'))
+OPENAI_HEDGE_MIN_SAMPLES = int(os.getenv('OPENAI_HEDGE_MIN_SAMPLES', '20'))
+
+# Seconds after an interaction was created by which its work must be done,
+# leaving time to reply before Discord's 15 minute interaction token expires
+INTERACTION_DEADLINE = float(os.getenv('INTERACTION_DEADLINE', '840'))
+# Client-side rate limits; set these to your OpenAI account's limits
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500'))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv('OPENAI_TOKENS_PER_MINUTE', '10000'))
+
+# Response cache: in-memory LRU plus an optional SQLite tier (set a path to enable)
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '256'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '86400'))
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', '')
 
 # Typefully Configuration
 TYPEFULLY_API_KEY = os.getenv('TYPEFULLY_API_KEY')
+TYPEFULLY_API_URL = os.getenv('TYPEFULLY_API_URL', 'https://api.typefully.com/v1/drafts/')
+TYPEFULLY_CONNECT_TIMEOUT = float(os.getenv('TYPEFULLY_CONNECT_TIMEOUT', '5'))
+TYPEFULLY_READ_TIMEOUT = float(os.getenv('TYPEFULLY_READ_TIMEOUT', '20'))
+TYPEFULLY_MAX_RETRIES = int(os.getenv('TYPEFULLY_MAX_RETRIES', '3'))
+# Maximum number of pooled keep-alive connections to Typefully
+TYPEFULLY_POOL_SIZE = int(os.getenv('TYPEFULLY_POOL_SIZE', '10'))
+TYPEFULLY_REQUESTS_PER_MINUTE = float(os.getenv('TYPEFULLY_REQUESTS_PER_MINUTE', '30'))
 
 # Bot Configuration
 COMMAND_PREFIX = '/'
 
-# List of user IDs that can use admin commands
-ADMIN_IDS = ['your_discord_user_id']  # Replace with your Discord user ID
-
-# Log loaded configuration (without sensitive values)
-logger.info("Configuration loaded:")
-logger.info(f"DISCORD_TOKEN: {'Set' if DISCORD_TOKEN else 'Not set'}")
-
-logger.info(f"ALLOWED_CHANNELS: {ALLOWED_CHANNELS if ALLOWED_CHANNELS else 'Not set (all channels allowed)'}")
-logger.info(f"OPENAI_API_KEY: {'Set' if OPENAI_API_KEY else 'Not set'}")
-logger.info(f"TYPEFULLY_API_KEY: {'Set' if TYPEFULLY_API_KEY else 'Not set'}")
-logger.info(f"COMMAND_PREFIX: {COMMAND_PREFIX}")
-
-# Validate required configuration
-if not DISCORD_TOKEN:
-    raise ValueError("DISCORD_TOKEN is not set in environment variables")
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY is not set in environment variables")
-if not TYPEFULLY_API_KEY:
-    raise ValueError("TYPEFULLY_API_KEY is not set in environment variables")
+# Logging: size-based rotation by default, or time-based when LOG_ROTATE_WHEN
+# is set (e.g. 'midnight'); LOG_FORMAT is 'json' or 'text'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')
+# Fraction of high-volume lines (e.g. every generated tweet) that are logged
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))
+
+# Circuit breakers: consecutive provider failures before failing fast, and
+# seconds before a trial request is let through again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+# Health checks: /healthz fails if the event loop stalls longer than
+# HEALTH_MAX_LOOP_STALL seconds, /readyz if the gateway latency exceeds
+# READY_MAX_LATENCY seconds
+HEALTH_MAX_LOOP_STALL = float(os.getenv('HEALTH_MAX_LOOP_STALL', '10'))
+READY_MAX_LATENCY = float(os.getenv('READY_MAX_LATENCY', '5'))
+
+# /create-batch limits
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+# Estimated OpenAI tokens per minute a single batch may use (0 for no limit);
+# defaults to half of OPENAI_TOKENS_PER_MINUTE, leaving the rest to other commands
+BATCH_TOKENS_PER_MINUTE = float(os.getenv('BATCH_TOKENS_PER_MINUTE') or OPENAI_TOKENS_PER_MINUTE / 2)
+
+# Directory for the bot's SQLite databases (mount a volume here in production)
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+# Preview sessions are kept for SESSION_TTL seconds after their last update
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', os.path.join(DATA_DIR, 'sessions.db'))
+SESSION_TTL = float(os.getenv('SESSION_TTL', str(7 * 24 * 3600)))
+# Number of previous thread versions kept per preview session
+MAX_REVISION_HISTORY = int(os.getenv('MAX_REVISION_HISTORY', '5'))
+# Queue of threads being posted to Typefully: failed attempts that can't have
+# created a draft are retried with backoff; /finalize waits POST_WAIT_TIMEOUT
+# seconds for the draft before promising to DM the link
+POST_QUEUE_DB_PATH = os.getenv('POST_QUEUE_DB_PATH', os.path.join(DATA_DIR, 'posts.db'))
+POST_MAX_ATTEMPTS = int(os.getenv('POST_MAX_ATTEMPTS', '8'))
+POST_RETRY_BASE = float(os.getenv('POST_RETRY_BASE', '5'))
+POST_RETRY_MAX = float(os.getenv('POST_RETRY_MAX', '300'))
+POST_WAIT_TIMEOUT = float(os.getenv('POST_WAIT_TIMEOUT', '10'))
+# /schedule: times without a timezone are in SCHEDULE_TIMEZONE; threads are
+# handed to Typefully SCHEDULE_LEAD seconds before their publish time, and
+# posts due within SCHEDULE_BATCH_WINDOW seconds of each other are sent
+# together. Posts that missed their time publish SCHEDULE_MIN_LEAD seconds
+# after they are handed over.
+SCHEDULE_TIMEZONE = os.getenv('SCHEDULE_TIMEZONE', 'UTC')
+SCHEDULE_LEAD = float(os.getenv('SCHEDULE_LEAD', '300'))
+SCHEDULE_BATCH_WINDOW = float(os.getenv('SCHEDULE_BATCH_WINDOW', '5'))
+SCHEDULE_MIN_LEAD = float(os.getenv('SCHEDULE_MIN_LEAD', '60'))
+# Append-only history of generations, revisions and posts behind /stats
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', os.path.join(DATA_DIR, 'history.db'))
+# Per-guild and per-channel settings (allowed channels, admins, tones, model,
+# rate limit), reloaded when the file changes; checked every
+# GUILD_CONFIG_WATCH_INTERVAL seconds (0 reloads only on /reload-config)
+GUILD_CONFIG_PATH = os.getenv('GUILD_CONFIG_PATH', os.path.join(DATA_DIR, 'guild_config.json'))
+GUILD_CONFIG_WATCH_INTERVAL = float(os.getenv('GUILD_CONFIG_WATCH_INTERVAL', '5'))
+# Hash of the last synced command tree; commands are only synced when it changes
+COMMAND_SYNC_STATE_PATH = os.getenv('COMMAND_SYNC_STATE_PATH', os.path.join(DATA_DIR, 'command_sync.json'))
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', 'false').lower() in ('1', 'true', 'yes')
+
+# Approved threads are archived here and the THREAD_EXAMPLES most similar
+# ones of the same tone (at least THREAD_EXAMPLE_MIN_SIMILARITY cosine
+# similarity) are added to generation prompts; 0 disables the examples
+THREAD_INDEX_DIR = os.getenv('THREAD_INDEX_DIR', os.path.join(DATA_DIR, 'thread_index'))
+THREAD_EXAMPLES = int(os.getenv('THREAD_EXAMPLES', '3'))
+THREAD_EXAMPLE_MIN_SIMILARITY = float(os.getenv('THREAD_EXAMPLE_MIN_SIMILARITY', '0.25'))
+
+# Maximum number of alternative drafts /create can generate at once
+MAX_VARIANTS = int(os.getenv('MAX_VARIANTS', '3'))
+
+# Stream tweets into the /create preview as they are generated
+STREAM_PREVIEWS = os.getenv('STREAM_PREVIEWS', 'true').lower() in ('1', 'true', 'yes')
+# Minimum number of seconds between edits of a streaming preview
+PREVIEW_EDIT_INTERVAL = float(os.getenv('PREVIEW_EDIT_INTERVAL', '1.0'))
+
+# Comma-separated Discord user IDs that can use admin commands in every guild
+ADMIN_IDS = [int(user_id.strip()) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()]
+
+def validate():
+    """
+    Check the required settings and log the loaded configuration
+
+    Called at startup rather than on import, so tools like the benchmark
+    can import the bot's modules without real credentials.
+
+    Raises:
+        ValueError: If a required setting is missing
+    """
+    # Log loaded configuration (without sensitive values)
+    logger.info("Configuration loaded:")
+    logger.info(f"DISCORD_TOKEN: {'Set' if DISCORD_TOKEN else 'Not set'}")
+
+    logger.info(f"ALLOWED_CHANNELS: {ALLOWED_CHANNELS if ALLOWED_CHANNELS else 'Not set (all channels allowed)'}")
+    logger.info(f"ADMIN_IDS: {ADMIN_IDS if ADMIN_IDS else 'Not set (guild configuration only)'}")
+    logger.info(f"GUILD_CONFIG_PATH: {GUILD_CONFIG_PATH}")
+    logger.info(f"DISCORD_GUILD_ID: {DISCORD_GUILD_ID or 'Not set (global commands)'}")
+    logger.info(f"DISCORD_SHARD_COUNT: {DISCORD_SHARD_COUNT or 'Not set (single connection)'}")
+    logger.info(f"GENERATION_WORKERS: {GENERATION_WORKERS or 'Not set (in process)'}")
+    logger.info(f"OPENAI_API_KEY: {'Set' if OPENAI_API_KEY else 'Not set'}")
+    logger.info(f"OPENAI_MAX_CONCURRENCY: {OPENAI_MAX_CONCURRENCY}")
+    logger.info(f"OPENAI_MODEL: {OPENAI_MODEL} (fallback: {', '.join(OPENAI_FALLBACK_MODELS) or 'none'})")
+    logger.info(f"OPENAI_ROUTES: {'Set' if OPENAI_ROUTES else 'Not set (built-in routes)'}")
+    logger.info(f"RESPONSE_CACHE_PATH: {RESPONSE_CACHE_PATH or 'Not set (memory only)'}")
+    logger.info(f"TYPEFULLY_API_KEY: {'Set' if TYPEFULLY_API_KEY else 'Not set'}")
+    logger.info(f"COMMAND_PREFIX: {COMMAND_PREFIX}")
+    logger.info(f"DATA_DIR: {DATA_DIR}")
+    logger.info(f"STREAM_PREVIEWS: {STREAM_PREVIEWS}")
+    logger.info(f"SCHEDULE_TIMEZONE: {SCHEDULE_TIMEZONE}")
+
+    # Validate required configuration
+    if not DISCORD_TOKEN:
+        raise ValueError("DISCORD_TOKEN is not set in environment variables")
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY is not set in environment variables")
+    if not TYPEFULLY_API_KEY:
+        raise ValueError("TYPEFULLY_API_KEY is not set in environment variables")
+    if _DISCORD_GUILD_ID and DISCORD_GUILD_ID is None:
+        raise ValueError(f"DISCORD_GUILD_ID must be a numeric server ID, got {_DISCORD_GUILD_ID!r}")
+    if DISCORD_SHARD_COUNT and DISCORD_SHARD_COUNT != 'auto' and not DISCORD_SHARD_COUNT.isdigit():
+        raise ValueError("DISCORD_SHARD_COUNT must be 'auto' or a number")
+    if DISCORD_SHARD_IDS and not DISCORD_SHARD_COUNT.isdigit():
+        raise ValueError("DISCORD_SHARD_IDS requires a numeric DISCORD_SHARD_COUNT")
+    if BATCH_TOKENS_PER_MINUTE > OPENAI_TOKENS_PER_MINUTE:
+        logger.warning(
+            f"BATCH_TOKENS_PER_MINUTE ({BATCH_TOKENS_PER_MINUTE:g}) exceeds OPENAI_TOKENS_PER_MINUTE "
+            f"({OPENAI_TOKENS_PER_MINUTE:g}); batches will wait on the OpenAI limit instead"
+        )
+    if tz.gettz(SCHEDULE_TIMEZONE) is None:
+        raise ValueError(f"Unknown SCHEDULE_TIMEZONE {SCHEDULE_TIMEZONE!r}")
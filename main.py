@@ -1,35 +1,162 @@
+import time
+
+# Taken before the other imports so the startup report includes them
+IMPORT_STARTED = time.perf_counter()
+
 import logging
 import discord
 from discord import app_commands
-from typing import Optional
+from typing import Dict, List, Optional
 import config
+from openai import RateLimitError
 from services.tweet_generator import TweetGenerator
-from services.scheduler import TweetScheduler
+from services.generation_pool import GenerationError, GenerationPool
+from services.scheduler import TweetScheduler, parse_publish_time
+from services.session_store import SessionStore
+from services.post_queue import PostQueue, PostWorker
+from services.batch import parse_batch_file, run_batch
+from services.deadline import Deadline, DeadlineExceeded
+from services.guild_config import ChannelSettings, GuildConfigStore
+from services.history import LATENCY_BUCKETS, MAX_STATS_DAYS
+from services.tokens import load_tokenizers
+from services.tweet_validator import MAX_WEIGHTED_LENGTH, format_warnings, validate_thread
+from services import metrics
+from services.logging_setup import setup_logging, set_correlation_id
 from aiohttp import web
+from datetime import datetime, timezone
+from dateutil import tz
 import asyncio
+import hashlib
+import json
+import math
 import os
+import re
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def build_preview_embed(
+    tweets: List[str],
+    title: str,
+    description: str,
+    color: discord.Color,
+    request: Optional[Dict] = None
+) -> discord.Embed:
+    """
+    Build the embed showing a thread preview
+
+    If the request is given the thread is validated against it and any
+    problems are listed below the tweets.
+    """
+    embed = discord.Embed(title=title, description=description, color=color)
+    report = validate_thread(tweets, request) if request is not None else None
+    for i, tweet in enumerate(tweets, 1):
+        name = f"Tweet {i}"
+        if report and i in report['overlong']:
+            name += f" ⚠️ {report['lengths'][i - 1]}/{MAX_WEIGHTED_LENGTH}"
+        embed.add_field(name=name, value=tweet, inline=False)
+    warnings = format_warnings(report) if report else []
+    if warnings:
+        embed.add_field(name="⚠️ Checks", value="\n".join(warnings)[:1024], inline=False)
+    return embed
+
+class PreviewUpdater:
+    """
+    Progressively edits a preview message while tweets are streamed in.
+
+    Updates are coalesced so the message is edited at most once per
+    PREVIEW_EDIT_INTERVAL seconds, keeping us well inside Discord's rate
+    limits for message edits. Callers never wait on an edit in flight.
+    """
+
+    def __init__(self, interaction: discord.Interaction, expected: int):
+        self.interaction = interaction
+        self.expected = expected
+        self.message = None
+        self.tweets: List[str] = []
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sending: Optional[asyncio.Future] = None
+        self._last_edit = 0.0
+
+    def _embed(self) -> discord.Embed:
+        return build_preview_embed(
+            self.tweets,
+            title="Tweet Thread Preview",
+            description=f"✍️ Writing your thread... ({len(self.tweets)}/{self.expected} tweets)",
+            color=discord.Color.light_grey()
+        )
+
+    def update(self, tweets: List[str]):
+        """Record the latest tweets; the message is edited in the background"""
+        self.tweets = list(tweets)
+        self._dirty.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._dirty.wait()
+            wait = self._last_edit + config.PREVIEW_EDIT_INTERVAL - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._dirty.clear()
+            # Shield the request so stopping the updater never aborts an edit
+            # half way, which could leave a sent message we don't know about
+            self._sending = asyncio.ensure_future(self._send(self._embed()))
+            await asyncio.shield(self._sending)
+            self._last_edit = loop.time()
+
+    async def _send(self, embed: discord.Embed):
+        try:
+            with metrics.DISCORD_SEND_SECONDS.labels('preview_update').time():
+                if self.message is None:
+                    # The preview replaces the "thinking..." (or queue position) response
+                    self.message = await self.interaction.edit_original_response(content=None, embed=embed)
+                else:
+                    await self.message.edit(embed=embed)
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to update streaming preview: {str(e)}")
+
+    async def stop(self):
+        """Stop progressive updates, waiting for an edit in flight"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._sending is not None and not self._sending.done():
+            await self._sending
+
+    async def finish(self, embed: discord.Embed, view: discord.ui.View):
+        """Stop progressive updates and show the final preview"""
+        await self.stop()
+        with metrics.DISCORD_SEND_SECONDS.labels('preview').time():
+            if self.message is None:
+                self.message = await self.interaction.edit_original_response(content=None, embed=embed, view=view)
+            else:
+                await self.message.edit(embed=embed, view=view)
+        return self.message
+
+def queue_notifier(interaction: discord.Interaction):
+    """Show the user's position in the rate limit queue in the deferred response"""
+    async def notify(position: int):
+        await interaction.edit_original_response(
+            content=f"⏳ Lots of requests right now - you're #{position} in the queue. Your draft will appear here."
+        )
+    return notify
+
 def check_channel():
-    """Decorator to check if command is used in the allowed channels"""
+    """Decorator to check if command is used in the channels allowed for its guild"""
     async def predicate(interaction: discord.Interaction) -> bool:
-        if not config.ALLOWED_CHANNELS:
-            # If no channels are set, allow the command everywhere
-            return True
-            
-        if interaction.channel_id not in config.ALLOWED_CHANNELS:
+        settings = interaction.client.guild_config.settings(interaction.guild_id, interaction.channel_id)
+        # Commands read the settings from here rather than resolving them again
+        interaction.extras['settings'] = settings
+        if not settings.allows(interaction.channel_id):
             # Format the channel mentions
-            allowed_channels = ', '.join(f'<#{channel_id}>' for channel_id in config.ALLOWED_CHANNELS)
+            allowed_channels = ', '.join(f'<#{channel_id}>' for channel_id in sorted(settings.allowed_channels))
             logger.info(
                 f"Command attempted in unauthorized channel {interaction.channel_id} "
                 f"by user {interaction.user} (ID: {interaction.user.id})"
@@ -42,19 +169,78 @@ def check_channel():
         return True
     return app_commands.check(predicate)
 
+def channel_settings(interaction: discord.Interaction) -> ChannelSettings:
+    """The settings check_channel resolved for the interaction, or resolved now"""
+    settings = interaction.extras.get('settings')
+    if settings is None:
+        settings = interaction.client.guild_config.settings(interaction.guild_id, interaction.channel_id)
+    return settings
+
+async def tone_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    """Suggest the tones of the channel, including its guild's custom tones"""
+    current = current.strip().lower()
+    tones = channel_settings(interaction).tone_names
+    return [app_commands.Choice(name=tone.capitalize(), value=tone) for tone in tones if current in tone][:25]
+
+def apply_settings(request: Dict, settings: ChannelSettings) -> Dict:
+    """Add the custom tone prompt and model of a channel to a generation request"""
+    tone_prompt = settings.tone_prompt(request['tone'])
+    if tone_prompt is not None:
+        request['tone_prompt'] = tone_prompt
+    if settings.model:
+        request['model'] = settings.model
+    return request
+
+def command_tree_hash(tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake]) -> str:
+    """Hash the payload a sync of the tree for guild (None for global) would send"""
+    payload = [command.to_dict() for command in tree.get_commands(guild=guild)]
+    payload.sort(key=lambda command: (command.get('type', 1), command['name']))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_command_sync_state() -> Dict[str, str]:
+    try:
+        with open(config.COMMAND_SYNC_STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_command_sync_state(state: Dict[str, str]):
+    directory = os.path.dirname(config.COMMAND_SYNC_STATE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{config.COMMAND_SYNC_STATE_PATH}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(state, f)
+    os.replace(temporary, config.COMMAND_SYNC_STATE_PATH)
+
+def is_rate_limited(error: BaseException) -> bool:
+    """Whether error is OpenAI rate limiting us, in this process or a generation worker"""
+    if isinstance(error, GenerationError):
+        return error.type_name == RateLimitError.__name__
+    return isinstance(error, RateLimitError)
+
 class TweetBot(discord.Client):
-    def __init__(self):
+    def __init__(self, startup: Optional[metrics.StartupTimer] = None, **options):
         # Set up all required intents
         intents = discord.Intents.default()
         intents.message_content = True
         intents.messages = True
         intents.guild_messages = True
         intents.guilds = True
-        super().__init__(intents=intents)
+        super().__init__(intents=intents, **options)
+        self.startup = startup or metrics.StartupTimer()
         
         self.tree = app_commands.CommandTree(self)
         self.tweet_generator = TweetGenerator()
+        # Generation runs in worker processes when GENERATION_WORKERS is set,
+        # leaving this process to handle Discord interactions
+        self.generation = (
+            GenerationPool(config.GENERATION_WORKERS, self.tweet_generator)
+            if config.GENERATION_WORKERS > 0 else self.tweet_generator
+        )
         self.scheduler = TweetScheduler()
+        # Per-guild settings, swapped in whole when the file changes
+        self.guild_config = GuildConfigStore(config.GUILD_CONFIG_PATH, config.GUILD_CONFIG_WATCH_INTERVAL)
         
         # Set up error handler for the command tree
         self.tree.on_error = self.on_tree_error
@@ -62,11 +248,30 @@ class TweetBot(discord.Client):
         # Add web app
         self.web_app = web.Application()
         self.web_app.router.add_get('/', self.handle_healthcheck)
+        self.web_app.router.add_get('/healthz', self.handle_healthcheck)
+        self.web_app.router.add_get('/readyz', self.handle_readiness)
+        self.web_app.router.add_get('/metrics', self.handle_metrics)
+        self.loop_monitor = metrics.LoopMonitor()
         
+        # Preview sessions survive restarts so their buttons keep working
+        self.sessions = SessionStore(config.SESSION_DB_PATH)
+        # Finalized threads are posted to Typefully from a persistent queue
+        self.post_queue = PostQueue(config.POST_QUEUE_DB_PATH)
+        self.post_worker = PostWorker(
+            self.post_queue,
+            self.scheduler,
+            self.on_post_done,
+            max_attempts=config.POST_MAX_ATTEMPTS,
+            retry_base=config.POST_RETRY_BASE,
+            retry_max=config.POST_RETRY_MAX,
+            batch_window=config.SCHEDULE_BATCH_WINDOW
+        )
+        self.register_metrics()
+
         # Register commands
         self.setup_commands()
+        self.startup.mark('init')
         logger.info("TweetBot initialized")
-        self.active_previews = {}  # Store active preview sessions
 
     def setup_commands(self):
         """Setup all bot commands"""
@@ -74,6 +279,8 @@ class TweetBot(discord.Client):
         @self.tree.command(name="ping", description="Test if the bot is working")
         @check_channel()
         async def ping(interaction: discord.Interaction):
+            set_correlation_id(interaction.id)
+            metrics.COMMANDS.labels('ping').inc()
             await interaction.response.send_message("Pong! 🏓")
 
         @self.tree.command(
@@ -84,16 +291,14 @@ class TweetBot(discord.Client):
             main="TLDR of what to introduce (partnership, sponsorship, etc.)",
             context="Special requirements, information dump, or partner intro",
             keywords="Key words that must be mentioned (comma-separated)",
-            tone="The tone of the tweets",
+            tone="Optional: The tone of the tweets (defaults to the channel's tone)",
             tag="Optional: X accounts to be mentioned (comma-separated)",
             length="Number of tweets in thread (use 1 for single tweet)",
-            link="Optional: Link to be included in the thread"
+            link="Optional: Link to be included in the thread",
+            regenerate="Optional: Skip cached drafts and always write a fresh one",
+            variants="Optional: Number of alternative drafts to choose from"
         )
-        @app_commands.choices(tone=[
-            app_commands.Choice(name="Normal", value="normal"),
-            app_commands.Choice(name="Intern", value="intern"),
-            app_commands.Choice(name="Marketing", value="marketing")
-        ])
+        @app_commands.autocomplete(tone=tone_autocomplete)
         @check_channel()
         async def create(
             interaction: discord.Interaction,
@@ -101,10 +306,15 @@ class TweetBot(discord.Client):
             context: str,
             keywords: str,
             length: int,
-            tone: app_commands.Choice[str],
+            tone: Optional[str] = None,
             tag: Optional[str] = None,
-            link: Optional[str] = None
+            link: Optional[str] = None,
+            regenerate: bool = False,
+            variants: int = 1
         ):
+            set_correlation_id(interaction.id)
+            metrics.COMMANDS.labels('create').inc()
+            updater = None
             try:
                 # Validate inputs
                 if not main or not context or not keywords:
@@ -121,95 +331,549 @@ class TweetBot(discord.Client):
                     )
                     return
 
+                if variants < 1 or variants > config.MAX_VARIANTS:
+                    await interaction.response.send_message(
+                        f"❌ You can ask for between 1 and {config.MAX_VARIANTS} variants.",
+                        ephemeral=True
+                    )
+                    return
+
+                settings = channel_settings(interaction)
+                tone = (tone or settings.default_tone).strip().lower()
+                if tone not in settings.tone_names:
+                    await interaction.response.send_message(
+                        f"❌ Unknown tone. Choose one of: {', '.join(settings.tone_names)}.",
+                        ephemeral=True
+                    )
+                    return
+
+                if not self.guild_config.allow_threads(interaction.guild_id, settings):
+                    await interaction.response.send_message(
+                        f"❌ This server can create {settings.threads_per_minute:g} threads per minute. "
+                        "Please try again shortly.",
+                        ephemeral=True
+                    )
+                    return
+
                 await interaction.response.defer(thinking=True)
                 logger.info(f"Received /create command from {interaction.user} (ID: {interaction.user.id})")
-                logger.info(f"Parameters: main='{main}', keywords='{keywords}', length={length}, tone={tone.value}, tag={tag}, link={link}")
+                logger.debug(f"Parameters: main='{main}', keywords='{keywords}', length={length}, tone={tone}, tag={tag}, link={link}")
 
                 # Prepare request data
-                request = {
+                request = apply_settings({
                     'main': main,
                     'context': context,
                     'keywords': [k.strip() for k in keywords.split(',')],
                     'tags': [t.strip() for t in tag.split(',')] if tag else [],
                     'length': length,
-                    'tone': tone.value,
+                    'tone': tone,
                     'link': link
-                }
+                }, settings)
+
+                # Everything has to be done while the interaction can still be answered
+                deadline = Deadline.for_interaction(interaction, config.INTERACTION_DEADLINE)
 
-                # Generate tweets
-                tweets = self.tweet_generator.generate_thread(request)
+                # Generate tweets; alternatives come from a single request
+                drafts = None
+                description = "Here's your draft tweet thread. Use the buttons below to provide feedback or finalize."
+                if variants > 1:
+                    drafts = await self.generation.generate_variants(
+                        request,
+                        variants,
+                        regenerate=regenerate,
+                        user_id=interaction.user.id,
+                        on_queued=queue_notifier(interaction),
+                        deadline=deadline
+                    )
+                    tweets = drafts[0]
+                elif config.STREAM_PREVIEWS and self.generation is self.tweet_generator:
+                    updater = PreviewUpdater(interaction, expected=length)
+                    tweets = []
+
+                    async def consume():
+                        async for index, tweet in self.tweet_generator.stream_thread(
+                            request,
+                            regenerate=regenerate,
+                            user_id=interaction.user.id,
+                            on_queued=queue_notifier(interaction),
+                            deadline=deadline
+                        ):
+                            if index < len(tweets):
+                                tweets[index] = tweet
+                            else:
+                                tweets.append(tweet)
+                            updater.update(tweets)
+
+                    try:
+                        await deadline.run(consume())
+                    except DeadlineExceeded:
+                        if not tweets:
+                            raise
+                        # Better a partial thread the user can revise than nothing
+                        logger.warning(f"Deadline passed after {len(tweets)} of {length} tweets")
+                        description = (
+                            f"⏱️ Generation ran out of time after {len(tweets)} of {length} tweets. "
+                            "Use the buttons below to provide feedback or finalize."
+                        )
+                else:
+                    tweets = await self.generation.generate_thread(
+                        request,
+                        regenerate=regenerate,
+                        user_id=interaction.user.id,
+                        on_queued=queue_notifier(interaction),
+                        deadline=deadline
+                    )
                 logger.info(f"Generated {len(tweets)} tweets successfully")
 
                 # Create preview embed
-                preview = discord.Embed(
-                    title="Tweet Thread Preview",
-                    description="Here's your draft tweet thread. Use the buttons below to provide feedback or finalize.",
-                    color=discord.Color.blue()
+                preview = build_preview_embed(
+                    tweets,
+                    title=preview_title(0, len(drafts or [tweets])),
+                    description=description,
+                    color=discord.Color.blue(),
+                    request=request
                 )
 
-                # Add tweets to preview
-                for i, tweet in enumerate(tweets, 1):
-                    preview.add_field(
-                        name=f"Tweet {i}",
-                        value=tweet,
-                        inline=False
+                # Create buttons view
+                view = preview_view(variants=len(drafts or [tweets]))
+
+                if updater is not None:
+                    message = await updater.finish(preview, view)
+                else:
+                    with metrics.DISCORD_SEND_SECONDS.labels('preview').time():
+                        message = await interaction.edit_original_response(content=None, embed=preview, view=view)
+
+                data = {'tweets': tweets, 'request': request}
+                if drafts is not None and len(drafts) > 1:
+                    data.update(variants=drafts, variant=0)
+                await self.sessions.save(message.id, interaction.user.id, interaction.channel_id, data)
+
+            except Exception as e:
+                logger.error(f"Error in /create command: {str(e)}", exc_info=True)
+                metrics.record_error('create', e)
+                if updater is not None:
+                    await updater.stop()
+                error_embed = discord.Embed(
+                    title="Error",
+                    description=(
+                        "OpenAI is rate limiting us right now. Please try again in a minute."
+                        if is_rate_limited(e)
+                        else "OpenAI is too slow right now. Please try again in a few minutes."
+                        if isinstance(e, DeadlineExceeded)
+                        else "Failed to create tweet draft. Please try again."
+                    ),
+                    color=discord.Color.red()
+                )
+                
+                if not interaction.response.is_done():
+                    await interaction.response.send_message(embed=error_embed, ephemeral=True)
+                else:
+                    await interaction.followup.send(embed=error_embed, ephemeral=True)
+
+        @self.tree.command(
+            name="create-batch",
+            description="Create many tweet or thread drafts from a CSV or JSON file"
+        )
+        @app_commands.describe(
+            file="CSV (with header row) or JSON list using the /create fields: main, context, keywords, length, tone, tag, link",
+            tone="Tone for rows that don't specify one (defaults to the channel's tone)"
+        )
+        @app_commands.autocomplete(tone=tone_autocomplete)
+        @check_channel()
+        async def create_batch(
+            interaction: discord.Interaction,
+            file: discord.Attachment,
+            tone: Optional[str] = None
+        ):
+            set_correlation_id(interaction.id)
+            metrics.COMMANDS.labels('create-batch').inc()
+            try:
+                if not file.filename.lower().endswith(('.csv', '.json')):
+                    await interaction.response.send_message(
+                        "❌ Please attach a `.csv` or `.json` file.",
+                        ephemeral=True
                     )
+                    return
 
-                # Create buttons view
-                view = TweetPreviewView(
-                    tweets=tweets,
-                    request=request,
+                settings = channel_settings(interaction)
+                tone = (tone or settings.default_tone).strip().lower()
+                if tone not in settings.tone_names:
+                    await interaction.response.send_message(
+                        f"❌ Unknown tone. Choose one of: {', '.join(settings.tone_names)}.",
+                        ephemeral=True
+                    )
+                    return
+
+                await interaction.response.defer(thinking=True)
+                logger.info(f"Received /create-batch command from {interaction.user} (ID: {interaction.user.id}) with {file.filename}")
+
+                try:
+                    requests, errors = parse_batch_file(
+                        await file.read(),
+                        file.filename,
+                        default_tone=tone,
+                        tones=settings.tone_names
+                    )
+                except (ValueError, UnicodeDecodeError) as e:
+                    await interaction.followup.send(f"❌ Could not read {file.filename}: {str(e)}", ephemeral=True)
+                    return
+
+                if not requests:
+                    details = "\n".join(errors[:10])
+                    await interaction.followup.send(f"❌ No valid rows found in {file.filename}.\n{details}", ephemeral=True)
+                    return
+
+                if len(requests) > config.BATCH_MAX_ITEMS:
+                    await interaction.followup.send(
+                        f"❌ A batch can contain at most {config.BATCH_MAX_ITEMS} threads ({len(requests)} given).",
+                        ephemeral=True
+                    )
+                    return
+
+                if not self.guild_config.allow_threads(interaction.guild_id, settings, len(requests)):
+                    await interaction.followup.send(
+                        f"❌ This server can create {settings.threads_per_minute:g} threads per minute. "
+                        "Please try again shortly or split the batch.",
+                        ephemeral=True
+                    )
+                    return
+                for request in requests:
+                    apply_settings(request, settings)
+
+                await interaction.followup.send(
+                    f"⏳ Generating {len(requests)} threads from {file.filename}; previews will appear as they complete."
+                )
+
+                async def post_preview(index, request, tweets, error):
+                    if error is not None:
+                        return
+                    preview = build_preview_embed(
+                        tweets,
+                        title=f"Tweet Thread Preview ({index}/{len(requests)})",
+                        description=f"**{request['main']}**\nUse the buttons below to provide feedback or finalize.",
+                        color=discord.Color.blue(),
+                        request=request
+                    )
+                    with metrics.DISCORD_SEND_SECONDS.labels('preview').time():
+                        message = await interaction.followup.send(embed=preview, view=preview_view(), wait=True)
+                    await self.sessions.save(
+                        message.id,
+                        interaction.user.id,
+                        interaction.channel_id,
+                        {'tweets': tweets, 'request': request}
+                    )
+
+                summary = await run_batch(
+                    self.generation,
+                    requests,
+                    post_preview,
+                    concurrency=config.BATCH_CONCURRENCY,
+                    tokens_per_minute=config.BATCH_TOKENS_PER_MINUTE or None,
                     user_id=interaction.user.id,
-                    tweet_generator=self.tweet_generator,
-                    scheduler=self.scheduler
+                    deadline=Deadline.for_interaction(interaction, config.INTERACTION_DEADLINE)
                 )
 
-                await interaction.followup.send(embed=preview, view=view)
+                summary_embed = discord.Embed(
+                    title="Batch Complete",
+                    description=(
+                        f"✅ {summary['succeeded']} succeeded, ❌ {summary['failed']} failed "
+                        f"in {summary['elapsed']:.1f}s ({summary['per_minute']:.1f} threads/min)"
+                    ),
+                    color=discord.Color.green() if not summary['failed'] else discord.Color.orange()
+                )
+                problems = summary['failures'] + errors
+                if problems:
+                    summary_embed.add_field(
+                        name="Problems",
+                        value="\n".join(problems)[:1024],
+                        inline=False
+                    )
+                await interaction.followup.send(embed=summary_embed)
 
             except Exception as e:
-                logger.error(f"Error in /create command: {str(e)}", exc_info=True)
+                logger.error(f"Error in /create-batch command: {str(e)}", exc_info=True)
+                metrics.record_error('create-batch', e)
                 error_embed = discord.Embed(
                     title="Error",
-                    description="Failed to create tweet draft. Please try again.",
+                    description="Failed to process the batch. Please try again.",
                     color=discord.Color.red()
                 )
-                
+
                 if not interaction.response.is_done():
                     await interaction.response.send_message(embed=error_embed, ephemeral=True)
                 else:
                     await interaction.followup.send(embed=error_embed, ephemeral=True)
 
+        @self.tree.command(
+            name="schedule",
+            description="Schedule a previewed thread to be published at a given time"
+        )
+        @app_commands.describe(
+            when="e.g. 2025-03-01 14:00, Mar 1 2pm or in 2h; in the bot's timezone unless you add one",
+            preview="Link or ID of the preview message; defaults to your latest open preview"
+        )
+        @check_channel()
+        async def schedule(interaction: discord.Interaction, when: str, preview: Optional[str] = None):
+            set_correlation_id(interaction.id)
+            metrics.COMMANDS.labels('schedule').inc()
+            try:
+                try:
+                    publish_at = parse_publish_time(
+                        when, datetime.now(timezone.utc), tz.gettz(config.SCHEDULE_TIMEZONE)
+                    )
+                except ValueError as e:
+                    await interaction.response.send_message(
+                        f"❌ {str(e)}. Try e.g. `2025-03-01 14:00`, `Mar 1 2pm` or `in 2h`.",
+                        ephemeral=True
+                    )
+                    return
+
+                if preview:
+                    message_id = parse_message_id(preview)
+                    session = await self.sessions.get(message_id) if message_id else None
+                else:
+                    session = await self.sessions.latest_for_user(interaction.user.id)
+                if session is None or session['user_id'] != interaction.user.id:
+                    await interaction.response.send_message(
+                        "❌ I couldn't find a preview of yours to schedule. Use /create to draft a thread first.",
+                        ephemeral=True
+                    )
+                    return
+                if session['status'] not in ('open', 'scheduled'):
+                    await interaction.response.send_message(
+                        "❌ This thread has already been finalized.",
+                        ephemeral=True
+                    )
+                    return
+
+                await interaction.response.defer(ephemeral=True)
+                logger.info(
+                    f"Scheduling preview {session['message_id']} for {publish_at.isoformat()} "
+                    f"for {interaction.user} (ID: {interaction.user.id})"
+                )
+                # Scheduling again moves the pending job to the new time
+                job, _ = await self.post_queue.enqueue(
+                    session['message_id'],
+                    interaction.user.id,
+                    session['channel_id'],
+                    session['tweets'],
+                    publish_at=publish_at.timestamp(),
+                    lead=config.SCHEDULE_LEAD
+                )
+                await self.sessions.set_status(session['message_id'], 'scheduled')
+                if self.is_primary:
+                    self.post_worker.add(job)
+
+                timestamp = int(publish_at.timestamp())
+                await interaction.followup.send(
+                    f"🗓️ Your thread will be published <t:{timestamp}:F> (<t:{timestamp}:R>). "
+                    "I'll send you the Typefully link once it's scheduled there.",
+                    ephemeral=True
+                )
+
+            except Exception as e:
+                logger.error(f"Error in /schedule command: {str(e)}", exc_info=True)
+                metrics.record_error('schedule', e)
+                message = "Failed to schedule the thread. Please try again."
+                if not interaction.response.is_done():
+                    await interaction.response.send_message(message, ephemeral=True)
+                else:
+                    await interaction.followup.send(message, ephemeral=True)
+
+        @self.tree.command(name="stats", description="Show generation usage, latency and token spend")
+        @app_commands.describe(days=f"Number of days to cover, up to {MAX_STATS_DAYS} (default 7)")
+        @check_channel()
+        async def stats(interaction: discord.Interaction, days: int = 7):
+            set_correlation_id(interaction.id)
+            metrics.COMMANDS.labels('stats').inc()
+            if days < 1 or days > MAX_STATS_DAYS:
+                await interaction.response.send_message(
+                    f"❌ Days must be between 1 and {MAX_STATS_DAYS}.",
+                    ephemeral=True
+                )
+                return
+            try:
+                usage = await self.tweet_generator.history.stats(days)
+                await interaction.response.send_message(embed=build_stats_embed(usage, days), ephemeral=True)
+            except Exception as e:
+                logger.error(f"Error in /stats command: {str(e)}", exc_info=True)
+                metrics.record_error('stats', e)
+                await interaction.response.send_message("Failed to load the stats. Please try again.", ephemeral=True)
+
+        @self.tree.command(name="reload-config", description="Admin: reload the per-guild settings file")
+        async def reload_config(interaction: discord.Interaction):
+            set_correlation_id(interaction.id)
+            metrics.COMMANDS.labels('reload-config').inc()
+            if not channel_settings(interaction).is_admin(interaction.user.id):
+                await interaction.response.send_message("❌ Only bot admins can reload the settings.", ephemeral=True)
+                return
+            try:
+                guild_config = await self.guild_config.reload()
+            except ValueError as e:
+                await interaction.response.send_message(
+                    f"❌ Kept the current settings, {os.path.basename(self.guild_config.path)} is invalid: {str(e)}",
+                    ephemeral=True
+                )
+                return
+            logger.info(f"Guild configuration reloaded by {interaction.user} (ID: {interaction.user.id})")
+            await interaction.response.send_message(
+                f"✅ Reloaded the settings of {guild_config.guilds} server(s).",
+                ephemeral=True
+            )
+
     async def setup_hook(self):
-        """Register commands globally"""
-        logger.info("Registering commands...")
-        
+        """Attach the persistent views and background tasks, then sync commands"""
+        self.startup.mark('login')
+        # Route button clicks on every preview message, including those sent
+        # before a restart, to a single stateless view
+        self.add_view(TweetPreviewView())
+        asyncio.create_task(self.prune_sessions())
+        self.guild_config.start()
+        if self.generation is not self.tweet_generator:
+            self.generation.start()
+        # Read the tokenizer vocabularies before the first command counts tokens
+        await asyncio.get_running_loop().run_in_executor(
+            None, load_tokenizers, self.tweet_generator.router.models
+        )
+        self.startup.mark('tokenizers')
+        # With the shards split across processes, the process running shard 0
+        # posts the queued threads and syncs the commands for all of them
+        if self.is_primary:
+            self.post_worker.start()
+            try:
+                await self.sync_commands()
+            except Exception as e:
+                logger.error(f"Failed to register commands: {str(e)}", exc_info=True)
+        self.startup.mark('command sync')
+
+    @property
+    def is_primary(self) -> bool:
+        """Whether this process runs shard 0, or the bot isn't sharded"""
+        shard_ids = getattr(self, 'shard_ids', None)
+        if shard_ids is None:
+            return self.shard_id in (None, 0)
+        return 0 in shard_ids
+
+    async def sync_commands(self):
+        """
+        Sync the command tree with Discord if it changed since the last sync
+
+        Commands are registered for DISCORD_GUILD_ID when set, which takes
+        effect immediately, and globally otherwise. The hash of the last
+        synced tree is kept in COMMAND_SYNC_STATE_PATH so a restart with
+        unchanged commands skips the slow, rate limited sync.
+        """
+        guild = discord.Object(id=config.DISCORD_GUILD_ID) if config.DISCORD_GUILD_ID else None
+        if guild is not None:
+            self.tree.copy_global_to(guild=guild)
+
+        scope = f"{self.application_id}:{config.DISCORD_GUILD_ID or 'global'}"
+        digest = command_tree_hash(self.tree, guild)
+        state = load_command_sync_state()
+        if state.get(scope) == digest and not config.FORCE_COMMAND_SYNC:
+            logger.info(f"Commands unchanged, skipping sync ({scope})")
+            return
+
+        logger.info(f"Syncing commands ({scope})...")
+        await self.tree.sync(guild=guild)
+        state[scope] = digest
+        save_command_sync_state(state)
+        if guild is not None:
+            logger.info(f"Commands registered for guild ID: {config.DISCORD_GUILD_ID}")
+        else:
+            logger.info("Commands registered globally")
+
+    async def prune_sessions(self):
+        """Periodically delete preview sessions and finished post jobs older than SESSION_TTL"""
+        while not self.is_closed():
+            try:
+                await self.sessions.prune(config.SESSION_TTL)
+                await self.post_queue.prune(config.SESSION_TTL)
+            except Exception as e:
+                logger.error(f"Failed to prune preview sessions: {str(e)}", exc_info=True)
+            await asyncio.sleep(3600)
+
+    async def close(self):
+        """Release pooled HTTP connections before shutting down"""
+        self.loop_monitor.stop()
+        await self.guild_config.stop()
+        await self.post_worker.stop()
+        self.post_queue.close()
+        await self.scheduler.close()
+        if self.generation is not self.tweet_generator:
+            self.generation.close()
+        self.tweet_generator.cache.close()
+        self.tweet_generator.thread_index.close()
+        self.tweet_generator.history.close()
+        self.sessions.close()
+        await super().close()
+
+    async def finish_post(self, job: Dict):
+        """Update the preview session once its post job has finished, record it and archive posted threads"""
+        status = 'finalized' if job['status'] == 'done' else 'open'
+        await self.sessions.set_status(job['message_id'], status)
         try:
-            # Clear the commands first
-            self.tree.clear_commands(guild=None)
-            
-            # Register commands
-            self.setup_commands()
-            
-            if hasattr(config, 'DISCORD_GUILD_ID'):
-                guild = discord.Object(id=int(config.DISCORD_GUILD_ID))
-                self.tree.copy_global_to(guild=guild)
-                await self.tree.sync(guild=guild)
-                logger.info(f"Commands registered for guild ID: {config.DISCORD_GUILD_ID}")
-            else:
-                await self.tree.sync()
-                logger.info("Commands registered globally")
+            session = await self.sessions.get(job['message_id'])
+            request = session['request'] if session is not None else {}
+            posted = job['status'] == 'done'
+            self.tweet_generator.history.record(
+                'post',
+                job['user_id'],
+                request.get('tone'),
+                job['seconds'],
+                ok=posted,
+                feedback_rounds=session.get('feedback_rounds', 0) if posted and session is not None else 0,
+                message_id=job['message_id']
+            )
+            if posted and session is not None:
+                await self.tweet_generator.thread_index.add(request.get('tone', 'normal'), request['main'], job['tweets'])
         except Exception as e:
-            logger.error(f"Failed to register commands: {str(e)}", exc_info=True)
-            
-        logger.info("Command registration completed")
+            logger.error(f"Failed to record the thread of post job {job['id']}: {str(e)}", exc_info=True)
+
+    async def on_post_done(self, job: Dict):
+        """Tell the user about a post job that finished after /finalize stopped waiting"""
+        await self.finish_post(job)
+        if job['status'] == 'done' and job['publish_at'] is not None:
+            publish_at = int(max(job['publish_at'], time.time()))
+            text = (
+                f"🗓️ Your thread is on Typefully and will be published <t:{publish_at}:R>.\n"
+                f"📝 Edit your thread here: {job['draft_url']}"
+            )
+        elif job['status'] == 'done':
+            text = f"✅ Your thread has been posted to Typefully!\n📝 Edit your thread here: {job['draft_url']}"
+        else:
+            text = (
+                f"❌ Posting your thread to Typefully failed: {job['last_error']}\n"
+                "Please check your Typefully drafts before finalizing it again."
+            )
+
+        channel = self.get_channel(job['channel_id']) if job['channel_id'] else None
+        if channel is not None and job['status'] == 'done':
+            try:
+                await channel.get_partial_message(job['message_id']).edit(view=preview_view(disabled=True))
+            except discord.HTTPException as e:
+                logger.warning(f"Could not disable the buttons of preview {job['message_id']}: {str(e)}")
+
+        try:
+            user = self.get_user(job['user_id']) or await self.fetch_user(job['user_id'])
+            await user.send(text)
+        except discord.HTTPException:
+            # DMs closed: mention the user in the preview's channel instead
+            if channel is None:
+                raise
+            await channel.send(f"<@{job['user_id']}> {text}")
 
     async def on_ready(self):
         logger.info(f'Logged in as {self.user} (ID: {self.user.id})')
         logger.info('------')
+        if 'gateway' not in self.startup.phases:
+            self.startup.mark('gateway')
+            logger.info(f"Startup: {self.startup.summary()}")
 
     async def on_tree_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
         """Handle command errors gracefully"""
         logger.error(f"Error in {interaction.command.name} command: {str(error)}", exc_info=True)
+        metrics.record_error(interaction.command.name, error)
         
         if isinstance(error, app_commands.errors.CheckFailure):
             # This is handled by the check_channel decorator
@@ -233,11 +897,111 @@ class TweetBot(discord.Client):
             logger.error(f"Error while sending error message: {str(e)}", exc_info=True)
 
     async def handle_healthcheck(self, request):
-        """Handle healthcheck requests"""
-        return web.Response(text="OK", status=200)
+        """
+        Liveness: the event loop is responsive.
+
+        Fails when the loop monitor's heartbeat is stale, i.e. something
+        blocked the loop. Never touches external services.
+        """
+        stalled = time.monotonic() - self.loop_monitor.last_beat
+        healthy = stalled < config.HEALTH_MAX_LOOP_STALL
+        return web.json_response(
+            {
+                'status': 'ok' if healthy else 'stalled',
+                'heartbeat_age': round(stalled, 3),
+                'loop_lag': round(self.loop_monitor.last_lag, 3)
+            },
+            status=200 if healthy else 503
+        )
+
+    @property
+    def openai_unavailable(self) -> bool:
+        """Whether OpenAI's circuit breaker is open, in this process or a generation worker"""
+        if self.generation is not self.tweet_generator:
+            return self.generation.breaker_open
+        return self.tweet_generator.breaker.is_open
+
+    async def handle_readiness(self, request):
+        """
+        Readiness: connected to the Discord gateway with acceptable latency
+        and no dependency circuit breaker open. Answers from in-memory state.
+        """
+        latency = self.latency
+        checks = {
+            'gateway': self.is_ready() and not self.is_closed(),
+            'latency': math.isfinite(latency) and latency < config.READY_MAX_LATENCY,
+            'openai': not self.openai_unavailable,
+            'typefully': not self.scheduler.breaker.is_open
+        }
+        ready = all(checks.values())
+        return web.json_response(
+            {
+                'status': 'ready' if ready else 'not_ready',
+                'checks': checks,
+                'latency': round(latency, 3) if math.isfinite(latency) else None
+            },
+            status=200 if ready else 503
+        )
+
+    def register_metrics(self):
+        """Expose cache, queue and gateway state as metrics read at scrape time"""
+        metrics.REGISTRY.gauge_callback(
+            "tweetbot_response_cache",
+            "Response cache hit/miss counters and size",
+            self.tweet_generator.cache.stats,
+            labelname="stat"
+        )
+        metrics.REGISTRY.gauge_callback(
+            "tweetbot_rate_limit_queue",
+            "Requests waiting for client-side rate limit capacity",
+            lambda: {
+                'openai': self.tweet_generator.limiter.queued,
+                'typefully': self.scheduler.limiter.queued
+            },
+            labelname="provider"
+        )
+        metrics.REGISTRY.gauge_callback(
+            "tweetbot_circuit_breaker_open",
+            "Whether a dependency's circuit breaker is open (1) or not (0)",
+            lambda: {
+                'openai': int(self.openai_unavailable),
+                'typefully': int(self.scheduler.breaker.is_open)
+            },
+            labelname="dependency"
+        )
+        metrics.REGISTRY.gauge_callback(
+            "tweetbot_post_jobs_timed",
+            "Pending post jobs in the post worker's timer queue",
+            lambda: len(self.post_worker.timers)
+        )
+        metrics.REGISTRY.gauge_callback(
+            "tweetbot_thread_index_size",
+            "Approved threads archived per tone",
+            self.tweet_generator.thread_index.sizes,
+            labelname="tone"
+        )
+        metrics.REGISTRY.gauge_callback(
+            "tweetbot_discord_latency_seconds",
+            "Discord gateway heartbeat latency",
+            lambda: self.latency if math.isfinite(self.latency) else -1
+        )
+        metrics.REGISTRY.gauge_callback(
+            "tweetbot_startup_seconds",
+            "Time spent in each phase of the last startup",
+            lambda: self.startup.phases,
+            labelname="phase"
+        )
+
+    async def handle_metrics(self, request):
+        """Serve metrics in the Prometheus text format"""
+        return web.Response(
+            body=metrics.REGISTRY.render().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
 
     async def start_web_server(self):
-        """Start the web server"""
+        """Start the web server, and the loop monitor its health check reads"""
+        self.loop_monitor.start()
         runner = web.AppRunner(self.web_app)
         await runner.setup()
         port = int(os.getenv("PORT", "8000"))
@@ -245,46 +1009,253 @@ class TweetBot(discord.Client):
         await site.start()
         logger.info(f"Health check endpoint started on port {port}")
 
+def format_latency(seconds: Optional[float]) -> str:
+    """A latency percentile from the history rollups, which is the bound of its bucket"""
+    if seconds is None:
+        return "n/a"
+    if math.isinf(seconds):
+        return f">{LATENCY_BUCKETS[-1]}s"
+    return f"≤{seconds:g}s"
+
+def build_stats_embed(stats: Dict[str, Dict[str, Dict]], days: int) -> discord.Embed:
+    """
+    Build the /stats embed with a field per tone
+
+    Args:
+        stats: Usage per tone and kind, as returned by HistoryStore.stats
+        days: Number of days the usage covers
+    """
+    embed = discord.Embed(
+        title=f"Usage in the last {days} day{'s' if days != 1 else ''}",
+        color=discord.Color.blurple()
+    )
+    if not stats:
+        embed.description = "Nothing has been generated yet."
+        return embed
+
+    total_tokens = total_cost = 0
+    for tone in sorted(stats):
+        kinds = stats[tone]
+        lines = []
+        generate = kinds.get('generate')
+        if generate:
+            lines.append(
+                f"🧵 {generate['events']} generated ({generate['failures']} failed), "
+                f"p50 {format_latency(generate['p50'])}, p95 {format_latency(generate['p95'])}"
+            )
+        revise = kinds.get('revise')
+        if revise:
+            lines.append(
+                f"✏️ {revise['events']} revisions, "
+                f"p50 {format_latency(revise['p50'])}, p95 {format_latency(revise['p95'])}"
+            )
+        post = kinds.get('post')
+        if post:
+            lines.append(
+                f"✅ {post['events'] - post['failures']} posted, "
+                f"{post['feedback_rounds']:.1f} feedback rounds per thread"
+            )
+        tokens = sum(kind['prompt_tokens'] + kind['completion_tokens'] for kind in kinds.values())
+        cost = sum(kind['cost'] for kind in kinds.values())
+        lines.append(f"🪙 {tokens:,} tokens (~${cost:.2f})")
+        total_tokens += tokens
+        total_cost += cost
+        embed.add_field(name=tone.capitalize(), value="\n".join(lines), inline=False)
+
+    embed.description = f"{total_tokens:,} OpenAI tokens in total (~${total_cost:.2f})"
+    return embed
+
+def preview_title(variant: int, variants: int) -> str:
+    """Title of a preview showing variant (0-based) of variants drafts"""
+    if variants > 1:
+        return f"Tweet Thread Preview (Variant {variant + 1}/{variants})"
+    return "Tweet Thread Preview"
+
+def preview_view(disabled: bool = False, variants: int = 1) -> 'TweetPreviewView':
+    """
+    Build the buttons attached to a preview message.
+
+    The page buttons are only shown when there are several variants to
+    choose from. The returned view is only used to render components: it
+    is stopped before being sent so discord.py doesn't track it per
+    message. Clicks are handled by the persistent TweetPreviewView
+    registered in setup_hook.
+    """
+    view = TweetPreviewView()
+    if variants <= 1 or disabled:
+        view.remove_item(view.previous_button)
+        view.remove_item(view.next_button)
+    for child in view.children:
+        child.disabled = disabled
+    view.stop()
+    return view
+
 class TweetPreviewView(discord.ui.View):
-    def __init__(self, tweets, request, user_id, tweet_generator, scheduler):
-        super().__init__(timeout=600)  # 10 minute timeout
-        self.tweets = tweets
-        self.request = request
-        self.user_id = user_id
-        self.tweet_generator = tweet_generator
-        self.scheduler = scheduler
+    """Persistent, stateless preview buttons; state lives in the session store"""
+
+    def __init__(self):
+        super().__init__(timeout=None)
         
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        return interaction.user.id == self.user_id
+        set_correlation_id(interaction.id)
+        session = await interaction.client.sessions.get(interaction.message.id)
+        if session is None:
+            await interaction.response.send_message(
+                "This preview has expired. Please use /create to start a new draft.",
+                ephemeral=True
+            )
+            return False
+        if interaction.user.id != session['user_id']:
+            return False
+        if session['status'] == 'posting':
+            await interaction.response.send_message(
+                "This thread is already being posted to Typefully.",
+                ephemeral=True
+            )
+            return False
+        if session['status'] == 'scheduled':
+            await interaction.response.send_message(
+                "This thread is scheduled to be published. Use /schedule with a link to this preview "
+                "to change the time.",
+                ephemeral=True
+            )
+            return False
+        if session['status'] != 'open':
+            await interaction.response.send_message(
+                "This thread has already been finalized.",
+                ephemeral=True
+            )
+            return False
+        interaction.extras['session'] = session
+        return True
         
-    @discord.ui.button(label="Provide Feedback", style=discord.ButtonStyle.primary)
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary, custom_id="tweetbot:preview:previous")
+    async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_variant(interaction, -1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary, custom_id="tweetbot:preview:next")
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_variant(interaction, 1)
+
+    async def show_variant(self, interaction: discord.Interaction, step: int):
+        """Page through the variants of a preview; the shown one is what gets revised or finalized"""
+        metrics.COMMANDS.labels('variant').inc()
+        session = interaction.extras['session']
+        drafts = session.get('variants')
+        if not drafts:
+            await interaction.response.defer()
+            return
+
+        variant = (session.get('variant', 0) + step) % len(drafts)
+        await interaction.client.sessions.update(session['message_id'], {
+            'tweets': drafts[variant],
+            'request': session['request'],
+            'variants': drafts,
+            'variant': variant
+        })
+        preview = build_preview_embed(
+            drafts[variant],
+            title=preview_title(variant, len(drafts)),
+            description="Here's your draft tweet thread. Use the buttons below to provide feedback or finalize.",
+            color=discord.Color.blue(),
+            request=session['request']
+        )
+        with metrics.DISCORD_SEND_SECONDS.labels('preview').time():
+            await interaction.response.edit_message(embed=preview, view=preview_view(variants=len(drafts)))
+
+    @discord.ui.button(label="Provide Feedback", style=discord.ButtonStyle.primary, custom_id="tweetbot:preview:feedback")
     async def feedback_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        modal = TweetFeedbackModal(self.tweets, self.request, self.tweet_generator)
+        metrics.COMMANDS.labels('feedback').inc()
+        modal = TweetFeedbackModal(interaction.extras['session'])
         await interaction.response.send_modal(modal)
         
-    @discord.ui.button(label="Finalize & Post to Typefully", style=discord.ButtonStyle.success)
+    @discord.ui.button(label="Finalize & Post to Typefully", style=discord.ButtonStyle.success, custom_id="tweetbot:preview:finalize")
     async def finalize_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        metrics.COMMANDS.labels('finalize').inc()
+        session = interaction.extras['session']
+        bot = interaction.client
+        queued = False
         await interaction.response.defer()
+        deadline = Deadline.for_interaction(interaction, config.INTERACTION_DEADLINE)
         try:
-            draft_url = self.scheduler.schedule_thread(self.tweets)
+            # The job is keyed on this preview and its tweets, so a second
+            # click or a retry joins the existing job instead of posting twice
+            await bot.sessions.set_status(session['message_id'], 'posting')
+            job, queued = await bot.post_queue.enqueue(
+                session['message_id'],
+                interaction.user.id,
+                interaction.channel_id,
+                session['tweets']
+            )
+            if job['status'] != 'done' and bot.is_primary:
+                bot.post_worker.add(job)
+                # The job itself outlives the interaction; only the wait is bounded
+                job = await bot.post_worker.wait(job['id'], deadline.timeout(config.POST_WAIT_TIMEOUT))
+            elif job['status'] != 'done':
+                # Posted by the process running shard 0, which sends the link
+                job = None
+
+            if job is None:
+                await interaction.followup.send(
+                    "⏳ Typefully is taking a while. Your thread is queued and I'll send you "
+                    "the draft link as soon as it's posted.",
+                    ephemeral=True
+                )
+                return
+
+            await bot.finish_post(job)
+            if job['status'] != 'done':
+                await interaction.followup.send(
+                    "Sorry, something went wrong while posting to Typefully. "
+                    "Please check your Typefully drafts before trying again.",
+                    ephemeral=True
+                )
+                return
             
             await interaction.followup.send(
-                f"✅ Thread has been finalized and posted to Typefully!\n📝 Edit your thread here: {draft_url}",
+                f"✅ Thread has been finalized and posted to Typefully!\n📝 Edit your thread here: {job['draft_url']}",
                 ephemeral=True
             )
             
             # Disable all buttons
-            for child in self.children:
-                child.disabled = True
-            await interaction.message.edit(view=self)
+            await interaction.message.edit(view=preview_view(disabled=True))
             
         except Exception as e:
             logger.error(f"Error finalizing thread: {str(e)}", exc_info=True)
+            metrics.record_error('finalize', e)
+            if not queued:
+                await bot.sessions.set_status(session['message_id'], 'open')
             await interaction.followup.send(
                 "Sorry, something went wrong while posting to Typefully. Please try again.",
                 ephemeral=True
             )
 
+def parse_message_id(value: str) -> Optional[int]:
+    """The message ID of a message link or a bare ID, or None if there is none"""
+    match = re.search(r"(\d+)/?$", value.strip())
+    return int(match.group(1)) if match else None
+
+def parse_tweet_numbers(value: str, count: int) -> Optional[List[int]]:
+    """
+    Parse a comma/space separated list of tweet numbers such as "2, 4"
+
+    Returns:
+        The numbers, or None to target the whole thread when value is blank
+
+    Raises:
+        ValueError: If a number is not an integer between 1 and count
+    """
+    parts = [part for part in value.replace(',', ' ').split() if part]
+    if not parts:
+        return None
+    numbers = []
+    for part in parts:
+        number = int(part)
+        if number < 1 or number > count:
+            raise ValueError(f"Tweet number {number} is out of range")
+        numbers.append(number)
+    return sorted(set(numbers))
+
 class TweetFeedbackModal(discord.ui.Modal, title="Tweet Thread Feedback"):
     feedback = discord.ui.TextInput(
         label="Your Feedback",
@@ -293,76 +1264,147 @@ class TweetFeedbackModal(discord.ui.Modal, title="Tweet Thread Feedback"):
         required=True,
         max_length=1000
     )
+    targets = discord.ui.TextInput(
+        label="Tweets to revise (optional)",
+        style=discord.TextStyle.short,
+        placeholder="e.g. 2, 4 - leave blank to revise the whole thread",
+        required=False,
+        max_length=50
+    )
     
-    def __init__(self, tweets, request, tweet_generator):
+    def __init__(self, session):
         super().__init__()
-        self.tweets = tweets
-        self.request = request
-        self.tweet_generator = tweet_generator
+        self.session = session
         
     async def on_submit(self, interaction: discord.Interaction):
+        set_correlation_id(interaction.id)
+        tweets = self.session['tweets']
+        try:
+            targets = parse_tweet_numbers(self.targets.value or "", len(tweets))
+        except ValueError:
+            await interaction.response.send_message(
+                f"❌ Please enter tweet numbers between 1 and {len(tweets)}, e.g. `2, 4`.",
+                ephemeral=True
+            )
+            return
+
         try:
             await interaction.response.defer(thinking=True)
+            bot = interaction.client
+            request = self.session['request']
+            deadline = Deadline.for_interaction(interaction, config.INTERACTION_DEADLINE)
             
-            # Format original tweets for context
-            original_tweets = "\n".join([f"Tweet {i+1}: {tweet}" for i, tweet in enumerate(self.tweets)])
-            
-            # Add feedback to context
-            feedback_context = (
-                f"Original thread:\n{original_tweets}\n\n"
-                f"User feedback: {self.feedback.value}\n\n"
-                f"Please improve the thread based on this feedback while maintaining the original message and style."
+            # Only the current thread and the latest feedback are sent
+            new_tweets = await bot.generation.revise_thread(
+                request,
+                tweets,
+                self.feedback.value,
+                targets,
+                user_id=interaction.user.id,
+                on_queued=queue_notifier(interaction),
+                deadline=deadline
             )
-            
-            # Update request with feedback
-            self.request['context'] = f"{self.request['context']}\n\n{feedback_context}"
-            
-            # Generate new thread
-            new_tweets = self.tweet_generator.generate_thread(self.request)
+            new_tweets = await bot.generation.shorten_overlong(
+                request,
+                new_tweets,
+                user_id=interaction.user.id,
+                on_queued=queue_notifier(interaction),
+                deadline=deadline
+            )
+
+            # Keep a bounded history of previous versions
+            revisions = self.session.get('revisions', []) + [{
+                'feedback': self.feedback.value,
+                'targets': targets,
+                'tweets': tweets
+            }]
+            revisions = revisions[-config.MAX_REVISION_HISTORY:]
             
             # Create new preview
-            new_preview = discord.Embed(
+            revised = f"Tweets {', '.join(str(t) for t in targets)}" if targets else "Thread"
+            new_preview = build_preview_embed(
+                new_tweets,
                 title="Updated Tweet Thread Preview",
-                description=f"Thread has been updated based on your feedback:\n> {self.feedback.value}",
-                color=discord.Color.green()
-            )
-            
-            for i, tweet in enumerate(new_tweets, 1):
-                new_preview.add_field(
-                    name=f"Tweet {i}",
-                    value=tweet,
-                    inline=False
-                )
-            
-            # Create new view
-            new_view = TweetPreviewView(
-                tweets=new_tweets,
-                request=self.request,
-                user_id=interaction.user.id,
-                tweet_generator=self.tweet_generator,
-                scheduler=interaction.client.scheduler
+                description=f"{revised} updated based on your feedback:\n> {self.feedback.value}",
+                color=discord.Color.green(),
+                request=request
             )
             
             # Update the message
-            await interaction.edit_original_response(embed=new_preview, view=new_view)
+            with metrics.DISCORD_SEND_SECONDS.labels('preview').time():
+                message = await interaction.edit_original_response(content=None, embed=new_preview, view=preview_view())
+            await bot.sessions.save(
+                message.id,
+                interaction.user.id,
+                interaction.channel_id,
+                {
+                    'tweets': new_tweets,
+                    'request': request,
+                    'revisions': revisions,
+                    'feedback_rounds': self.session.get('feedback_rounds', 0) + 1
+                }
+            )
             
         except Exception as e:
             logger.error(f"Error processing feedback: {str(e)}", exc_info=True)
+            metrics.record_error('feedback', e)
             await interaction.followup.send(
-                "Sorry, something went wrong while processing your feedback. Please try again.",
+                "OpenAI is too slow right now. Please try your feedback again in a few minutes."
+                if isinstance(e, DeadlineExceeded)
+                else "Sorry, something went wrong while processing your feedback. Please try again.",
                 ephemeral=True
             )
 
+class ShardedTweetBot(TweetBot, discord.AutoShardedClient):
+    """
+    TweetBot connected through several gateway shards.
+
+    Used when DISCORD_SHARD_COUNT is set. With DISCORD_SHARD_IDS only
+    those shards are run, so the shards can be spread over processes
+    sharing the same DATA_DIR.
+    """
+
+    async def on_shard_ready(self, shard_id: int):
+        logger.info(f"Shard {shard_id} ready")
+
+def create_bot(startup: metrics.StartupTimer) -> TweetBot:
+    """The bot for the configured deployment mode"""
+    if not config.DISCORD_SHARD_COUNT:
+        return TweetBot(startup)
+    options = {}
+    if config.DISCORD_SHARD_COUNT != 'auto':
+        options['shard_count'] = int(config.DISCORD_SHARD_COUNT)
+    if config.DISCORD_SHARD_IDS:
+        options['shard_ids'] = config.DISCORD_SHARD_IDS
+        # Every process calls OpenAI with the same account, so each gets the
+        # share of its limits that its shards are of all shards
+        share = len(config.DISCORD_SHARD_IDS) / int(config.DISCORD_SHARD_COUNT)
+        config.OPENAI_REQUESTS_PER_MINUTE *= share
+        config.OPENAI_TOKENS_PER_MINUTE *= share
+        config.BATCH_TOKENS_PER_MINUTE *= share
+    logger.info(
+        f"Running shards {config.DISCORD_SHARD_IDS or 'all'} of {config.DISCORD_SHARD_COUNT}"
+    )
+    return ShardedTweetBot(startup, **options)
+
+async def run(startup: metrics.StartupTimer):
+    # Create the client inside the running loop
+    bot = create_bot(startup)
+
+    # Serve health checks while logging in to Discord
+    await bot.start_web_server()
+    startup.mark('web server')
+
+    async with bot:
+        await bot.start(config.DISCORD_TOKEN)
+
 def main():
-    # Create the client
-    bot = TweetBot()
-    
-    # Set up the event loop
-    loop = asyncio.get_event_loop()
-    
-    # Start both the Discord bot and web server
-    loop.create_task(bot.start_web_server())
-    loop.run_until_complete(bot.start(config.DISCORD_TOKEN))
+    # Not on import: spawned generation workers import this module too
+    setup_logging()
+    startup = metrics.StartupTimer(IMPORT_STARTED)
+    startup.mark('imports')
+    config.validate()
+    asyncio.run(run(startup))
 
 if __name__ == '__main__':
     main()
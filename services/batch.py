@@ -0,0 +1,162 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Collection, Dict, List, Optional, Tuple
+from .deadline import Deadline, within
+from .rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+TONES = ("normal", "intern", "marketing")
+
+def _split(value) -> List[str]:
+    """Accept either a list or a comma-separated string"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in str(value).split(',') if v.strip()]
+
+def build_request(row: Dict, default_tone: str = "normal", tones: Collection[str] = TONES) -> Dict:
+    """
+    Build a generate_thread request from a batch row
+
+    Args:
+        row: The batch row
+        default_tone: Tone of rows that don't set one
+        tones: The tones rows may use, e.g. including a guild's custom tones
+
+    Raises:
+        ValueError: If a required field is missing or invalid
+    """
+    main = str(row.get('main') or '').strip()
+    context = str(row.get('context') or '').strip()
+    keywords = _split(row.get('keywords'))
+    if not main or not context or not keywords:
+        raise ValueError("main, context and keywords are required")
+
+    try:
+        length = int(row.get('length') or 1)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid length {row.get('length')!r}")
+    if length < 1 or length > 10:
+        raise ValueError("length must be between 1 and 10")
+
+    tone = str(row.get('tone') or default_tone).strip().lower()
+    if tone not in tones:
+        raise ValueError(f"unknown tone {tone!r}")
+
+    return {
+        'main': main,
+        'context': context,
+        'keywords': keywords,
+        'tags': _split(row.get('tags', row.get('tag'))),
+        'length': length,
+        'tone': tone,
+        'link': str(row.get('link') or '').strip() or None
+    }
+
+def parse_batch_file(
+    data: bytes,
+    filename: str,
+    default_tone: str = "normal",
+    tones: Collection[str] = TONES
+) -> Tuple[List[Dict], List[str]]:
+    """
+    Parse a CSV or JSON batch file into generation requests
+
+    CSV files need a header row; JSON files contain a list of objects. Both
+    use the /create field names (main, context, keywords, length, tone,
+    tag/tags, link).
+
+    Returns:
+        A tuple of (requests, errors) where errors describe skipped rows
+    """
+    text = data.decode('utf-8-sig')
+    if filename.lower().endswith('.json'):
+        rows = json.loads(text)
+        if isinstance(rows, dict):
+            rows = rows.get('threads', [])
+        if not isinstance(rows, list):
+            raise ValueError("JSON batch must be a list of objects")
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+
+    requests, errors = [], []
+    for i, row in enumerate(rows, 1):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("expected an object")
+            requests.append(build_request(row, default_tone, tones))
+        except ValueError as e:
+            errors.append(f"Row {i}: {str(e)}")
+    return requests, errors
+
+async def run_batch(
+    tweet_generator,
+    requests: List[Dict],
+    on_result: Callable[[int, Dict, Optional[List[str]], Optional[Exception]], Awaitable[None]],
+    concurrency: int,
+    tokens_per_minute: Optional[float] = None,
+    user_id: Optional[int] = None,
+    deadline: Optional[Deadline] = None
+) -> Dict:
+    """
+    Generate many threads concurrently
+
+    At most `concurrency` generations run at once and, if tokens_per_minute
+    is set, their estimated token usage is kept within that budget.
+    on_result is awaited as soon as each thread completes (or fails).
+    All items are queued for provider capacity under user_id, so a large
+    batch shares the rate limits fairly with interactive users. Items
+    that can't be generated before the deadline fail instead of being
+    delivered after the interaction has expired.
+
+    Returns:
+        A summary with total, succeeded, failed, elapsed seconds,
+        threads per minute and a list of failure messages
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    budget = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+    failures: List[Tuple[int, str]] = []
+    started = time.monotonic()
+
+    async def _run_one(index: int, request: Dict):
+        async with semaphore:
+            try:
+                if budget is not None:
+                    await within(deadline, budget.acquire(await tweet_generator.estimate_tokens(request)))
+                tweets = await tweet_generator.generate_thread(request, user_id=user_id, deadline=deadline)
+                error = None
+            except Exception as e:
+                logger.error(f"Batch item {index} failed: {str(e)}")
+                tweets, error = None, e
+
+        try:
+            await on_result(index, request, tweets, error)
+        except Exception as e:
+            logger.error(f"Failed to deliver batch item {index}: {str(e)}", exc_info=True)
+            error = error or e
+        if error is not None:
+            failures.append((index, f"#{index} ({request['main'][:40]}): {str(error)}"))
+
+    await asyncio.gather(*(_run_one(i, request) for i, request in enumerate(requests, 1)))
+
+    elapsed = time.monotonic() - started
+    succeeded = len(requests) - len(failures)
+    summary = {
+        'total': len(requests),
+        'succeeded': succeeded,
+        'failed': len(failures),
+        'elapsed': elapsed,
+        'per_minute': succeeded / elapsed * 60 if elapsed > 0 else 0.0,
+        'failures': [message for _, message in sorted(failures)]
+    }
+    logger.info(
+        f"Batch finished: {succeeded}/{len(requests)} threads in {elapsed:.1f}s "
+        f"({summary['per_minute']:.1f}/min)"
+    )
+    return summary
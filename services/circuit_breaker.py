@@ -0,0 +1,84 @@
+import logging
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreakerOpen(Exception):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while.
+
+    After failure_threshold consecutive failures the circuit opens and
+    calls fail fast with CircuitBreakerOpen. Once reset_timeout seconds have
+    passed a single trial call is let through (half-open); its outcome
+    closes or re-opens the circuit.
+
+    Use as a context manager around the dependency call. Only exceptions
+    for which is_failure returns True count against the dependency, and
+    only calls that raise nothing count for it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        is_failure: Optional[Callable[[BaseException], bool]] = None
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure or (lambda e: True)
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def __enter__(self):
+        state = self.state
+        if state == self.OPEN or (state == self.HALF_OPEN and self._trial_in_flight):
+            raise CircuitBreakerOpen(f"{self.name} is unavailable, please try again later")
+        if state == self.HALF_OPEN:
+            self._trial_in_flight = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._trial_in_flight = False
+        if exc is None:
+            self.record_success()
+        elif self.is_failure(exc):
+            self.record_failure()
+        # Other errors, cancellation included, say nothing about the
+        # dependency; a half-open circuit lets the next call try again
+        return False
+
+    def record_success(self):
+        if self._state != self.CLOSED:
+            logger.info(f"{self.name} circuit closed")
+        self.failures = 0
+        self._state = self.CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        if self._state == self.OPEN or self.failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                logger.warning(f"{self.name} circuit opened after {self.failures} consecutive failures")
+            self._state = self.OPEN
+            self.opened_at = time.monotonic()
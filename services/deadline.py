@@ -0,0 +1,68 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar('T')
+
+class DeadlineExceeded(Exception):
+    """Raised when work can't finish before its deadline"""
+
+class Deadline:
+    """
+    Point in time by which a piece of work has to be done.
+
+    Created once per interaction and passed down to every call made on its
+    behalf, so each step only waits for as long as the whole interaction
+    still has. Based on the monotonic clock, which is shared by all
+    processes on a host, so a deadline can be passed to worker processes.
+    """
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_interaction(cls, interaction, budget: float) -> 'Deadline':
+        """A deadline budget seconds after the interaction was created"""
+        created_at = getattr(interaction, 'created_at', None) or datetime.now(timezone.utc)
+        elapsed = (datetime.now(timezone.utc) - created_at).total_seconds()
+        return cls(budget - max(0.0, elapsed))
+
+    def remaining(self) -> float:
+        """Seconds left, 0 once expired"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, limit: Optional[float] = None) -> float:
+        """The smaller of limit and the time remaining"""
+        remaining = self.remaining()
+        return remaining if limit is None else min(limit, remaining)
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """
+        Await awaitable, cancelling it when the deadline passes
+
+        Raises:
+            DeadlineExceeded: If the deadline passed first
+        """
+        if self.expired:
+            if asyncio.iscoroutine(awaitable):
+                # Don't leave a never-awaited coroutine behind
+                awaitable.close()
+            raise DeadlineExceeded("Deadline already passed")
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            if not self.expired:
+                # A timeout of the work itself, not of the deadline
+                raise
+            raise DeadlineExceeded("Deadline passed") from None
+
+async def within(deadline: Optional[Deadline], awaitable: Awaitable[T]) -> T:
+    """Await awaitable within deadline, or without a limit if there is none"""
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable)
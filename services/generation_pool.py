@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import config
+from . import metrics
+from .deadline import Deadline, DeadlineExceeded
+from .logging_setup import correlation_id, forward_worker_logs, set_correlation_id, setup_worker_logging
+from .tokens import load_tokenizers
+
+logger = logging.getLogger(__name__)
+
+# Per-process state of a generation worker, set up by _init_worker
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_generator = None
+
+class GenerationError(Exception):
+    """
+    An error raised while generating in a worker process.
+
+    OpenAI's exceptions can't be pickled back to the bot, so they are
+    carried across as the original type name and message.
+    """
+
+    def __init__(self, type_name: str, message: str):
+        super().__init__(type_name, message)
+        self.type_name = type_name
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+def _init_worker(log_queue, requests_per_minute: float, tokens_per_minute: float):
+    global _loop, _generator
+    setup_worker_logging(log_queue)
+    # This worker's share of the account's rate limits
+    config.OPENAI_REQUESTS_PER_MINUTE = requests_per_minute
+    config.OPENAI_TOKENS_PER_MINUTE = tokens_per_minute
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    # Imported here so the bot process doesn't load it just to start the pool
+    from .tweet_generator import TweetGenerator
+    _generator = TweetGenerator()
+    load_tokenizers(_generator.router.models)
+    logging.getLogger(__name__).info("Generation worker ready")
+
+def _ready() -> bool:
+    return _generator is not None
+
+def _breaker_state() -> Tuple[int, float]:
+    """This worker's pid and the monotonic time its OpenAI circuit breaker is open until (0 if closed)"""
+    breaker = _generator.breaker
+    return os.getpid(), breaker.opened_at + breaker.reset_timeout if breaker.is_open else 0.0
+
+def _call(method: str, args: tuple, kwargs: Dict, correlation: str):
+    """
+    Run a TweetGenerator method
+
+    Returns:
+        A tuple of (result, error, breaker state, metrics recorded since
+        the last call); the error is raised by the bot, so the rest gets
+        back either way
+    """
+    set_correlation_id(correlation)
+    try:
+        result = _loop.run_until_complete(getattr(_generator, method)(*args, **kwargs))
+        error = None
+    except DeadlineExceeded as e:
+        # Ours, so it pickles; lets the bot handle it like a local one
+        result, error = None, e
+    except Exception as e:
+        result, error = None, GenerationError(type(e).__name__, str(e))
+    return result, error, _breaker_state(), metrics.REGISTRY.take_changes()
+
+class GenerationPool:
+    """
+    Runs thread generation in separate worker processes.
+
+    Offers the TweetGenerator methods the bot calls, each sent to one of
+    `workers` processes through the executor's call queue. Every worker
+    has its own TweetGenerator and handles one call at a time, so up to
+    `workers` generations run in parallel, and the client-side rate limits
+    are divided between the workers.
+
+    If a worker dies the pool is replaced and the interrupted calls are
+    retried once; queued callers are not told their queue position.
+    Deadlines are passed on to the workers, which share the host's
+    monotonic clock. Each call also reports the state of its worker's
+    OpenAI circuit breaker, so the bot's readiness check can see it, and
+    the metrics the worker recorded, which are added to the bot's.
+    """
+
+    def __init__(self, workers: int, local):
+        self.workers = workers
+        # The bot's own TweetGenerator, used for local estimates
+        self.local = local
+        self._context = multiprocessing.get_context('spawn')
+        self._log_queue = self._context.Queue()
+        self._log_listener = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Monotonic time each worker's circuit breaker is open until, by pid
+        self._breakers: Dict[int, float] = {}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Started on first use, keeping the bot's startup fast
+        if self._executor is None:
+            if self._log_listener is None:
+                self._log_listener = forward_worker_logs(self._log_queue)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self._context,
+                initializer=_init_worker,
+                initargs=(
+                    self._log_queue,
+                    config.OPENAI_REQUESTS_PER_MINUTE / self.workers,
+                    config.OPENAI_TOKENS_PER_MINUTE / self.workers
+                )
+            )
+            logger.info(f"Started {self.workers} generation worker processes")
+        return self._executor
+
+    def start(self):
+        """Start all worker processes in the background, so the first generations don't wait for them"""
+        executor = self._pool()
+        for _ in range(self.workers):
+            executor.submit(_ready)
+
+    async def _submit(self, method: str, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = self._pool()
+            started = time.perf_counter()
+            try:
+                result, error, (pid, open_until), changes = await loop.run_in_executor(
+                    executor, _call, method, args, kwargs, correlation_id.get()
+                )
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                logger.error(f"A generation worker died during {method}, restarting the pool")
+                self._restart(executor)
+                continue
+            self._breakers[pid] = open_until
+            metrics.REGISTRY.add_changes(changes)
+            if error is not None:
+                raise error
+            metrics.GENERATION_WORKER_SECONDS.labels(method).observe(time.perf_counter() - started)
+            return result
+
+    @property
+    def breaker_open(self) -> bool:
+        """Whether a worker's OpenAI circuit breaker was open at its last call and hasn't timed out since"""
+        now = time.monotonic()
+        return any(open_until > now for open_until in self._breakers.values())
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        # Concurrent callers see the same broken pool; only replace it once
+        if self._executor is broken:
+            metrics.GENERATION_WORKER_RESTARTS.inc()
+            broken.shutdown(wait=False)
+            self._executor = None
+            self._breakers.clear()
+
+    async def generate_thread(
+        self,
+        request: Dict,
+        regenerate: bool = False,
+        user_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        deadline: Optional[Deadline] = None
+    ) -> List[str]:
+        """See TweetGenerator.generate_thread; on_queued is not called"""
+        return await self._submit('generate_thread', request, regenerate, user_id, deadline=deadline)
+
+    async def generate_variants(
+        self,
+        request: Dict,
+        count: int,
+        regenerate: bool = False,
+        user_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        deadline: Optional[Deadline] = None
+    ) -> List[List[str]]:
+        """See TweetGenerator.generate_variants; on_queued is not called"""
+        return await self._submit('generate_variants', request, count, regenerate, user_id, deadline=deadline)
+
+    async def revise_thread(
+        self,
+        request: Dict,
+        tweets: List[str],
+        feedback: str,
+        targets: Optional[List[int]] = None,
+        user_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        operation: str = 'revise',
+        deadline: Optional[Deadline] = None
+    ) -> List[str]:
+        """See TweetGenerator.revise_thread; on_queued is not called"""
+        return await self._submit(
+            'revise_thread', request, tweets, feedback, targets, user_id, operation=operation, deadline=deadline
+        )
+
+    async def shorten_overlong(
+        self,
+        request: Dict,
+        tweets: List[str],
+        user_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        deadline: Optional[Deadline] = None
+    ) -> List[str]:
+        """See TweetGenerator.shorten_overlong; on_queued is not called"""
+        return await self._submit('shorten_overlong', request, tweets, user_id, deadline=deadline)
+
+    async def estimate_tokens(self, request: Dict) -> int:
+        return await self.local.estimate_tokens(request)
+
+    def close(self):
+        """Stop the worker processes, abandoning queued calls"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
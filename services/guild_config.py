@@ -0,0 +1,289 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, FrozenSet, List, Optional, Tuple
+import config
+from .rate_limiter import TokenBucket
+from .tone_settings import TONE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# Settings of the "defaults" section and of each guild
+GUILD_SETTINGS = ('allowed_channels', 'admins', 'default_tone', 'tones', 'model', 'threads_per_minute')
+# Settings a channel can override within its guild
+CHANNEL_SETTINGS = ('default_tone', 'tones', 'model')
+
+class ChannelSettings:
+    """The effective settings of one channel, after the defaults and its guild's settings"""
+
+    __slots__ = GUILD_SETTINGS
+
+    def __init__(
+        self,
+        allowed_channels: Optional[FrozenSet[int]],
+        admins: FrozenSet[int],
+        default_tone: str,
+        tones: Dict[str, str],
+        model: Optional[str],
+        threads_per_minute: Optional[float]
+    ):
+        # None allows every channel
+        self.allowed_channels = allowed_channels
+        self.admins = admins
+        self.default_tone = default_tone
+        # Custom tone prompts, by tone name; they can also replace built-in tones
+        self.tones = tones
+        # Model generating threads, instead of the routed one
+        self.model = model
+        self.threads_per_minute = threads_per_minute
+
+    def allows(self, channel_id: Optional[int]) -> bool:
+        return self.allowed_channels is None or channel_id in self.allowed_channels
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self.admins
+
+    @property
+    def tone_names(self) -> List[str]:
+        """Built-in tones first, then the custom ones"""
+        return list(TONE_SETTINGS) + sorted(tone for tone in self.tones if tone not in TONE_SETTINGS)
+
+    def tone_prompt(self, tone: str) -> Optional[str]:
+        """The configured prompt of a tone, or None to use the built-in one"""
+        return self.tones.get(tone)
+
+def _ids(value, where: str) -> FrozenSet[int]:
+    if not isinstance(value, list):
+        raise ValueError(f"{where} must be a list of IDs")
+    try:
+        return frozenset(int(item) for item in value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{where} must be a list of IDs") from None
+
+def _layer(data, where: str, allowed: Tuple[str, ...]) -> Dict:
+    """Validate one level of settings, converting it to the form ChannelSettings takes"""
+    if not isinstance(data, dict):
+        raise ValueError(f"{where} must be an object")
+    unknown = set(data) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown settings in {where}: {', '.join(sorted(unknown))}")
+    layer = {}
+    for name in ('allowed_channels', 'admins'):
+        if name in data:
+            layer[name] = _ids(data[name], f"{where}.{name}")
+    if 'tones' in data:
+        tones = data['tones']
+        if not isinstance(tones, dict) or not all(
+            isinstance(prompt, str) and prompt.strip() for prompt in tones.values()
+        ):
+            raise ValueError(f"{where}.tones must map tone names to prompts")
+        layer['tones'] = {name.strip().lower(): prompt for name, prompt in tones.items()}
+    for name in ('default_tone', 'model'):
+        if name in data:
+            if not isinstance(data[name], str) or not data[name].strip():
+                raise ValueError(f"{where}.{name} must be a string")
+            layer[name] = data[name].strip().lower() if name == 'default_tone' else data[name].strip()
+    if 'threads_per_minute' in data:
+        value = data['threads_per_minute']
+        if not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"{where}.threads_per_minute must be a positive number")
+        layer['threads_per_minute'] = float(value)
+    return layer
+
+class GuildConfig:
+    """
+    One version of the guild configuration file; never changed once built.
+
+    The file is a JSON object with an optional "defaults" section and a
+    "guilds" object keyed by guild ID, each of which can have a
+    "channels" object keyed by channel ID:
+
+        {
+            "defaults": {"default_tone": "normal"},
+            "guilds": {
+                "123": {
+                    "allowed_channels": [456],
+                    "admins": [789],
+                    "tones": {"hype": "You are ..."},
+                    "threads_per_minute": 10,
+                    "channels": {"456": {"default_tone": "hype", "model": "gpt-4o"}}
+                }
+            }
+        }
+
+    A guild's settings replace the defaults, which replace the
+    environment settings (DISCORD_CHANNEL_IDS, ADMIN_IDS); tones are
+    merged and admins added up instead. The settings of the defaults, of
+    each guild and of each configured channel are resolved when the file
+    is loaded; any other channel has its guild's settings (or the
+    defaults), so a lookup is at most three dict reads.
+    """
+
+    def __init__(self, data: Dict):
+        if not isinstance(data, dict):
+            raise ValueError("The guild configuration must be a JSON object")
+        unknown = set(data) - {'defaults', 'guilds'}
+        if unknown:
+            raise ValueError(f"Unknown sections in the guild configuration: {', '.join(sorted(unknown))}")
+        self._defaults = _layer(data.get('defaults', {}), 'defaults', GUILD_SETTINGS)
+        self._guilds: Dict[int, Dict] = {}
+        self._channels: Dict[Tuple[int, int], Dict] = {}
+        guilds = data.get('guilds', {})
+        if not isinstance(guilds, dict):
+            raise ValueError("guilds must be an object keyed by guild ID")
+        for guild_id, guild in guilds.items():
+            where = f"guild {guild_id}"
+            self._guilds[int(guild_id)] = _layer(guild, where, GUILD_SETTINGS + ('channels',))
+            channels = guild.get('channels') or {}
+            if not isinstance(channels, dict):
+                raise ValueError(f"{where}.channels must be an object keyed by channel ID")
+            for channel_id, channel in channels.items():
+                self._channels[int(guild_id), int(channel_id)] = _layer(
+                    channel, f"{where}.channel {channel_id}", CHANNEL_SETTINGS
+                )
+        # Resolved now, so a bad default tone fails the load instead of a command
+        self._resolved: Dict[Tuple[Optional[int], Optional[int]], ChannelSettings] = {
+            key: self._resolve(*key)
+            for key in [(None, None)] + [(guild_id, None) for guild_id in self._guilds] + list(self._channels)
+        }
+
+    @property
+    def guilds(self) -> int:
+        return len(self._guilds)
+
+    def settings(self, guild_id: Optional[int], channel_id: Optional[int]) -> ChannelSettings:
+        """The settings of a channel of a guild (None for DMs or unknown)"""
+        return (
+            self._resolved.get((guild_id, channel_id))
+            or self._resolved.get((guild_id, None))
+            or self._resolved[None, None]
+        )
+
+    def _resolve(self, guild_id: Optional[int], channel_id: Optional[int]) -> ChannelSettings:
+        values = {
+            'allowed_channels': frozenset(config.ALLOWED_CHANNELS) or None,
+            'admins': frozenset(config.ADMIN_IDS),
+            'default_tone': 'normal',
+            'tones': {},
+            'model': None,
+            'threads_per_minute': None
+        }
+        layers = [self._defaults, self._guilds.get(guild_id, {}), self._channels.get((guild_id, channel_id), {})]
+        for layer in layers:
+            for name, value in layer.items():
+                if name == 'tones':
+                    values['tones'] = dict(values['tones'], **value)
+                elif name == 'admins':
+                    values['admins'] = values['admins'] | value
+                else:
+                    values[name] = value
+        settings = ChannelSettings(**values)
+        if settings.default_tone not in settings.tone_names:
+            raise ValueError(
+                f"Unknown default tone {settings.default_tone!r} for guild {guild_id}, channel {channel_id}"
+            )
+        return settings
+
+class GuildConfigStore:
+    """
+    The current guild configuration, reloaded when its file changes.
+
+    Reloads parse and validate the whole file before replacing the
+    current GuildConfig in a single assignment, so a command always sees
+    one complete version, and a broken file leaves the previous version in
+    place. A missing file means only the environment settings apply.
+    """
+
+    def __init__(self, path: str, watch_interval: float = 5.0):
+        self.path = path
+        self.watch_interval = watch_interval
+        self._mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        # Per-guild generation limits, kept across reloads unless the limit changes
+        self._limits: Dict[int, TokenBucket] = {}
+        try:
+            self.current = self._load()
+        except ValueError as e:
+            logger.error(f"Ignoring invalid guild configuration {path}: {str(e)}")
+            self.current = GuildConfig({})
+
+    def _mtime_of_file(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _load(self) -> GuildConfig:
+        """
+        Read and parse the file
+
+        Raises:
+            ValueError: If the file isn't valid JSON or has invalid settings
+        """
+        mtime = self._mtime_of_file()
+        if mtime is None:
+            guild_config = GuildConfig({})
+        else:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    guild_config = GuildConfig(json.load(f))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON: {str(e)}") from None
+        self._mtime = mtime
+        logger.info(f"Loaded guild configuration for {guild_config.guilds} guild(s) from {self.path}")
+        return guild_config
+
+    async def reload(self) -> GuildConfig:
+        """
+        Load the file again and make it the current configuration
+
+        Raises:
+            ValueError: If the file is invalid; the current configuration is kept
+        """
+        loop = asyncio.get_running_loop()
+        guild_config = await loop.run_in_executor(None, self._load)
+        self.current = guild_config
+        return guild_config
+
+    def settings(self, guild_id: Optional[int], channel_id: Optional[int]) -> ChannelSettings:
+        return self.current.settings(guild_id, channel_id)
+
+    def allow_threads(self, guild_id: Optional[int], settings: ChannelSettings, count: int = 1) -> bool:
+        """Take count threads from the guild's per-minute limit, False if it is used up or smaller than count"""
+        if guild_id is None or settings.threads_per_minute is None:
+            return True
+        if count > settings.threads_per_minute:
+            # The bucket would take the whole limit for it, not count threads
+            return False
+        bucket = self._limits.get(guild_id)
+        if bucket is None or bucket.capacity != settings.threads_per_minute:
+            bucket = self._limits[guild_id] = TokenBucket(settings.threads_per_minute)
+        return bucket.try_acquire(count)
+
+    def start(self):
+        if self._task is None and self.watch_interval > 0:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            if self._mtime_of_file() == self._mtime:
+                continue
+            try:
+                await self.reload()
+            except ValueError as e:
+                # Don't retry the same broken file every interval
+                self._mtime = self._mtime_of_file()
+                logger.error(f"Keeping the previous guild configuration, {self.path} is invalid: {str(e)}")
+            except Exception as e:
+                logger.error(f"Failed to reload the guild configuration: {str(e)}", exc_info=True)
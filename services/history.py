@@ -0,0 +1,227 @@
+import bisect
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+from .sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency buckets kept per day, tone and
+# kind; percentiles are read from these, so they are only as exact as
+# the bucket they fall in
+LATENCY_BUCKETS = (0.5, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233)
+
+# Most days /stats can look back
+MAX_STATS_DAYS = 90
+
+def _day(timestamp: float) -> str:
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+def _percentile(counts: List[int], fraction: float) -> Optional[float]:
+    """Upper bound of the bucket holding the given fraction of events, inf past the last bucket"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for bucket, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else float('inf')
+    return float('inf')
+
+class HistoryStore(SQLiteStore):
+    """
+    Append-only record of every generation, revision and post.
+
+    Each event is one row in history_events, indexed by user, tone and
+    time for ad-hoc queries. The same transaction adds it to per-day
+    rollups by tone and kind (counts, tokens, cost, feedback rounds and a
+    latency histogram), so usage stats are read from a few dozen rows
+    however many events there are.
+
+    record() never waits for the database: events are buffered and
+    written in batches on the store's thread. Generation worker processes
+    each write through their own store to the same database.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            kind TEXT NOT NULL,
+            user_id INTEGER,
+            tone TEXT NOT NULL,
+            seconds REAL NOT NULL,
+            ok INTEGER NOT NULL,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            feedback_rounds INTEGER NOT NULL DEFAULT 0,
+            message_id INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_history_user ON history_events (user_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_history_tone ON history_events (tone, created_at);
+        CREATE INDEX IF NOT EXISTS idx_history_time ON history_events (created_at);
+        CREATE TABLE IF NOT EXISTS history_rollups (
+            day TEXT NOT NULL,
+            tone TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            failures INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            cost REAL NOT NULL,
+            feedback_rounds INTEGER NOT NULL,
+            PRIMARY KEY (day, tone, kind)
+        );
+        CREATE TABLE IF NOT EXISTS history_latency (
+            day TEXT NOT NULL,
+            tone TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            events INTEGER NOT NULL,
+            PRIMARY KEY (day, tone, kind, bucket)
+        );
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._pending: List[tuple] = []
+        self._lock = threading.Lock()
+        self._flush_queued = False
+
+    def record(
+        self,
+        kind: str,
+        user_id: Optional[int],
+        tone: Optional[str],
+        seconds: float,
+        ok: bool = True,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cost: float = 0.0,
+        feedback_rounds: int = 0,
+        message_id: Optional[int] = None
+    ):
+        """
+        Queue an event to be written in the background
+
+        Args:
+            kind: What happened, e.g. 'generate', 'revise' or 'post'
+            user_id: Discord user it was done for
+            tone: Tone of the thread
+            seconds: How long it took
+            ok: Whether it succeeded
+            prompt_tokens: OpenAI prompt tokens used
+            completion_tokens: OpenAI completion tokens used
+            cost: Estimated OpenAI cost in USD
+            feedback_rounds: For posted threads, how many rounds of
+                feedback they took
+            message_id: The preview message, if any
+        """
+        event = (
+            time.time(), kind, user_id, tone or 'normal', seconds, int(ok),
+            prompt_tokens, completion_tokens, cost, feedback_rounds, message_id
+        )
+        with self._lock:
+            self._pending.append(event)
+            if self._flush_queued:
+                # The queued flush picks this event up too
+                return
+            self._flush_queued = True
+        try:
+            self._executor.submit(self._flush)
+        except RuntimeError:
+            logger.warning(f"History store closed, dropped a {kind} event")
+
+    def _flush(self):
+        with self._lock:
+            events, self._pending = self._pending, []
+            self._flush_queued = False
+        try:
+            self._call(self._insert, events)
+        except Exception as e:
+            logger.error(f"Failed to write {len(events)} history events: {str(e)}", exc_info=True)
+
+    @staticmethod
+    def _insert(conn, events: List[tuple]):
+        conn.executemany(
+            "INSERT INTO history_events (created_at, kind, user_id, tone, seconds, ok, "
+            "prompt_tokens, completion_tokens, cost, feedback_rounds, message_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            events
+        )
+        rollups: Dict[tuple, list] = {}
+        latency: Dict[tuple, int] = {}
+        for created_at, kind, _, tone, seconds, ok, prompt, completion, cost, rounds, _ in events:
+            key = (_day(created_at), tone, kind)
+            totals = rollups.setdefault(key, [0, 0, 0.0, 0, 0, 0.0, 0])
+            for index, value in enumerate((1, 1 - ok, seconds, prompt, completion, cost, rounds)):
+                totals[index] += value
+            bucket = key + (bisect.bisect_left(LATENCY_BUCKETS, seconds),)
+            latency[bucket] = latency.get(bucket, 0) + 1
+        conn.executemany(
+            "INSERT INTO history_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (day, tone, kind) DO UPDATE SET "
+            "events = events + excluded.events, failures = failures + excluded.failures, "
+            "seconds = seconds + excluded.seconds, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+            "completion_tokens = completion_tokens + excluded.completion_tokens, cost = cost + excluded.cost, "
+            "feedback_rounds = feedback_rounds + excluded.feedback_rounds",
+            [key + tuple(totals) for key, totals in rollups.items()]
+        )
+        conn.executemany(
+            "INSERT INTO history_latency VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (day, tone, kind, bucket) DO UPDATE SET events = events + excluded.events",
+            [bucket + (count,) for bucket, count in latency.items()]
+        )
+
+    async def stats(self, days: int) -> Dict[str, Dict[str, Dict]]:
+        """
+        Usage over the last days days (today included), from the rollups
+
+        Returns:
+            {tone: {kind: summary}} where a summary has events, failures,
+            prompt_tokens, completion_tokens, cost, feedback_rounds (per
+            successful event) and p50/p95 latency in seconds
+        """
+        def _stats(conn, since):
+            rollups = conn.execute(
+                "SELECT tone, kind, SUM(events) AS events, SUM(failures) AS failures, "
+                "SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens, "
+                "SUM(cost) AS cost, SUM(feedback_rounds) AS feedback_rounds "
+                "FROM history_rollups WHERE day >= ? GROUP BY tone, kind",
+                (since,)
+            ).fetchall()
+            latency = conn.execute(
+                "SELECT tone, kind, bucket, SUM(events) AS events FROM history_latency "
+                "WHERE day >= ? GROUP BY tone, kind, bucket",
+                (since,)
+            ).fetchall()
+            return rollups, latency
+
+        days = max(1, min(days, MAX_STATS_DAYS))
+        since = _day(time.time() - (days - 1) * 86400)
+        rollups, latency = await self._run(_stats, since)
+
+        buckets: Dict[tuple, List[int]] = {}
+        for row in latency:
+            counts = buckets.setdefault((row['tone'], row['kind']), [0] * (len(LATENCY_BUCKETS) + 1))
+            counts[row['bucket']] += row['events']
+
+        stats: Dict[str, Dict[str, Dict]] = {}
+        for row in rollups:
+            counts = buckets.get((row['tone'], row['kind']), [])
+            stats.setdefault(row['tone'], {})[row['kind']] = {
+                'events': row['events'],
+                'failures': row['failures'],
+                'prompt_tokens': row['prompt_tokens'],
+                'completion_tokens': row['completion_tokens'],
+                'cost': row['cost'],
+                'feedback_rounds': row['feedback_rounds'] / max(1, row['events'] - row['failures']),
+                'p50': _percentile(counts, 0.5),
+                'p95': _percentile(counts, 0.95)
+            }
+        return stats
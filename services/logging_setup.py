@@ -0,0 +1,156 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Tuple
+import config
+
+# Id of the Discord interaction currently being handled; copied into every
+# log record so all lines of one interaction can be correlated
+correlation_id: ContextVar[str] = ContextVar('correlation_id', default='-')
+
+# The file and stderr handlers set up by setup_logging, also used for the
+# records of worker processes
+_output_handlers: Tuple[logging.Handler, ...] = ()
+
+def set_correlation_id(value) -> None:
+    """Tag log records emitted by the current task (and tasks it starts)"""
+    correlation_id.set(str(value))
+
+class CorrelationIdFilter(logging.Filter):
+    """Attach the current correlation id to each record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Records from worker processes arrive with their id already set
+        if not hasattr(record, 'correlation_id'):
+            record.correlation_id = correlation_id.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of high-volume records.
+
+    Records logged with extra={'sample': True} pass with probability rate;
+    all other records always pass.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'sample', False):
+            return random.random() < self.rate
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'correlation_id': getattr(record, 'correlation_id', '-')
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def _file_handler() -> logging.Handler:
+    directory = os.path.dirname(config.LOG_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if config.LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            config.LOG_FILE,
+            when=config.LOG_ROTATE_WHEN,
+            backupCount=config.LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+    return logging.handlers.RotatingFileHandler(
+        config.LOG_FILE,
+        maxBytes=config.LOG_MAX_BYTES,
+        backupCount=config.LOG_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    Configure non-blocking logging for the bot.
+
+    Records are put on an in-memory queue by the calling thread and written
+    to the rotating log file and stderr by a QueueListener thread, so
+    logging never performs I/O on the event loop.
+    """
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+
+    file_handler = _file_handler()
+    if config.LOG_FORMAT == 'json':
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(levelname)s - [%(correlation_id)s] %(message)s'
+        ))
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(
+        '%(asctime)s - %(levelname)s - [%(correlation_id)s] %(message)s'
+    ))
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationIdFilter())
+    queue_handler.addFilter(SamplingFilter(config.LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.LOG_LEVEL)
+
+    global _output_handlers
+    _output_handlers = (file_handler, stream_handler)
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stream_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+def setup_worker_logging(log_queue) -> None:
+    """Send the log records of a worker process to the bot through log_queue"""
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationIdFilter())
+    queue_handler.addFilter(SamplingFilter(config.LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config.LOG_LEVEL)
+
+class _Dispatcher(logging.Handler):
+    """Hand records from another process to the logger they were logged on"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger(record.name).handle(record)
+
+def forward_worker_logs(log_queue) -> logging.handlers.QueueListener:
+    """
+    Write the records worker processes put on log_queue to the bot's log
+
+    The workers already filtered and sampled them, so they go straight to
+    the file and stderr handlers rather than through the root logger's
+    sampling filter again. Without setup_logging they are passed to the
+    loggers they were logged on.
+    """
+    handlers = _output_handlers or (_Dispatcher(),)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
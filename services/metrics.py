@@ -0,0 +1,364 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Default latency buckets in seconds, from fast local work up to slow gpt-4 calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Return the child metric for the given label values"""
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _default(self):
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.child.observe(self.elapsed)
+        return False
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def time(self) -> _Timer:
+        """Context manager observing the duration of its block"""
+        return _Timer(self)
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self) -> _Timer:
+        return self._default().time()
+
+    def _render_child(self, values, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(child.buckets, child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {child.count}")
+        plain = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{plain} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{plain} {child.count}")
+        return lines
+
+class _CallbackGauge:
+    """Gauge family whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name: str, documentation: str, labelname: Optional[str], callback: Callable[[], object]):
+        self.name = name
+        self.documentation = documentation
+        self.labelname = labelname
+        self.callback = callback
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning(f"Metric callback {self.name} failed: {str(e)}")
+            return lines
+        if isinstance(value, dict):
+            for label, sample in value.items():
+                lines.append(f'{self.name}{{{self.labelname}="{_escape(label)}"}} {_format_value(sample)}')
+        else:
+            lines.append(f"{self.name} {_format_value(value)}")
+        return lines
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name: str, documentation: str, callback: Callable[[], object], labelname: Optional[str] = None):
+        """Register a gauge read from callback (a number, or a dict keyed by labelname)"""
+        return self.register(_CallbackGauge(name, documentation, labelname, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    def take_changes(self) -> List[Tuple[str, Tuple[str, ...], object]]:
+        """
+        The counter and histogram samples recorded since the last call,
+        which are reset, as picklable (name, label values, sample) tuples.
+        Lets a worker process send what it recorded to the bot.
+        """
+        changes = []
+        for metric in list(self._metrics.values()):
+            if not isinstance(metric, (Counter, Histogram)):
+                continue
+            with metric._lock:
+                children, metric._children = metric._children, {}
+            for values, child in children.items():
+                if isinstance(child, _HistogramValue):
+                    if child.count:
+                        changes.append((metric.name, values, (child.counts, child.sum, child.count)))
+                elif child.value:
+                    changes.append((metric.name, values, child.value))
+        return changes
+
+    def add_changes(self, changes: List[Tuple[str, Tuple[str, ...], object]]):
+        """Add samples from take_changes in another process to these metrics"""
+        for name, values, sample in changes:
+            metric = self._metrics.get(name)
+            if metric is None:
+                continue
+            child = metric.labels(*values)
+            with metric._lock:
+                if isinstance(child, _HistogramValue):
+                    counts, total, count = sample
+                    child.counts = [a + b for a, b in zip(child.counts, counts)]
+                    child.sum += total
+                    child.count += count
+                else:
+                    child.inc(sample)
+
+REGISTRY = Registry()
+
+# Latency of the main stages of handling a command
+OPENAI_SECONDS = REGISTRY.histogram(
+    "tweetbot_openai_request_seconds", "Latency of OpenAI requests", ["operation"]
+)
+TIME_TO_FIRST_TWEET = REGISTRY.histogram(
+    "tweetbot_time_to_first_tweet_seconds", "Time from the streamed OpenAI request to its first complete tweet"
+)
+PARSE_SECONDS = REGISTRY.histogram(
+    "tweetbot_parse_seconds", "Time spent parsing model output into tweets"
+)
+TYPEFULLY_SECONDS = REGISTRY.histogram(
+    "tweetbot_typefully_request_seconds", "Latency of creating a Typefully draft"
+)
+DISCORD_SEND_SECONDS = REGISTRY.histogram(
+    "tweetbot_discord_send_seconds", "Latency of sending or editing Discord messages", ["kind"]
+)
+
+COMMANDS = REGISTRY.counter("tweetbot_commands_total", "Invocations per command", ["command"])
+ERRORS = REGISTRY.counter("tweetbot_errors_total", "Errors by location and exception type", ["where", "type"])
+REPAIRED_TWEETS = REGISTRY.counter("tweetbot_repaired_tweets_total", "Tweets regenerated because they failed validation")
+SHORTENED_TWEETS = REGISTRY.counter("tweetbot_shortened_tweets_total", "Tweets rewritten because they were over the length limit")
+POST_JOBS = REGISTRY.counter("tweetbot_post_jobs_total", "Typefully post job attempts by outcome", ["outcome"])
+POST_JOB_DELAY = REGISTRY.histogram(
+    "tweetbot_post_job_delay_seconds", "Time from a post job being due to its attempt starting",
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600, 21600)
+)
+OPENAI_ROUTE_SECONDS = REGISTRY.histogram(
+    "tweetbot_openai_route_seconds", "Latency of successful OpenAI requests by route and model", ["route", "model"]
+)
+OPENAI_ROUTE_TOKENS = REGISTRY.counter(
+    "tweetbot_openai_route_tokens_total", "Tokens used by route and model", ["route", "model"]
+)
+OPENAI_COST = REGISTRY.counter(
+    "tweetbot_openai_cost_usd_total", "Estimated OpenAI spend in USD by route and model", ["route", "model"]
+)
+OPENAI_FALLBACKS = REGISTRY.counter(
+    "tweetbot_openai_fallbacks_total", "Requests moved to a fallback model, by route, failed model and reason",
+    ["route", "model", "reason"]
+)
+GENERATION_WORKER_SECONDS = REGISTRY.histogram(
+    "tweetbot_generation_worker_seconds", "Round trip of calls to generation worker processes", ["method"]
+)
+GENERATION_WORKER_RESTARTS = REGISTRY.counter(
+    "tweetbot_generation_worker_restarts_total", "Generation worker pools replaced after a worker died"
+)
+THREAD_INDEX_SECONDS = REGISTRY.histogram(
+    "tweetbot_thread_index_seconds", "Time to search or add to the approved thread index", ["operation"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+OPENAI_HEDGES = REGISTRY.counter(
+    "tweetbot_openai_hedges_total", "Hedged OpenAI requests sent or skipped for lack of capacity, and how many answered first", ["route", "model", "outcome"]
+)
+OPENAI_TOKENS = REGISTRY.counter("tweetbot_openai_tokens_total", "Tokens reported by OpenAI", ["kind"])
+PROMPT_TOKENS = REGISTRY.counter("tweetbot_prompt_tokens_total", "Locally counted prompt tokens by section", ["section"])
+PROMPT_TOKENS_SAVED = REGISTRY.counter(
+    "tweetbot_prompt_tokens_saved_total", "Prompt tokens saved by normalizing the tone prompts"
+)
+
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "tweetbot_event_loop_lag_seconds",
+    "Delay between when the loop monitor should have woken and when it did",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+class StartupTimer:
+    """Records how long each phase of startup took, in the order marked"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self._last = self.started
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str):
+        """End the current phase, naming it phase"""
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def summary(self) -> str:
+        parts = [f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items()]
+        return f"{', '.join(parts)}; total {self._last - self.started:.2f}s"
+
+def record_error(where: str, error: BaseException):
+    """Count an error under where and the exception's type"""
+    ERRORS.labels(where, type(error).__name__).inc()
+
+class LoopMonitor:
+    """
+    Measures event loop lag by sleeping for a fixed interval and recording
+    how late the wake-up was. last_beat is updated on every tick, so a
+    stale value means the loop is blocked.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last_beat = time.monotonic()
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            # The loop wasn't being watched until now
+            self.last_beat = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - expected)
+            self.last_beat = time.monotonic()
+            EVENT_LOOP_LAG.observe(self.last_lag)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
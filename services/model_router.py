@@ -0,0 +1,356 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+import openai
+import config
+from . import metrics
+from .deadline import Deadline, DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# USD per 1K prompt and completion tokens, used to track the cost of each
+# route; extend or override with OPENAI_MODEL_PRICES
+MODEL_PRICES = {
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-turbo': (0.01, 0.03),
+    'gpt-4o': (0.0025, 0.01),
+    'gpt-4o-mini': (0.00015, 0.0006),
+    'gpt-3.5-turbo': (0.0005, 0.0015)
+}
+
+# Used unless OPENAI_ROUTES is set: edits of existing tweets and short
+# threads go to a cheaper, faster model, everything else to OPENAI_MODEL
+DEFAULT_RULES = [
+    {'name': 'edit', 'operation': ['revise', 'shorten', 'repair'], 'model': 'gpt-4o-mini'},
+    {'name': 'short', 'operation': 'create', 'max_length': 2, 'model': 'gpt-4o-mini'}
+]
+
+# Operations a request can be routed by
+OPERATIONS = ('create', 'revise', 'shorten', 'repair')
+
+# Recent latencies kept per route and model to derive the hedging delay
+LATENCY_WINDOW = 200
+
+def should_fall_back(error: BaseException) -> bool:
+    """Whether another model might succeed where this attempt failed"""
+    return isinstance(error, (
+        asyncio.TimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+        openai.RateLimitError,
+        openai.NotFoundError
+    ))
+
+class Route:
+    """The models a request is sent to, in order of preference"""
+
+    def __init__(self, name: str, models: List[str], temperature: float, timeout: float):
+        self.name = name
+        self.models = models
+        self.temperature = temperature
+        self.timeout = timeout
+
+    @property
+    def model(self) -> str:
+        """The primary model"""
+        return self.models[0]
+
+    def __repr__(self):
+        return f"Route({self.name!r}, {self.models!r})"
+
+class Hedge:
+    """
+    What the second request of a hedged request needs.
+
+    reserve is awaited right before the second request would be sent and
+    returns whether capacity for it was taken, without waiting for any;
+    when it wasn't, the request isn't hedged. release is called once the
+    second request is done. The request that loses is cancelled before
+    OpenAI reports its usage, so its estimated prompt tokens and their
+    cost are counted instead and passed to charge.
+    """
+
+    def __init__(
+        self,
+        prompt_tokens: int,
+        reserve: Callable[[], Awaitable[bool]],
+        release: Callable[[], None],
+        charge: Optional[Callable[[int, float], None]] = None
+    ):
+        self.prompt_tokens = prompt_tokens
+        self.reserve = reserve
+        self.release = release
+        self.charge = charge
+
+class ModelRouter:
+    """
+    Picks the model for each OpenAI request and falls back to the next one
+    when it is slow or failing.
+
+    Rules are checked in order and the first whose conditions all match
+    wins; requests matching no rule use the default route. A rule is a
+    dict with a model and any of:
+
+        name         Label for logs and metrics (defaults to the model)
+        operation    One or a list of 'create', 'revise', 'shorten', 'repair'
+        tone         One or a list of tones
+        min_length   Minimum thread length
+        max_length   Maximum thread length
+        fallback     Models to try next, in order (defaults to the default model)
+        temperature  Sampling temperature
+        timeout      Seconds to wait for a model before falling back
+
+    Requests that may be hedged get a second, identical request once the
+    first has taken longer than hedge_percentile of the recent latencies
+    of its route and model; whichever answers first is used and the other
+    is cancelled. Hedging starts after hedge_min_samples requests, and only
+    when the Hedge of the request can reserve capacity for the second one.
+    """
+
+    def __init__(
+        self,
+        rules: List[Dict],
+        default_model: str,
+        fallback_models: List[str],
+        temperature: float = 0.7,
+        timeout: float = 60.0,
+        prices: Optional[Dict[str, Tuple[float, float]]] = None,
+        hedge_percentile: float = 0.0,
+        hedge_min_samples: int = 20
+    ):
+        self.default = Route('default', self._models(default_model, fallback_models), temperature, timeout)
+        self.rules = [self._compile(rule) for rule in rules]
+        self.prices = dict(MODEL_PRICES, **(prices or {}))
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = {}
+        self._overrides: Dict[Tuple[str, str], Route] = {}
+
+    @property
+    def models(self) -> List[str]:
+        """Every model a request can be routed to"""
+        models = list(self.default.models)
+        for rule in self.rules:
+            models.extend(model for model in rule['route'].models if model not in models)
+        return models
+
+    @classmethod
+    def from_config(cls) -> 'ModelRouter':
+        rules = json.loads(config.OPENAI_ROUTES) if config.OPENAI_ROUTES else DEFAULT_RULES
+        prices = json.loads(config.OPENAI_MODEL_PRICES) if config.OPENAI_MODEL_PRICES else None
+        return cls(
+            rules,
+            config.OPENAI_MODEL,
+            config.OPENAI_FALLBACK_MODELS,
+            temperature=config.OPENAI_TEMPERATURE,
+            timeout=config.OPENAI_ROUTE_TIMEOUT,
+            prices=prices,
+            hedge_percentile=config.OPENAI_HEDGE_PERCENTILE,
+            hedge_min_samples=config.OPENAI_HEDGE_MIN_SAMPLES
+        )
+
+    @staticmethod
+    def _models(primary: str, fallback: List[str]) -> List[str]:
+        models = [primary]
+        models.extend(model for model in fallback if model not in models)
+        return models
+
+    @staticmethod
+    def _values(value) -> Optional[frozenset]:
+        if value is None:
+            return None
+        return frozenset([value] if isinstance(value, str) else value)
+
+    def _compile(self, rule: Dict) -> Dict:
+        operations = self._values(rule.get('operation'))
+        if operations is not None and not operations <= set(OPERATIONS):
+            raise ValueError(f"Unknown operation in model route {rule}")
+        fallback = rule.get('fallback')
+        if fallback is None:
+            fallback = self.default.models
+        route = Route(
+            rule.get('name') or rule['model'],
+            self._models(rule['model'], fallback),
+            float(rule.get('temperature', self.default.temperature)),
+            float(rule.get('timeout', self.default.timeout))
+        )
+        return {
+            'operation': operations,
+            'tone': self._values(rule.get('tone')),
+            'min_length': rule.get('min_length'),
+            'max_length': rule.get('max_length'),
+            'route': route
+        }
+
+    def route(self, operation: str, tone: str = 'normal', length: Optional[int] = None) -> Route:
+        """The route of a request for operation on a thread in tone of length tweets"""
+        for rule in self.rules:
+            if rule['operation'] is not None and operation not in rule['operation']:
+                continue
+            if rule['tone'] is not None and tone not in rule['tone']:
+                continue
+            if rule['min_length'] is not None and (length is None or length < rule['min_length']):
+                continue
+            if rule['max_length'] is not None and (length is None or length > rule['max_length']):
+                continue
+            return rule['route']
+        return self.default
+
+    def with_model(self, route: Route, model: str) -> Route:
+        """route with model tried first and the route's models as its fallbacks"""
+        if route.model == model:
+            return route
+        key = (route.name, model)
+        override = self._overrides.get(key)
+        if override is None:
+            override = self._overrides[key] = Route(
+                route.name, self._models(model, route.models), route.temperature, route.timeout
+            )
+        return override
+
+    async def call(
+        self,
+        route: Route,
+        create: Callable[[str, float], Awaitable[Any]],
+        deadline: Optional[Deadline] = None,
+        hedge: Optional[Hedge] = None
+    ) -> Tuple[Any, str]:
+        """
+        Await create(model, temperature) for each model of route until one succeeds
+
+        An attempt that takes longer than the route's timeout, can't connect,
+        or gets a server error, rate limit or unknown model response moves on
+        to the next model; other errors are raised right away.
+
+        Args:
+            route: The route of the request
+            create: Starts the request for a model and temperature
+            deadline: Attempts are cut short when it passes
+            hedge: Set if a slow attempt may be hedged; only for requests
+                that are safe to send twice
+
+        Returns:
+            A tuple of (result, model) for the model that answered
+
+        Raises:
+            DeadlineExceeded: If the deadline passed before a model answered
+            The error of the last model if every model failed
+        """
+        for attempt, model in enumerate(route.models):
+            timeout = route.timeout
+            limited = deadline is not None and deadline.remaining() < timeout
+            if limited:
+                if deadline.expired:
+                    raise DeadlineExceeded(f"No time left to call {model}")
+                timeout = deadline.remaining()
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(self._attempt(route, model, create, hedge), timeout)
+            except Exception as e:
+                if limited and isinstance(e, asyncio.TimeoutError):
+                    raise DeadlineExceeded(f"{model} did not answer before the deadline") from None
+                if not should_fall_back(e) or attempt + 1 == len(route.models):
+                    raise
+                reason = 'timeout' if isinstance(e, asyncio.TimeoutError) else type(e).__name__
+                metrics.OPENAI_FALLBACKS.labels(route.name, model, reason).inc()
+                logger.warning(
+                    f"Model {model} failed for route {route.name} ({reason}), "
+                    f"falling back to {route.models[attempt + 1]}"
+                )
+                continue
+            metrics.OPENAI_ROUTE_SECONDS.labels(route.name, model).observe(time.perf_counter() - started)
+            return result, model
+
+    def hedge_delay(self, route: Route, model: str) -> Optional[float]:
+        """Seconds after which a request is hedged, or None while there are too few samples"""
+        latencies = self._latencies.get((route.name, model))
+        if not self.hedge_percentile or latencies is None or len(latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    async def _attempt(
+        self,
+        route: Route,
+        model: str,
+        create: Callable[[str, float], Awaitable[Any]],
+        hedge: Optional[Hedge]
+    ):
+        latencies = self._latencies.setdefault((route.name, model), deque(maxlen=LATENCY_WINDOW))
+
+        async def request(first: bool = True):
+            started = time.perf_counter()
+            try:
+                result = await create(model, route.temperature)
+            except asyncio.CancelledError:
+                # A first request cut short by its hedge or a timeout took at
+                # least this long; leaving it out would only keep the fast ones
+                if first:
+                    latencies.append(time.perf_counter() - started)
+                raise
+            latencies.append(time.perf_counter() - started)
+            return result
+
+        delay = self.hedge_delay(route, model) if hedge is not None else None
+        if delay is None:
+            return await request()
+
+        first = asyncio.ensure_future(request())
+        pending = {first}
+        hedged = False
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                if await hedge.reserve():
+                    logger.info(f"Hedging a {route.name} request to {model} after {delay:.1f}s")
+                    metrics.OPENAI_HEDGES.labels(route.name, model, 'sent').inc()
+                    hedged = True
+                    pending.add(asyncio.ensure_future(request(first=False)))
+                else:
+                    metrics.OPENAI_HEDGES.labels(route.name, model, 'skipped').inc()
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            metrics.OPENAI_HEDGES.labels(route.name, model, 'won').inc()
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # The slower request (or both, when cut short) is no longer needed
+            for task in pending:
+                task.cancel()
+            if hedged:
+                hedge.release()
+                cost = self.record_prompt_tokens(route, model, hedge.prompt_tokens)
+                if hedge.charge is not None:
+                    hedge.charge(hedge.prompt_tokens, cost)
+
+    def record_usage(self, route: Route, model: str, usage) -> float:
+        """Count the tokens and estimated cost of a request under its route and model, returning the cost"""
+        if usage is None:
+            return 0.0
+        metrics.OPENAI_ROUTE_TOKENS.labels(route.name, model).inc(usage.total_tokens)
+        prompt_price, completion_price = self._price(model)
+        cost = (usage.prompt_tokens * prompt_price + usage.completion_tokens * completion_price) / 1000
+        metrics.OPENAI_COST.labels(route.name, model).inc(cost)
+        return cost
+
+    def record_prompt_tokens(self, route: Route, model: str, tokens: int) -> float:
+        """Count prompt tokens of a request whose usage is unknown, like a cancelled one, returning their cost"""
+        metrics.OPENAI_ROUTE_TOKENS.labels(route.name, model).inc(tokens)
+        cost = tokens * self._price(model)[0] / 1000
+        metrics.OPENAI_COST.labels(route.name, model).inc(cost)
+        return cost
+
+    def _price(self, model: str) -> Tuple[float, float]:
+        # Dated snapshots like gpt-4o-mini-2024-07-18 are priced as their base model
+        for name in sorted(self.prices, key=len, reverse=True):
+            if model == name or model.startswith(f"{name}-"):
+                return tuple(self.prices[name])
+        return 0.0, 0.0
@@ -0,0 +1,405 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import aiohttp
+from .sqlite_store import SQLiteStore
+from .circuit_breaker import CircuitBreakerOpen
+from .timer_queue import TimerQueue
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for jobs queued by other processes (e.g. shards
+# running in another process); jobs queued here are timed directly
+SYNC_INTERVAL = 30.0
+# Most jobs claimed in one go
+CLAIM_LIMIT = 100
+# Seconds the worker pauses after an unexpected error
+ERROR_DELAY = 5.0
+# Error of jobs that were being posted when the bot stopped
+INTERRUPTED_ERROR = "Interrupted by a restart; the draft may already be on Typefully"
+
+class PostQueue(SQLiteStore):
+    """
+    Persistent queue of threads waiting to be posted to Typefully.
+
+    Each job has an idempotency key derived from the preview message and
+    the thread content, so finalizing the same preview twice (double
+    clicks, retries after a restart) always maps to the same job and
+    never creates a second draft.
+
+    Jobs with a publish_at time are scheduled posts: they become due a
+    little before that time and are handed to Typefully to publish then.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS post_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER,
+            tweets TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            draft_url TEXT,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            publish_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_post_jobs_due ON post_jobs (status, next_attempt_at);
+    """
+    COLUMNS = (('post_jobs', 'publish_at', 'REAL'),)
+
+    @staticmethod
+    def idempotency_key(message_id: int, tweets: List[str]) -> str:
+        """Key identifying one post of one version of a preview"""
+        payload = json.dumps({'message_id': message_id, 'tweets': tweets}, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def enqueue(
+        self,
+        message_id: int,
+        user_id: int,
+        channel_id: Optional[int],
+        tweets: List[str],
+        publish_at: Optional[float] = None,
+        lead: float = 0.0
+    ) -> Tuple[Dict, bool]:
+        """
+        Queue a thread for posting unless the same post is already queued or done
+
+        A job that previously failed is queued again, and a pending job is
+        moved to the new publish time.
+
+        Args:
+            message_id: The preview message of the thread
+            user_id: Discord user posting the thread
+            channel_id: Channel of the preview
+            tweets: The thread
+            publish_at: When Typefully should publish the thread (a Unix
+                time), or None to create a draft right away
+            lead: Seconds before publish_at the job is due, so Typefully
+                has it in time
+
+        Returns:
+            A tuple of (job, queued) where queued is False if an existing
+            job was returned as is
+        """
+        key = self.idempotency_key(message_id, tweets)
+
+        def _enqueue(conn, key, message_id, user_id, channel_id, payload, publish_at, due):
+            now = time.time()
+            due = now if due is None else due
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO post_jobs "
+                "(idempotency_key, message_id, user_id, channel_id, tweets, next_attempt_at, "
+                "created_at, updated_at, publish_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, message_id, user_id, channel_id, payload, due, now, now, publish_at)
+            ).rowcount
+            requeued = 0
+            if not inserted:
+                requeued = conn.execute(
+                    "UPDATE post_jobs SET status = 'pending', attempts = 0, next_attempt_at = ?, "
+                    "publish_at = ?, updated_at = ? WHERE idempotency_key = ? AND status = 'failed'",
+                    (due, publish_at, now, key)
+                ).rowcount or conn.execute(
+                    "UPDATE post_jobs SET next_attempt_at = ?, publish_at = ?, updated_at = ? "
+                    "WHERE idempotency_key = ? AND status = 'pending' AND publish_at IS NOT ?",
+                    (due, publish_at, now, key, publish_at)
+                ).rowcount
+            row = conn.execute("SELECT * FROM post_jobs WHERE idempotency_key = ?", (key,)).fetchone()
+            return row, bool(inserted or requeued)
+
+        due = None if publish_at is None else publish_at - lead
+        row, queued = await self._run(
+            _enqueue, key, message_id, user_id, channel_id, json.dumps(tweets), publish_at, due
+        )
+        return self._to_job(row), queued
+
+    async def claim(self, job_ids: List[int], until: float) -> List[Dict]:
+        """
+        Mark the given jobs as running and return them, in one transaction
+
+        Only jobs still pending and due by until are claimed; the others
+        were finished, claimed by another process or rescheduled since.
+        """
+        def _claim(conn, job_ids, now, until):
+            marks = ", ".join("?" * len(job_ids))
+            rows = conn.execute(
+                f"SELECT id FROM post_jobs WHERE id IN ({marks}) AND status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at",
+                (*job_ids, until)
+            ).fetchall()
+            for row in rows:
+                conn.execute(
+                    "UPDATE post_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (now, row['id'])
+                )
+            return [conn.execute("SELECT * FROM post_jobs WHERE id = ?", (row['id'],)).fetchone() for row in rows]
+        if not job_ids:
+            return []
+        return [self._to_job(row) for row in await self._run(_claim, job_ids, time.time(), until)]
+
+    async def pending(self, updated_since: float = 0.0) -> List[Tuple[int, float]]:
+        """(id, due time) of the pending jobs updated since the given time"""
+        def _pending(conn, updated_since):
+            return [
+                (row['id'], row['next_attempt_at']) for row in conn.execute(
+                    "SELECT id, next_attempt_at FROM post_jobs WHERE status = 'pending' AND updated_at >= ?",
+                    (updated_since,)
+                )
+            ]
+        return await self._run(_pending, updated_since)
+
+    async def complete(self, job_id: int, draft_url: str):
+        await self._set(job_id, status='done', draft_url=draft_url, last_error=None)
+
+    async def retry(self, job_id: int, delay: float, error: str) -> float:
+        """Return a job to the queue for another attempt after delay seconds, returning when it is due"""
+        due = time.time() + delay
+        await self._set(job_id, status='pending', next_attempt_at=due, last_error=error)
+        return due
+
+    async def fail(self, job_id: int, error: str):
+        await self._set(job_id, status='failed', last_error=error)
+
+    async def fail_interrupted(self, error: str) -> List[Dict]:
+        """
+        Mark jobs left running by a crash as failed and return them
+
+        Their attempt may have created the draft before the crash, and the
+        idempotency key is never sent to Typefully, so posting them again
+        could create a duplicate. They are left for the user to check and
+        finalize again, which queues them anew.
+        """
+        def _fail(conn, error, now):
+            rows = conn.execute("SELECT * FROM post_jobs WHERE status = 'running'").fetchall()
+            conn.execute(
+                "UPDATE post_jobs SET status = 'failed', last_error = ?, updated_at = ? WHERE status = 'running'",
+                (error, now)
+            )
+            return rows
+        rows = await self._run(_fail, error, time.time())
+        jobs = [self._to_job(row) for row in rows]
+        for job in jobs:
+            job.update(status='failed', last_error=error)
+        return jobs
+
+    async def prune(self, max_age: float) -> int:
+        """Delete finished jobs not updated for max_age seconds, returning the count"""
+        def _prune(conn, cutoff):
+            return conn.execute(
+                "DELETE FROM post_jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+            ).rowcount
+        return await self._run(_prune, time.time() - max_age)
+
+    async def _set(self, job_id: int, **fields):
+        def _update(conn, job_id, fields):
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            conn.execute(
+                f"UPDATE post_jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                (*fields.values(), time.time(), job_id)
+            )
+        await self._run(_update, job_id, fields)
+
+    @staticmethod
+    def _to_job(row) -> Dict:
+        job = dict(row)
+        job['tweets'] = json.loads(job['tweets'])
+        return job
+
+class PostWorker:
+    """
+    Background task posting queued threads to Typefully.
+
+    Failures where the draft cannot have been created (connection errors,
+    429/503 responses, an open circuit breaker) are retried with jittered
+    exponential backoff. Any other failure may have reached Typefully, so
+    the job is marked failed instead of risking a duplicate draft.
+
+    Callers can wait a short while for a job with wait(); if nobody is
+    waiting when a job finishes, on_done is awaited with the job so the
+    user can be notified some other way.
+
+    Pending jobs are kept in a timer queue and the worker sleeps until the
+    next one is due, so thousands of scheduled posts cost no polling. All
+    jobs due within batch_window seconds of each other are claimed in one
+    transaction and posted together. On start, every pending job is
+    loaded; jobs whose time passed while the bot was down are due at once.
+    Jobs that were being posted when the bot stopped are marked failed
+    and reported through on_done, since their draft may already exist.
+    """
+
+    def __init__(
+        self,
+        queue: PostQueue,
+        scheduler,
+        on_done: Callable[[Dict], Awaitable[None]],
+        max_attempts: int = 8,
+        retry_base: float = 5.0,
+        retry_max: float = 300.0,
+        concurrency: int = 4,
+        batch_window: float = 5.0
+    ):
+        self.queue = queue
+        self.scheduler = scheduler
+        self.on_done = on_done
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.concurrency = concurrency
+        self.batch_window = batch_window
+        self.timers = TimerQueue()
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._synced_at = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def add(self, job: Dict):
+        """Time a job that was just queued or rescheduled"""
+        if job['status'] == 'pending':
+            self.timers.push(job['id'], job['next_attempt_at'])
+
+    async def wait(self, job_id: int, timeout: float) -> Optional[Dict]:
+        """
+        Wait up to timeout seconds for a job to finish
+
+        Returns:
+            The finished job, or None if it is still queued; on_done is
+            then called for it instead when it finishes
+        """
+        future = self._waiters.get(job_id)
+        if future is None:
+            future = self._waiters[job_id] = asyncio.get_running_loop().create_future()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if self._waiters.get(job_id) is future and not future.done():
+                del self._waiters[job_id]
+
+    async def _run(self):
+        await self._report_interrupted()
+        while True:
+            try:
+                if time.time() - self._synced_at >= SYNC_INTERVAL:
+                    await self._sync()
+                until = time.time() + self.batch_window
+                due = self.timers.pop_due(until, CLAIM_LIMIT)
+                if due:
+                    jobs = await self.queue.claim(due, until)
+                    if jobs:
+                        logger.info(f"Posting {len(jobs)} due jobs")
+                        semaphore = asyncio.Semaphore(self.concurrency)
+                        await asyncio.gather(*(self._process(job, semaphore) for job in jobs))
+                    continue
+            except Exception as e:
+                logger.error(f"Post worker error: {str(e)}", exc_info=True)
+                # Jobs taken off the timer queue may not have been claimed;
+                # reload every pending job on the next round
+                self._synced_at = 0.0
+                await asyncio.sleep(ERROR_DELAY)
+                continue
+            await self.timers.wait(max(0.0, self._synced_at + SYNC_INTERVAL - time.time()))
+
+    async def _report_interrupted(self):
+        try:
+            jobs = await self.queue.fail_interrupted(INTERRUPTED_ERROR)
+        except Exception as e:
+            logger.error(f"Failed to check for interrupted post jobs: {str(e)}", exc_info=True)
+            return
+        for job in jobs:
+            logger.error(
+                f"Post job {job['id']} (preview {job['message_id']}) was interrupted by a restart; "
+                "check Typefully for its draft before posting it again"
+            )
+            metrics.POST_JOBS.labels('interrupted').inc()
+            job['seconds'] = 0.0
+            await self._finish(job)
+
+    async def _sync(self):
+        """Time the pending jobs changed since the last sync, by this or another process"""
+        started = time.time()
+        # Overlap the previous sync a little, so a job updated during it isn't missed
+        pending = await self.queue.pending(self._synced_at - 1.0 if self._synced_at else 0.0)
+        for job_id, due in pending:
+            self.timers.push(job_id, due)
+        if not self._synced_at and pending:
+            overdue = sum(1 for _, due in pending if due <= started)
+            logger.info(f"Loaded {len(pending)} pending post jobs ({overdue} overdue)")
+        self._synced_at = started
+
+    async def _process(self, job: Dict, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            metrics.POST_JOB_DELAY.observe(max(0.0, time.time() - job['next_attempt_at']))
+            await self._post(job)
+
+    async def _post(self, job: Dict):
+        started = time.perf_counter()
+        try:
+            draft_url = await self.scheduler.schedule_thread(
+                job['tweets'], user_id=job['user_id'], publish_at=job['publish_at']
+            )
+        except Exception as e:
+            error = str(e)
+            if self.is_retryable(e) and job['attempts'] < self.max_attempts:
+                delay = random.uniform(0, min(self.retry_max, self.retry_base * (2 ** job['attempts'])))
+                logger.warning(
+                    f"Post job {job['id']} failed ({error}), retrying in {delay:.0f}s "
+                    f"(attempt {job['attempts']}/{self.max_attempts})"
+                )
+                self.timers.push(job['id'], await self.queue.retry(job['id'], delay, error))
+                metrics.POST_JOBS.labels('retried').inc()
+                return
+            logger.error(f"Post job {job['id']} failed after {job['attempts']} attempts: {error}")
+            await self.queue.fail(job['id'], error)
+            job.update(status='failed', last_error=error, seconds=time.perf_counter() - started)
+            metrics.POST_JOBS.labels('failed').inc()
+        else:
+            logger.info(f"Post job {job['id']} completed")
+            await self.queue.complete(job['id'], draft_url)
+            job.update(status='done', draft_url=draft_url, seconds=time.perf_counter() - started)
+            metrics.POST_JOBS.labels('done').inc()
+        await self._finish(job)
+
+    async def _finish(self, job: Dict):
+        """Hand a finished job to its waiter, or to on_done if nobody is waiting"""
+        future = self._waiters.pop(job['id'], None)
+        if future is not None and not future.done():
+            future.set_result(job)
+            return
+        try:
+            await self.on_done(job)
+        except Exception as e:
+            logger.error(f"Failed to report post job {job['id']}: {str(e)}", exc_info=True)
+
+    @staticmethod
+    def is_retryable(error: BaseException) -> bool:
+        """Whether Typefully certainly did not create a draft for the failed attempt"""
+        cause = error.__cause__ or error
+        if isinstance(cause, CircuitBreakerOpen):
+            return True
+        if isinstance(cause, aiohttp.ClientResponseError):
+            return cause.status in (429, 503)
+        return isinstance(cause, aiohttp.ClientConnectorError)
@@ -0,0 +1,95 @@
+import functools
+import re
+from typing import Dict, List, Optional
+from .tone_settings import TONE_SETTINGS, ToneType
+from .tokens import count_tokens
+
+# Instructions shared by every request. They live in the system message,
+# after the tone, so everything before the user message is identical for
+# all calls with the same tone and can be served from OpenAI's prompt cache.
+GENERATION_RULES = "\n".join([
+    "Rules for every thread:",
+    "- Each tweet stays within 280 characters; links count as 23.",
+    "- Mention every required keyword and tag every listed account somewhere in the thread.",
+    "- Work an important link naturally into the most relevant tweet."
+])
+
+# Request-specific part of a generation prompt; optional lines are dropped
+# when their field is empty
+REQUEST_TEMPLATE = (
+    ("main", "Main Topic: {main}"),
+    ("context", "Context: {context}"),
+    ("keywords", "Required Keywords: {keywords}"),
+    ("tags", "Accounts to Tag: {tags}"),
+    ("link", "Important Link to Include: {link}"),
+    ("length", "Thread Length: exactly {length} tweets")
+)
+
+RESPONSE_FORMAT = "Format the response as a numbered list of tweets."
+
+EXAMPLES_HEADER = "Approved threads on similar topics, to match their style (don't copy them):"
+
+def normalize_prompt(text: str) -> str:
+    """Collapse runs of whitespace and drop blank lines, which only cost tokens"""
+    lines = (re.sub(r'\s+', ' ', line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+def _tone(tone: str) -> str:
+    return tone if tone in TONE_SETTINGS else "normal"
+
+def _tone_text(tone: str, tone_prompt: Optional[str]) -> str:
+    return tone_prompt if tone_prompt is not None else TONE_SETTINGS[_tone(tone)]
+
+@functools.lru_cache(maxsize=256)
+def system_prompt(tone: ToneType = "normal", tone_prompt: Optional[str] = None) -> str:
+    """
+    Normalized system prompt for a tone, built once per tone
+
+    Args:
+        tone: A built-in tone
+        tone_prompt: A guild's own prompt for the tone, used instead of the built-in one
+    """
+    return f"{normalize_prompt(_tone_text(tone, tone_prompt))}\n\n{GENERATION_RULES}"
+
+def generation_prompt(request: Dict, examples: Optional[List[Dict]] = None) -> str:
+    """User message for generating a thread from a /create request, with optional example threads"""
+    values = {
+        'main': request['main'],
+        'context': request['context'],
+        'keywords': ", ".join(request.get('keywords') or []),
+        'tags': ", ".join(request.get('tags') or []),
+        'link': request.get('link') or "",
+        'length': request['length']
+    }
+    lines: List[str] = ["Create a Twitter thread with the following requirements:"]
+    lines.extend(template.format(**values) for field, template in REQUEST_TEMPLATE if values[field])
+    if examples:
+        lines.append(EXAMPLES_HEADER)
+        for number, example in enumerate(examples, 1):
+            lines.append(f"Example {number}:")
+            lines.extend(f"- {normalize_prompt(tweet)}" for tweet in example['tweets'])
+    lines.append(RESPONSE_FORMAT)
+    return "\n".join(lines)
+
+@functools.lru_cache(maxsize=256)
+def _static_tokens(tone_text: str, model: str) -> Dict[str, int]:
+    raw = count_tokens(tone_text, model)
+    normalized = count_tokens(normalize_prompt(tone_text), model)
+    return {
+        'tone': normalized,
+        'rules': count_tokens(GENERATION_RULES, model),
+        'saved': max(0, raw - normalized)
+    }
+
+def measure_prompt(tone: ToneType, prompt: str, model: str, tone_prompt: Optional[str] = None) -> Dict[str, int]:
+    """
+    Token counts of the sections of a request's prompt
+
+    Returns:
+        A dict with the tokens of the tone, rules (both part of the static
+        prefix) and request sections, plus the tokens saved by normalizing
+        the tone prompt compared to sending it verbatim
+    """
+    sections = dict(_static_tokens(_tone_text(tone, tone_prompt), model))
+    sections['request'] = count_tokens(prompt, model)
+    return sections
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds between queue position updates sent to a waiting caller
+QUEUE_NOTIFY_INTERVAL = 2.0
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at rate_per_minute.
+
+    Waiters are served in FIFO order. A request larger than the bucket's
+    capacity waits for a full bucket instead of blocking forever.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> float:
+        """
+        Wait until amount tokens are available and take them
+
+        Returns:
+            The number of seconds spent waiting
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take amount tokens if they are available now, without waiting"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def adjust(self, amount: float):
+        """Correct the bucket after the fact, e.g. when actual usage differs from the estimate"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+class _Ticket:
+    __slots__ = ('user_id', 'tokens', 'future')
+
+    def __init__(self, user_id, tokens: float, future: asyncio.Future):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.future = future
+
+class FairRateLimiter:
+    """
+    Client-side limiter for a provider's requests/min and tokens/min limits.
+
+    Callers wait in per-user queues that are served round-robin, so one user
+    (or one large batch) can't starve everyone else. A single dispatcher
+    task hands out capacity from the token buckets in that order.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, tokens_per_minute: Optional[float] = None):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._queues: "OrderedDict[object, Deque[_Ticket]]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        # Ticket that is next in line and waiting for bucket capacity
+        self._serving: Optional[_Ticket] = None
+
+    @property
+    def queued(self) -> int:
+        """Number of callers currently waiting"""
+        waiting = sum(len(queue) for queue in self._queues.values())
+        return waiting + (1 if self._serving is not None else 0)
+
+    def position(self, ticket: _Ticket) -> int:
+        """1-based position of a ticket in the round-robin service order"""
+        if ticket is self._serving:
+            return 1
+        for user_order, (user_id, queue) in enumerate(self._queues.items()):
+            if user_id == ticket.user_id:
+                try:
+                    ticket_round = queue.index(ticket)
+                except ValueError:
+                    return 0
+                break
+        else:
+            return 0
+
+        ahead = 0
+        for order, queue in enumerate(self._queues.values()):
+            # Users earlier in the rotation get one extra turn per round
+            ahead += min(len(queue), ticket_round + (1 if order < user_order else 0))
+        return ahead + (2 if self._serving is not None else 1)
+
+    async def acquire(
+        self,
+        user_id=None,
+        tokens: float = 0,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None
+    ):
+        """
+        Wait for this user's turn and for provider capacity
+
+        Args:
+            user_id: Key used for fair queueing (None shares one queue)
+            tokens: Estimated tokens the request will use
+            on_queued: Awaited with the caller's queue position while it waits
+        """
+        loop = asyncio.get_running_loop()
+        ticket = _Ticket(user_id, tokens, loop.create_future())
+        self._queues.setdefault(user_id, deque()).append(ticket)
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        last_position = None
+        try:
+            while True:
+                done, _ = await asyncio.wait({ticket.future}, timeout=QUEUE_NOTIFY_INTERVAL)
+                if done:
+                    return ticket.future.result()
+                position = self.position(ticket)
+                if on_queued is not None and position and position != last_position:
+                    last_position = position
+                    try:
+                        await on_queued(position)
+                    except Exception as e:
+                        logger.warning(f"{self.name} queue notification failed: {str(e)}")
+        finally:
+            if not ticket.future.done():
+                # The caller gave up; the dispatcher will skip this ticket
+                ticket.future.cancel()
+
+    def try_acquire(self, tokens: float = 0) -> bool:
+        """
+        Take capacity for a request now, without queueing
+
+        Fails while anyone is waiting, so the request never gets ahead of
+        them, or when the buckets don't have the capacity right now.
+        """
+        if self.queued or not self.requests.try_acquire(1):
+            return False
+        if self.tokens is not None and tokens and not self.tokens.try_acquire(tokens):
+            self.requests.adjust(-1)
+            return False
+        return True
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        while self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            del self._queues[user_id]
+            if queue:
+                # Move the user to the back of the rotation
+                self._queues[user_id] = queue
+            if not ticket.future.done():
+                return ticket
+        return None
+
+    async def _dispatch(self):
+        while True:
+            ticket = self._next_ticket()
+            if ticket is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            self._serving = ticket
+            try:
+                waited = await self.requests.acquire(1)
+                if self.tokens is not None and ticket.tokens:
+                    waited += await self.tokens.acquire(ticket.tokens)
+            finally:
+                self._serving = None
+            if waited:
+                logger.info(f"{self.name} rate limit delayed a request by {waited:.1f}s")
+            if not ticket.future.done():
+                ticket.future.set_result(None)
+
+    def record_usage(self, estimated: float, actual: float):
+        """Charge the difference between actual and estimated token usage"""
+        if self.tokens is not None and actual:
+            self.tokens.adjust(actual - estimated)
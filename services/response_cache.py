@@ -0,0 +1,123 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from .sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+class _DiskTier(SQLiteStore):
+    """On-disk cache tier so responses survive restarts"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_expires_at ON responses (expires_at);
+    """
+
+    async def get(self, key: str) -> Optional[Tuple[List, float]]:
+        def _get(conn, key):
+            row = conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+            return (json.loads(row['value']), row['expires_at']) if row else None
+        return await self._run(_get, key)
+
+    async def set(self, key: str, value: List, expires_at: float):
+        def _set(conn, key, value, expires_at):
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        await self._run(_set, key, value, expires_at)
+
+class ResponseCache:
+    """
+    Two-tier cache of generated threads.
+
+    Entries are keyed on a hash of everything that determines the model
+    output (system prompt, user prompt and model parameters). The memory
+    tier is a bounded LRU; the optional disk tier is only consulted on a
+    memory miss. Both tiers expire entries after ttl seconds.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[List, float]]" = OrderedDict()
+        self._disk = _DiskTier(path) if path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(system_prompt: str, prompt: str, params: Dict) -> str:
+        """Build a canonical content hash for a generation request"""
+        payload = json.dumps(
+            {'system': system_prompt, 'prompt': prompt, 'params': params},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[List]:
+        """Return the cached tweets for key, or None on a miss"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > time.time():
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return list(value)
+            del self._memory[key]
+
+        if self._disk is not None:
+            try:
+                entry = await self._disk.get(key)
+            except Exception as e:
+                logger.warning(f"Response cache disk lookup failed: {str(e)}")
+                entry = None
+            if entry is not None:
+                self._remember(key, *entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return list(entry[0])
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: List):
+        """Store tweets for key in both tiers"""
+        expires_at = time.time() + self.ttl
+        self._remember(key, list(value), expires_at)
+        if self._disk is not None:
+            try:
+                await self._disk.set(key, value, expires_at)
+            except Exception as e:
+                logger.warning(f"Response cache disk write failed: {str(e)}")
+
+    def _remember(self, key: str, value: List, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the current memory tier size"""
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'entries': len(self._memory)
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
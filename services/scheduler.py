@@ -1,26 +1,126 @@
-import requests
+import asyncio
+import random
+import re
+import aiohttp
 import logging
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import List, Optional
+from dateutil import parser as date_parser
 import config
+from .rate_limiter import FairRateLimiter
+from . import metrics
+from .circuit_breaker import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+# Status codes retried within a call: the request was turned away before a
+# draft could be created. Other server errors may come after the draft was
+# created, so retrying them could post it twice.
+RETRY_STATUSES = {429, 503}
+# Status codes counted by the circuit breaker as Typefully being unavailable
+OUTAGE_STATUSES = {429, 500, 502, 503, 504}
+# Longest wait before retrying within a call; a longer Retry-After fails
+# the call instead, leaving the retry to the post queue
+MAX_RETRY_DELAY = 30.0
+
+RELATIVE_TIME = re.compile(r"^(?:in\s+|\+)(\d+)\s*(m|min|mins|minutes?|h|hrs?|hours?|d|days?)$", re.IGNORECASE)
+RELATIVE_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+def parse_publish_time(value: str, now: datetime, tz: tzinfo) -> datetime:
+    """
+    Parse the publish time of a /schedule command
+
+    Accepts relative times such as "in 90m", "+2h" or "in 1d", and dates
+    and times such as "2025-03-01 14:00" or "Mar 1 2pm". Times without a
+    timezone are taken to be in tz; a time without a date is today.
+
+    Args:
+        value: The time as typed by the user
+        now: The current time, timezone aware
+        tz: Timezone of times that don't specify one
+
+    Returns:
+        The publish time, timezone aware
+
+    Raises:
+        ValueError: If value can't be parsed or is not in the future
+    """
+    value = value.strip()
+    match = RELATIVE_TIME.match(value)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)[0].lower()
+        when = now + timedelta(**{RELATIVE_UNITS[unit]: amount})
+    else:
+        try:
+            when = date_parser.parse(value, default=now.astimezone(tz).replace(second=0, microsecond=0))
+        except (ValueError, OverflowError):
+            raise ValueError(f"Couldn't understand the time {value!r}") from None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=tz)
+    if when <= now:
+        raise ValueError("The publish time has to be in the future")
+    return when
+
 class TweetScheduler:
     def __init__(self):
-        self.base_url = "https://api.typefully.com/v1/drafts/"  # Updated endpoint
+        self.base_url = config.TYPEFULLY_API_URL
         self.headers = {
             "X-API-KEY": f"Bearer {config.TYPEFULLY_API_KEY}",  # Updated header
             "Content-Type": "application/json",
             "Accept": "application/json",
             "User-Agent": "Python/3.10"
         }
+        self.timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=config.TYPEFULLY_CONNECT_TIMEOUT,
+            sock_read=config.TYPEFULLY_READ_TIMEOUT
+        )
+        self.max_retries = config.TYPEFULLY_MAX_RETRIES
+        self.limiter = FairRateLimiter("Typefully", requests_per_minute=config.TYPEFULLY_REQUESTS_PER_MINUTE)
+        self.breaker = CircuitBreaker(
+            "Typefully",
+            failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=config.CIRCUIT_RESET_TIMEOUT,
+            is_failure=self._is_outage
+        )
+        # The session is created lazily so it binds to the running event loop
+        self._session: Optional[aiohttp.ClientSession] = None
 
-    def schedule_thread(self, tweets):
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared keep-alive session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=config.TYPEFULLY_POOL_SIZE,
+                keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=self.timeout
+            )
+        return self._session
+
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def schedule_thread(
+        self,
+        tweets: List[str],
+        user_id: Optional[int] = None,
+        publish_at: Optional[float] = None
+    ) -> str:
         """
-        Create a draft thread on Typefully.
-        
+        Create a draft thread on Typefully, scheduled for publishing if publish_at is given.
+
         Args:
             tweets (list): List of tweet texts to be posted
-            
+            user_id (int): Discord user posting the thread, used for fair queueing
+            publish_at (float): Unix time Typefully should publish the thread at;
+                a time already passed publishes it as soon as possible
+
         Returns:
             str: URL to the draft on Typefully
         """
@@ -31,37 +131,98 @@ class TweetScheduler:
                 "threadify": True,
                 "share": True
             }
-            
-            response = requests.request(
-                method='POST',
-                url=self.base_url,
-                headers=self.headers,
-                json=body,
-                allow_redirects=True
-            )
-            response.raise_for_status()
-            
-            data = response.json()
+            if publish_at is not None:
+                # Typefully rejects times in the past, so late jobs go out shortly
+                publish_at = max(publish_at, datetime.now(timezone.utc).timestamp() + config.SCHEDULE_MIN_LEAD)
+                body["schedule-date"] = datetime.fromtimestamp(publish_at, timezone.utc).isoformat()
+
+            with self.breaker:
+                await self.limiter.acquire(user_id)
+                with metrics.TYPEFULLY_SECONDS.time():
+                    data = await self._post_with_retry(body)
             if not data:
                 raise ValueError("Empty response from Typefully API")
-            
+
             # Get share URL or construct it from draft ID
             share_url = data.get('share_url')
             if not share_url and 'id' in data:
                 share_url = f"https://typefully.com/draft/{data['id']}"
-            
+
             if not share_url:
                 raise ValueError("No URL in Typefully response")
-                
+
             logger.info(f"Draft thread created successfully on Typefully")
             return share_url
-            
-        except requests.exceptions.RequestException as e:
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logger.error(f"Error creating draft on Typefully: {str(e)}")
-            raise Exception(f"Failed to create draft: {str(e)}")
+            metrics.record_error('typefully', e)
+            raise Exception(f"Failed to create draft: {str(e)}") from e
         except ValueError as e:
             logger.error(f"Invalid response from Typefully: {str(e)}")
+            metrics.record_error('typefully', e)
             raise
         except Exception as e:
             logger.error(f"Unexpected error in schedule_thread: {str(e)}")
+            metrics.record_error('typefully', e)
             raise
+
+    async def _post_with_retry(self, body: dict) -> dict:
+        """POST to Typefully, retrying 429/503 responses and connection failures with jittered backoff"""
+        session = self._get_session()
+        attempt = 0
+        while True:
+            try:
+                async with session.post(self.base_url, json=body) as response:
+                    delay = None
+                    if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                        delay = self._retry_delay(attempt, response.headers.get('Retry-After'))
+                    if delay is not None:
+                        logger.warning(
+                            f"Typefully returned {response.status}, retrying in {delay:.1f}s "
+                            f"(attempt {attempt + 1}/{self.max_retries})"
+                        )
+                    else:
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+            except aiohttp.ClientConnectorError as e:
+                # Only connection failures are retried: the request never reached
+                # Typefully, so retrying cannot create a duplicate draft
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"Typefully request failed ({e!r}), retrying in {delay:.1f}s")
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _is_outage(error: BaseException) -> bool:
+        """Whether an error means Typefully itself is unavailable"""
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status in OUTAGE_STATUSES
+        return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+    @staticmethod
+    def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> Optional[float]:
+        """
+        Compute the delay before the next attempt, honoring Retry-After if given
+
+        Returns:
+            The delay in seconds, or None if Retry-After asks for longer
+            than MAX_RETRY_DELAY
+        """
+        if retry_after:
+            delay = None
+            try:
+                delay = max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(retry_after)
+                    delay = max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+            if delay is not None:
+                return delay if delay <= MAX_RETRY_DELAY else None
+        # Full jitter exponential backoff
+        return random.uniform(0, min(MAX_RETRY_DELAY, 0.5 * (2 ** attempt)))
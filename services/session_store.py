@@ -0,0 +1,104 @@
+import json
+import logging
+import time
+from typing import Dict, Optional
+from .sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+class SessionStore(SQLiteStore):
+    """
+    Persistent store for thread preview sessions.
+
+    Each preview message has one session row keyed by its Discord message
+    id. The tweets, the original request and any other per-preview state
+    live in a JSON payload, so the preview buttons keep working after the
+    bot restarts.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            message_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'open',
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id, updated_at);
+        CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at);
+    """
+
+    async def save(self, message_id: int, user_id: int, channel_id: Optional[int], data: Dict):
+        """Create or replace the session for a preview message"""
+        def _save(conn, message_id, user_id, channel_id, payload):
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions "
+                "(message_id, user_id, channel_id, status, data, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'open', ?, ?, ?)",
+                (message_id, user_id, channel_id, payload, now, now)
+            )
+        await self._run(_save, message_id, user_id, channel_id, json.dumps(data))
+
+    async def get(self, message_id: int) -> Optional[Dict]:
+        """
+        Load a session
+
+        Returns:
+            The session's data merged with message_id, user_id, channel_id
+            and status, or None if there is no session for the message
+        """
+        def _get(conn, message_id):
+            return conn.execute("SELECT * FROM sessions WHERE message_id = ?", (message_id,)).fetchone()
+        row = await self._run(_get, message_id)
+        return self._to_session(row) if row else None
+
+    async def latest_for_user(self, user_id: int, status: str = 'open') -> Optional[Dict]:
+        """Load the most recently updated session of a user"""
+        def _latest(conn, user_id, status):
+            return conn.execute(
+                "SELECT * FROM sessions WHERE user_id = ? AND status = ? ORDER BY updated_at DESC LIMIT 1",
+                (user_id, status)
+            ).fetchone()
+        row = await self._run(_latest, user_id, status)
+        return self._to_session(row) if row else None
+
+    async def update(self, message_id: int, data: Dict):
+        """Replace the data of an existing session"""
+        def _update(conn, message_id, payload):
+            conn.execute(
+                "UPDATE sessions SET data = ?, updated_at = ? WHERE message_id = ?",
+                (payload, time.time(), message_id)
+            )
+        await self._run(_update, message_id, json.dumps(data))
+
+    async def set_status(self, message_id: int, status: str):
+        """Mark a session as e.g. 'finalized'"""
+        def _set_status(conn, message_id, status):
+            conn.execute(
+                "UPDATE sessions SET status = ?, updated_at = ? WHERE message_id = ?",
+                (status, time.time(), message_id)
+            )
+        await self._run(_set_status, message_id, status)
+
+    async def prune(self, max_age: float) -> int:
+        """Delete sessions not updated for max_age seconds, returning the count"""
+        def _prune(conn, cutoff):
+            return conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+        removed = await self._run(_prune, time.time() - max_age)
+        if removed:
+            logger.info(f"Pruned {removed} expired preview sessions")
+        return removed
+
+    @staticmethod
+    def _to_session(row) -> Dict:
+        session = json.loads(row['data'])
+        session.update(
+            message_id=row['message_id'],
+            user_id=row['user_id'],
+            channel_id=row['channel_id'],
+            status=row['status']
+        )
+        return session
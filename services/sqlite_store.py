@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SQLiteStore:
+    """
+    Base class for small SQLite-backed stores used by the bot.
+
+    The database runs in WAL mode and every statement is executed on a
+    dedicated worker thread, so callers on the event loop only ever await
+    the result and never block on disk I/O. Subclasses set SCHEMA and
+    implement their queries as plain synchronous methods taking the
+    connection, which are dispatched through _run.
+
+    Columns added to a table after its first release are listed in
+    COLUMNS as (table, column, definition) and added to existing
+    databases when they are opened.
+    """
+
+    SCHEMA = ""
+    COLUMNS: Tuple[Tuple[str, str, str], ...] = ()
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+            self._add_columns(self._conn)
+            self._conn.commit()
+            logger.info(f"{type(self).__name__} opened at {self.path}")
+        return self._conn
+
+    def _add_columns(self, conn: sqlite3.Connection):
+        for table, column, definition in self.COLUMNS:
+            existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                logger.info(f"Added column {table}.{column} to {self.path}")
+
+    def _call(self, fn: Callable[..., Any], *args) -> Any:
+        conn = self._connect()
+        with conn:
+            return fn(conn, *args)
+
+    async def _run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run fn(conn, *args) inside a transaction on the store's thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, *args)
+
+    def close(self):
+        """Close the database connection and stop the worker thread"""
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close).result()
+        self._executor.shutdown(wait=True)
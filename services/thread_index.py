@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+from . import metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where only one process may add to an index directory
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Size of the hashed embeddings; 128 float32s is 512 bytes per thread, so
+# a search over 30,000 threads reads about 15 MB
+DIMENSIONS = 128
+# Rows allocated when a tone's vector file is created; it doubles when full
+INITIAL_CAPACITY = 1024
+# A new thread this similar to an indexed one is treated as a duplicate
+DUPLICATE_SIMILARITY = 0.98
+
+WORD = re.compile(r"[@#$]?\w+")
+
+def embed(text: str) -> np.ndarray:
+    """
+    Embed text as a unit vector of hashed word and word-pair features
+
+    Each feature is hashed to a dimension and a sign (the hashing trick),
+    counts are dampened logarithmically, and the result is normalized so
+    a dot product is the cosine similarity.
+    """
+    words = WORD.findall(text.lower())
+    features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    if not features:
+        return vector
+    hashes = np.fromiter(
+        (zlib.crc32(feature.encode('utf-8')) for feature in features), dtype=np.uint32, count=len(features)
+    )
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, hashes % DIMENSIONS, signs)
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class _ToneIndex:
+    """
+    The threads of one tone: a memory-mapped float32 matrix with one
+    embedding per row, plus a JSON lines file with the thread of each row.
+
+    The JSON lines file is the source of truth for the number of rows, so
+    a row is only visible once its line has been written. Other processes
+    pick up new rows by reading the lines appended since their last look,
+    and appends hold an exclusive lock on a lock file, so processes sharing
+    the directory never write the same row.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.vectors_path = os.path.join(directory, f"{name}.f32")
+        self.threads_path = os.path.join(directory, f"{name}.jsonl")
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        self.count = 0
+        self.vectors: Optional[np.memmap] = None
+        self._offsets: List[int] = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _map(self, capacity: int):
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(capacity, DIMENSIONS))
+
+    def _capacity(self) -> int:
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def _refresh(self):
+        """Take in rows appended since the last call, possibly by another process"""
+        try:
+            size = os.path.getsize(self.threads_path)
+        except FileNotFoundError:
+            return
+        if size <= self._size:
+            return
+        with open(self.threads_path, 'rb') as f:
+            f.seek(self._size)
+            data = f.read(size - self._size)
+        # Ignore a partially written last line until it is complete
+        end = data.rfind(b'\n') + 1
+        offset = self._size
+        for line in data[:end].splitlines(keepends=True):
+            self._offsets.append(offset)
+            offset += len(line)
+        self._size = offset
+        self.count = len(self._offsets)
+        if self.count > self._capacity():
+            self._map(os.path.getsize(self.vectors_path) // (DIMENSIONS * 4))
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Keep other processes from appending until the block ends"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, vector: np.ndarray, thread: Dict) -> bool:
+        """Add a row, unless one at least DUPLICATE_SIMILARITY similar is there already"""
+        with self._lock, self._exclusive():
+            self._refresh()
+            if self.count and float(np.max(self.vectors[:self.count] @ vector)) >= DUPLICATE_SIMILARITY:
+                return False
+            if self.count >= self._capacity():
+                capacity = max(INITIAL_CAPACITY, self._capacity() * 2)
+                with open(self.vectors_path, 'ab') as f:
+                    f.truncate(capacity * DIMENSIONS * 4)
+                self._map(capacity)
+            self.vectors[self.count] = vector
+            line = (json.dumps(thread, ensure_ascii=False) + "\n").encode('utf-8')
+            with open(self.threads_path, 'ab') as f:
+                f.write(line)
+            self._offsets.append(self._size)
+            self._size += len(line)
+            self.count += 1
+            return True
+
+    def search(self, query: np.ndarray, k: int) -> List[tuple]:
+        """The up to k (similarity, row) pairs most similar to query, best first"""
+        with self._lock:
+            self._refresh()
+            if not self.count:
+                return []
+            scores = self.vectors[:self.count] @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[row]), int(row)) for row in top]
+
+    def thread(self, row: int) -> Dict:
+        with open(self.threads_path, 'rb') as f:
+            f.seek(self._offsets[row])
+            return json.loads(f.readline())
+
+    def close(self):
+        with self._lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+                self.vectors = None
+
+class ThreadIndex:
+    """
+    Archive of approved threads searchable by similarity, per tone.
+
+    Each tone is stored as a memory-mapped matrix of embeddings under
+    directory, so a search is a single matrix-vector product over that
+    tone's threads. Threads are added and searched on a dedicated worker
+    thread, so callers on the event loop never wait for disk I/O or for
+    a tone's lock; a search only reads the mapped pages and takes under a
+    millisecond for tens of thousands of threads per tone.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._tones: Dict[str, _ToneIndex] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ThreadIndex')
+
+    def _tone(self, tone: str) -> _ToneIndex:
+        name = re.sub(r'[^a-z0-9_-]', '_', tone.lower()) or 'normal'
+        with self._lock:
+            index = self._tones.get(name)
+            if index is None:
+                os.makedirs(self.directory, exist_ok=True)
+                index = self._tones[name] = _ToneIndex(self.directory, name)
+            return index
+
+    @staticmethod
+    def _text(topic: str, tweets: List[str]) -> str:
+        return "\n".join([topic] + list(tweets))
+
+    def _add(self, tone: str, topic: str, tweets: List[str]) -> bool:
+        started = time.perf_counter()
+        index = self._tone(tone)
+        vector = embed(self._text(topic, tweets))
+        if not index.append(vector, {'topic': topic, 'tweets': list(tweets), 'added_at': time.time()}):
+            return False
+        metrics.THREAD_INDEX_SECONDS.labels('add').observe(time.perf_counter() - started)
+        return True
+
+    async def add(self, tone: str, topic: str, tweets: List[str]) -> bool:
+        """
+        Archive an approved thread
+
+        Returns:
+            False if a near-identical thread was already archived
+        """
+        loop = asyncio.get_running_loop()
+        added = await loop.run_in_executor(self._executor, self._add, tone, topic, tweets)
+        if added:
+            logger.info(f"Archived a {len(tweets)} tweet {tone} thread on: {topic}")
+        return added
+
+    async def search(self, tone: str, text: str, k: int, min_similarity: float = 0.0) -> List[Dict]:
+        """
+        Find the archived threads of a tone most similar to text
+
+        Returns:
+            Up to k threads, each a dict with topic, tweets and similarity,
+            most similar first
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._search, tone, text, k, min_similarity)
+
+    def _search(self, tone: str, text: str, k: int, min_similarity: float) -> List[Dict]:
+        started = time.perf_counter()
+        index = self._tone(tone)
+        matches = [
+            (similarity, row) for similarity, row in index.search(embed(text), k)
+            if similarity >= min_similarity
+        ]
+        threads = []
+        for similarity, row in matches:
+            thread = index.thread(row)
+            thread['similarity'] = similarity
+            threads.append(thread)
+        metrics.THREAD_INDEX_SECONDS.labels('search').observe(time.perf_counter() - started)
+        return threads
+
+    def sizes(self) -> Dict[str, int]:
+        """Number of archived threads per tone loaded so far"""
+        with self._lock:
+            return {name: index.count for name, index in self._tones.items()}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for index in self._tones.values():
+                index.close()
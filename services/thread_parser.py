@@ -0,0 +1,185 @@
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Matches the number prefix the model puts in front of each tweet, e.g.
+# "1. ", "2) ", "3/ ", "4/10 " or "Tweet 5: ". Only one or two digits are
+# accepted so a tweet that starts with a year such as "2025" is left alone.
+NUMBER_PREFIX = re.compile(
+    r'^\s*(?:\*\*)?(?:tweet\s*)?(\d{1,2})(?:\s*/\s*\d{1,2}\s*[.):]?|\s*[.):/])(?:\*\*)?(?:\s+|$)',
+    re.IGNORECASE
+)
+
+def _clean(tweet: str) -> str:
+    """Strip whitespace and any quotes wrapped around a tweet"""
+    return tweet.strip().strip('"').strip("'").strip()
+
+def _strip_number(tweet: str) -> str:
+    """Remove a number prefix the model added despite the schema"""
+    match = NUMBER_PREFIX.match(tweet)
+    if match:
+        tweet = tweet[match.end():]
+    return _clean(tweet)
+
+class ThreadParser:
+    """
+    Incremental parser for a numbered list of tweets.
+
+    Text can be fed in arbitrary chunks (e.g. streamed tokens). A tweet is
+    emitted as soon as the next numbered line starts, so callers can show it
+    before the rest of the response has arrived. Lines without a number are
+    treated as a continuation of the current tweet, which keeps multi-line
+    tweets intact.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._current: Optional[List[str]] = None
+        self._current_number: Optional[int] = None
+        # Number the model gave each emitted tweet (None for unnumbered output)
+        self.numbers: List[Optional[int]] = []
+        self._preamble: List[str] = []
+        self._seen_number = False
+
+    def feed(self, text: str) -> List[str]:
+        """Consume a chunk of text and return the tweets completed by it"""
+        # Split every complete line in one pass so parsing stays linear in
+        # the response length however the text is chunked
+        *lines, self._buffer = (self._buffer + text).split('\n')
+        completed = []
+        for line in lines:
+            tweet = self._consume_line(line)
+            if tweet:
+                completed.append(tweet)
+        return completed
+
+    def close(self) -> List[str]:
+        """Flush the remaining text and return the final tweets"""
+        completed = []
+        if self._buffer:
+            tweet = self._consume_line(self._buffer)
+            self._buffer = ""
+            if tweet:
+                completed.append(tweet)
+
+        if self._current is not None:
+            tweet = _clean("\n".join(self._current))
+            self._current = None
+            if tweet:
+                self.numbers.append(self._current_number)
+                completed.append(tweet)
+        elif not self._seen_number:
+            # The model ignored the numbering instruction: fall back to one
+            # tweet per paragraph
+            paragraphs = "\n".join(self._preamble).split("\n\n")
+            for tweet in (_clean(p) for p in paragraphs):
+                if tweet:
+                    self.numbers.append(None)
+                    completed.append(tweet)
+            self._preamble = []
+        return completed
+
+    def _consume_line(self, line: str) -> Optional[str]:
+        match = NUMBER_PREFIX.match(line)
+        if match:
+            finished = None
+            if self._current is not None:
+                finished = _clean("\n".join(self._current)) or None
+                if finished:
+                    self.numbers.append(self._current_number)
+            self._seen_number = True
+            self._current = [line[match.end():]]
+            self._current_number = int(match.group(1))
+            return finished
+
+        if self._current is not None:
+            self._current.append(line)
+        else:
+            # Text before the first numbered line ("Here's your thread:")
+            self._preamble.append(line)
+        return None
+
+def parse_thread(text: str) -> List[str]:
+    """Parse a complete numbered-list response into tweets"""
+    parser = ThreadParser()
+    tweets = parser.feed(text)
+    tweets.extend(parser.close())
+    return tweets
+
+def parse_numbered_thread(text: str) -> List[Tuple[Optional[int], str]]:
+    """Parse a numbered-list response into (number, tweet) pairs"""
+    parser = ThreadParser()
+    tweets = parser.feed(text)
+    tweets.extend(parser.close())
+    return list(zip(parser.numbers, tweets))
+
+def thread_function(length: int) -> Dict:
+    """OpenAI function definition used to get the thread as structured output"""
+    return {
+        "name": "submit_thread",
+        "description": "Submit the tweets of the thread, in order",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "tweets": {
+                    "type": "array",
+                    "description": f"Exactly {length} tweets",
+                    "minItems": length,
+                    "maxItems": length,
+                    "items": {
+                        "type": "string",
+                        "description": "Text of one tweet, without numbering"
+                    }
+                }
+            },
+            "required": ["tweets"]
+        }
+    }
+
+def parse_thread_arguments(arguments: str) -> List[str]:
+    """
+    Parse and validate the JSON arguments of a submit_thread call
+
+    Tweets that aren't strings are replaced by empty strings so they can be
+    repaired individually.
+
+    Raises:
+        ValueError: If the arguments don't match the schema at all
+    """
+    data = json.loads(arguments)
+    if not isinstance(data, dict) or not isinstance(data.get('tweets'), list):
+        raise ValueError("submit_thread arguments must contain a 'tweets' array")
+
+    tweets = []
+    for tweet in data['tweets']:
+        if not isinstance(tweet, str):
+            tweets.append("")
+            continue
+        tweets.append(_strip_number(tweet))
+    return tweets
+
+def find_invalid_tweets(tweets: List[str], length: int) -> List[int]:
+    """1-based numbers of tweets that are empty or missing from a thread of the given length"""
+    invalid = [i for i, tweet in enumerate(tweets[:length], 1) if not tweet.strip()]
+    invalid.extend(range(len(tweets) + 1, length + 1))
+    return invalid
+
+# A complete JSON string literal
+JSON_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+def salvage_thread_arguments(arguments: str) -> List[str]:
+    """
+    Recover the complete tweets from malformed or truncated submit_thread
+    arguments, e.g. when the model stopped in the middle of the array
+    """
+    start = arguments.find('[')
+    if start == -1:
+        return []
+    tweets = []
+    for match in JSON_STRING.finditer(arguments, start):
+        try:
+            tweet = json.loads(match.group(0))
+        except ValueError:
+            continue
+        tweets.append(_strip_number(tweet))
+    return tweets
@@ -0,0 +1,86 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+class TimerQueue:
+    """
+    Keys ordered by the time they are due, for a task that sleeps until
+    the next one is due.
+
+    A binary heap of (due, key) pairs: pushing and popping are O(log n)
+    and the next due time is O(1), so thousands of pending timers cost
+    nothing while waiting. Pushing a key again reschedules it; the old
+    entry stays in the heap and is skipped when it comes up. Times are
+    wall clock (time.time()), as they are persisted across restarts.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._due: Dict[Hashable, float] = {}
+        self._order = itertools.count()
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._due
+
+    def push(self, key: Hashable, due: float):
+        """Schedule key for due, replacing any earlier schedule of it"""
+        if self._due.get(key) == due:
+            return
+        head = self.next_due()
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._order), key))
+        if head is None or due < head:
+            # The waiting task has to wake up earlier than it planned
+            self._changed.set()
+
+    def discard(self, key: Hashable):
+        """Stop timing key, if it is timed"""
+        self._due.pop(key, None)
+
+    def next_due(self) -> Optional[float]:
+        """When the first key is due, or None if there is none"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, until: float, limit: Optional[int] = None) -> List[Hashable]:
+        """Remove and return up to limit keys due by until, earliest first"""
+        keys = []
+        while limit is None or len(keys) < limit:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > until:
+                break
+            _, _, key = heapq.heappop(self._heap)
+            del self._due[key]
+            keys.append(key)
+        return keys
+
+    async def wait(self, timeout: Optional[float] = None):
+        """
+        Sleep until the first key is due, an earlier key is pushed, or
+        timeout seconds have passed
+        """
+        self._changed.clear()
+        due = self.next_due()
+        delay = None if due is None else due - time.time()
+        if timeout is not None:
+            delay = timeout if delay is None else min(delay, timeout)
+        if delay is not None and delay <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _drop_stale(self):
+        # Entries for keys that were rescheduled or discarded since
+        while self._heap:
+            due, _, key = self._heap[0]
+            if self._due.get(key) == due:
+                return
+            heapq.heappop(self._heap)
@@ -0,0 +1,66 @@
+import functools
+import logging
+from typing import Dict, Iterable, Optional
+
+try:
+    import tiktoken
+except ImportError:  # in requirements.txt, but fall back to the character heuristic without it
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Rough average for English text with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+# Expected completion size of a single tweet, including list numbering
+TOKENS_PER_TWEET = 80
+
+# Model whose tokenizer is used when none is given
+DEFAULT_MODEL = "gpt-4"
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str):
+    """The tiktoken encoding for model, or None if it can't be loaded"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its vocabularies on first use
+        logger.warning(f"Could not load the tokenizer for {model}, estimating tokens instead: {str(e)}")
+        return None
+
+def load_tokenizers(models: Iterable[str]) -> int:
+    """
+    Load the tokenizers of models before the first count_tokens call
+
+    tiktoken reads its vocabularies from disk, downloading them the first
+    time, which would otherwise block whichever request counts tokens
+    first. Call it at startup, off the event loop.
+
+    Returns:
+        The number of models with a tokenizer
+    """
+    return sum(_encoding(model) is not None for model in {DEFAULT_MODEL, *models})
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Count the tokens in text with the model's tokenizer
+
+    Uses tiktoken when it is installed and falls back to estimate_tokens
+    otherwise.
+    """
+    encoding = _encoding(model or DEFAULT_MODEL)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def estimate_tokens(text: str) -> int:
+    """Cheaply estimate the number of tokens in text"""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+def estimate_completion_tokens(request: Dict) -> int:
+    """Estimate the completion size of a generation request"""
+    return TOKENS_PER_TWEET * max(1, int(request.get('length', 1)))
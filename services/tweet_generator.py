@@ -1,19 +1,104 @@
-from openai import OpenAI
-from typing import List, Dict, Optional
+import asyncio
+import contextlib
+import time
+import openai
+from contextvars import ContextVar
+from openai import AsyncOpenAI
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Optional, Tuple
 import config
 import logging
-from .tone_settings import get_system_prompt, ToneType
+from .tone_settings import ToneType
+from .prompt_templates import generation_prompt, measure_prompt, system_prompt as get_system_prompt
+from .thread_parser import (
+    ThreadParser,
+    find_invalid_tweets,
+    parse_numbered_thread,
+    parse_thread,
+    parse_thread_arguments,
+    salvage_thread_arguments,
+    thread_function
+)
+from .response_cache import ResponseCache
+from .tokens import count_tokens, estimate_completion_tokens, TOKENS_PER_TWEET
+from .rate_limiter import FairRateLimiter
+from . import metrics
+from .circuit_breaker import CircuitBreaker
+from .model_router import Hedge, ModelRouter, Route
+from .deadline import Deadline, DeadlineExceeded, within
+from .tweet_validator import MAX_WEIGHTED_LENGTH, URL_LENGTH, find_overlong_tweets
+from .thread_index import ThreadIndex
+from .history import HistoryStore
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Token usage of the call being recorded in the history; revisions made
+# while generating a thread add to the generation's usage
+_tracked_usage: ContextVar[Optional[Dict]] = ContextVar('tracked_usage', default=None)
+
+# Feedback used to regenerate only the tweets that failed validation
+REPAIR_FEEDBACK = (
+    "These tweets are missing or empty. Write them so the thread is complete, "
+    "follows on from the surrounding tweets and reads naturally."
+)
+
+# Feedback used to shorten only the tweets over X's length limit
+SHORTEN_FEEDBACK = (
+    f"These tweets are too long for X. Shorten each to at most {MAX_WEIGHTED_LENGTH} characters "
+    f"(links count as {URL_LENGTH}, emoji and CJK characters as 2) while keeping the keywords, "
+    "tags and links they contain."
+)
+
 class TweetGenerator:
     def __init__(self):
-        self.client = OpenAI(api_key=config.OPENAI_API_KEY)
+        # The HTTP client is created on first use, keeping startup fast
+        self._client: Optional[AsyncOpenAI] = None
+        # Bound the number of in-flight OpenAI calls so a burst of /create
+        # commands runs in parallel without flooding the provider
+        self.semaphore = asyncio.Semaphore(config.OPENAI_MAX_CONCURRENCY)
+        # Stay below the account's rate limits, queueing users fairly
+        self.limiter = FairRateLimiter(
+            "OpenAI",
+            requests_per_minute=config.OPENAI_REQUESTS_PER_MINUTE,
+            tokens_per_minute=config.OPENAI_TOKENS_PER_MINUTE
+        )
+        # Fail fast while OpenAI is down instead of tying up every interaction
+        self.breaker = CircuitBreaker(
+            "OpenAI",
+            failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=config.CIRCUIT_RESET_TIMEOUT,
+            is_failure=lambda e: isinstance(
+                e, (asyncio.TimeoutError, openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError)
+            )
+        )
+        # Picks the model per request and falls back when it is slow or failing
+        self.router = ModelRouter.from_config()
+        # 'json' asks for the thread through function calling, 'text' for a numbered list
+        self.output_mode = config.OPENAI_OUTPUT_MODE
+        self.cache = ResponseCache(
+            max_entries=config.RESPONSE_CACHE_SIZE,
+            ttl=config.RESPONSE_CACHE_TTL,
+            path=config.RESPONSE_CACHE_PATH or None
+        )
+        # Approved threads, used as examples of the house style
+        self.thread_index = ThreadIndex(config.THREAD_INDEX_DIR)
+        # Every generation and revision, for /stats
+        self.history = HistoryStore(config.HISTORY_DB_PATH)
         logger.info("TweetGenerator initialized")
 
-    def generate_thread(self, request: Dict) -> List[str]:
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self._client = AsyncOpenAI(api_key=config.OPENAI_API_KEY, base_url=config.OPENAI_BASE_URL)
+        return self._client
+
+    async def generate_thread(
+        self,
+        request: Dict,
+        regenerate: bool = False,
+        user_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        deadline: Optional[Deadline] = None
+    ) -> List[str]:
         """
         Generate a thread of tweets based on the provided parameters
         
@@ -23,89 +108,570 @@ class TweetGenerator:
                 - context: Additional context
                 - keywords: Must-mention keywords
                 - tags: X accounts to mention
-                - length: Approximate thread length
+                - length: Number of tweets in the thread
                 - tone: Optional tone (intern/normal/marketing)
                 - link: Optional link to include in thread
+            regenerate: Skip the response cache and always call OpenAI
+            user_id: Discord user the request is made for, used for fair queueing
+            on_queued: Awaited with the queue position while waiting for capacity
+            deadline: When the thread has to be ready; checks that don't fit
+                are skipped
         
         Returns:
             List of tweets for the thread
+
+        Raises:
+            DeadlineExceeded: If no thread could be generated in time
+        """
+        variants = await self.generate_variants(request, 1, regenerate, user_id, on_queued, deadline)
+        return variants[0]
+
+    async def generate_variants(
+        self,
+        request: Dict,
+        count: int,
+        regenerate: bool = False,
+        user_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        deadline: Optional[Deadline] = None
+    ) -> List[List[str]]:
+        """
+        Generate alternative versions of a thread in a single OpenAI request
+
+        All variants come from one completion with n=count, so they cost one
+        round trip and share the prompt tokens.
+
+        Args:
+            request: Same dictionary as accepted by generate_thread
+            count: Number of variants to generate
+            regenerate: Skip the response cache and always call OpenAI
+            user_id: Discord user the request is made for, used for fair queueing
+            on_queued: Awaited with the queue position while waiting for capacity
+            deadline: When the variants have to be ready
+
+        Returns:
+            The usable variants, each a list of tweets (at most count)
         """
-        logger.info(f"Generating thread for topic: {request['main']}")
-        logger.info(f"Required keywords: {request['keywords']}")
+        with self._tracked('generate', request, user_id):
+            logger.info(f"Generating {count} thread variant(s) for topic: {request['main']}")
+            logger.info(f"Required keywords: {request['keywords']}")
         
-        prompt = self._create_prompt(request)
-        logger.info("Generated prompt for OpenAI")
-        logger.debug(f"Prompt content: {prompt}")
+            route = self._route('create', request)
+            system_prompt = self._system_prompt(request)
+            prompt = await self._create_prompt(request)
+            logger.info(f"Generated prompt for OpenAI (route {route.name}, model {route.model})")
+            logger.debug(f"Prompt content: {prompt}")
+            self._measure_prompt(request, prompt, route.model)
+
+            cache_key = self._cache_key(route, system_prompt, prompt, count)
+            if not regenerate:
+                cached = await self.cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"Using cached thread ({len(cached)} {'tweets' if count == 1 else 'variants'})")
+                    return [cached] if count == 1 else cached
         
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": get_system_prompt(request.get('tone', 'normal'))},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7
-            )
-            logger.info("Received response from OpenAI")
-            
-            tweets = self._parse_response(response.choices[0].message.content)
-            logger.info(f"Generated {len(tweets)} tweets")
-            for i, tweet in enumerate(tweets, 1):
-                logger.info(f"Tweet {i}: {tweet}")
+            try:
+                with self.breaker:
+                    completion_tokens = estimate_completion_tokens(request) * count
+                    estimated = await within(deadline, self._acquire(
+                        route.model, system_prompt, prompt, completion_tokens, user_id, on_queued
+                    ))
+                    async with self.semaphore:
+                        with metrics.OPENAI_SECONDS.labels('generate').time():
+                            response, model = await self.router.call(
+                                route,
+                                lambda model, temperature: self.client.chat.completions.create(
+                                    model=model,
+                                    messages=[
+                                        {"role": "system", "content": system_prompt},
+                                        {"role": "user", "content": prompt}
+                                    ],
+                                    temperature=temperature,
+                                    n=count,
+                                    **self._output_options(request)
+                                ),
+                                deadline,
+                                hedge=self._hedge(estimated, completion_tokens)
+                            )
+                logger.info(f"Received response from OpenAI ({model})")
+                self._record_usage(estimated, response.usage, route, model)
             
-            return tweets
+                with metrics.PARSE_SECONDS.time():
+                    parsed = [self._parse_message(choice.message, request['length']) for choice in response.choices]
+                # Variants are repaired and shortened concurrently; one that is
+                # beyond repair is dropped rather than failing the others
+                results = await asyncio.gather(
+                    *(self._check(request, tweets, user_id, deadline) for tweets in parsed),
+                    return_exceptions=True
+                )
+                variants = [result for result in results if not isinstance(result, BaseException)]
+                if not variants:
+                    raise results[0]
+                if len(variants) < len(results):
+                    logger.warning(f"Dropped {len(results) - len(variants)} unusable variant(s)")
+
+                for number, tweets in enumerate(variants, 1):
+                    logger.info(f"Generated {len(tweets)} tweets" + (f" for variant {number}" if count > 1 else ""))
+                    for i, tweet in enumerate(tweets, 1):
+                        logger.info(f"Tweet {i}: {tweet}", extra={'sample': True})
+
+                # Drafts whose checks were cut short by the deadline aren't
+                # reused, nor are those of a fallback model: the key is the
+                # route's primary model
+                if model == route.model and (deadline is None or not deadline.expired):
+                    await self.cache.set(cache_key, variants[0] if count == 1 else variants)
+                return variants
             
-        except Exception as e:
-            logger.error(f"Error generating tweets: {str(e)}")
-            raise
+            except Exception as e:
+                logger.error(f"Error generating tweets: {str(e)}")
+                metrics.record_error('openai', e)
+                raise
     
-    def _create_prompt(self, request: Dict) -> str:
-        # Process tags: split if string, convert to list if None
-        tags = request.get('tags')
-        
-        # Similar to tags, but for keywords
-        keywords = request.get('keywords')
-        
-        # Build the prompt
+    async def stream_thread(
+        self,
+        request: Dict,
+        regenerate: bool = False,
+        user_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        deadline: Optional[Deadline] = None
+    ) -> AsyncIterator[Tuple[int, str]]:
+        """
+        Generate a thread like generate_thread, yielding each tweet as soon as
+        it is complete in the streamed response
+
+        Args:
+            request: Same dictionary as accepted by generate_thread
+            regenerate: Skip the response cache and always call OpenAI
+            user_id: Discord user the request is made for, used for fair queueing
+            on_queued: Awaited with the queue position while waiting for capacity
+            deadline: Bounds the wait for capacity, the start of the stream
+                and the checks; the caller bounds the rest of the stream
+
+        Yields:
+            (index, tweet) pairs in order. After the stream has finished,
+            repaired or shortened tweets are yielded again under the index
+            of the tweet they replace.
+        """
+        with self._tracked('generate', request, user_id):
+            logger.info(f"Streaming thread for topic: {request['main']}")
+
+            route = self._route('create', request)
+            system_prompt = self._system_prompt(request)
+            prompt = await self._create_prompt(request)
+            self._measure_prompt(request, prompt, route.model)
+
+            cache_key = self._cache_key(route, system_prompt, prompt)
+            if not regenerate:
+                cached = await self.cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"Using cached thread ({len(cached)} tweets)")
+                    for index, tweet in enumerate(cached):
+                        yield index, tweet
+                    return
+
+            parser = ThreadParser()
+            tweets = []
+
+            try:
+                with self.breaker:
+                    estimated = await within(deadline, self._acquire(
+                        route.model, system_prompt, prompt, estimate_completion_tokens(request), user_id, on_queued
+                    ))
+                    async with self.semaphore:
+                        started = time.perf_counter()
+                        # Falling back is only possible until the stream has started
+                        stream, model = await self.router.call(
+                            route,
+                            lambda model, temperature: self.client.chat.completions.create(
+                                model=model,
+                                messages=[
+                                    {"role": "system", "content": system_prompt},
+                                    {"role": "user", "content": prompt}
+                                ],
+                                temperature=temperature,
+                                stream=True,
+                                stream_options={"include_usage": True}
+                            ),
+                            deadline
+                        )
+                        async for chunk in stream:
+                            if chunk.usage is not None:
+                                self._record_usage(estimated, chunk.usage, route, model)
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if not delta:
+                                continue
+                            for tweet in parser.feed(delta):
+                                if not tweets:
+                                    metrics.TIME_TO_FIRST_TWEET.observe(time.perf_counter() - started)
+                                tweets.append(tweet)
+                                yield len(tweets) - 1, tweet
+                        metrics.OPENAI_SECONDS.labels('stream').observe(time.perf_counter() - started)
+
+                for tweet in parser.close():
+                    if not tweets:
+                        metrics.TIME_TO_FIRST_TWEET.observe(time.perf_counter() - started)
+                    tweets.append(tweet)
+                    yield len(tweets) - 1, tweet
+
+                # Streamed tweets are never empty, so only missing ones are repaired
+                checked = await self._check(request, tweets, user_id, deadline)
+                for index, tweet in enumerate(checked):
+                    if index >= len(tweets) or tweets[index] != tweet:
+                        yield index, tweet
+                tweets = checked
+                logger.info(f"Streamed {len(tweets)} tweets")
+
+                if model == route.model and (deadline is None or not deadline.expired):
+                    await self.cache.set(cache_key, tweets)
+
+            except Exception as e:
+                logger.error(f"Error streaming tweets: {str(e)}")
+                metrics.record_error('openai', e)
+                raise
+
+    async def revise_thread(
+        self,
+        request: Dict,
+        tweets: List[str],
+        feedback: str,
+        targets: Optional[List[int]] = None,
+        user_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        operation: str = 'revise',
+        deadline: Optional[Deadline] = None
+    ) -> List[str]:
+        """
+        Revise an existing thread based on user feedback
+
+        Only the current thread and the latest feedback are sent, and only
+        the targeted tweets are rewritten; all other tweets are kept as is.
+
+        Args:
+            request: The request the thread was generated from
+            tweets: The current tweets of the thread
+            feedback: The user's feedback
+            targets: 1-based numbers of the tweets to rewrite (None for all)
+            user_id: Discord user the request is made for, used for fair queueing
+            on_queued: Awaited with the queue position while waiting for capacity
+            operation: What the revision is for ('revise', 'shorten' or
+                'repair'), used to pick the model
+            deadline: When the revision has to be ready
+
+        Returns:
+            The revised list of tweets
+
+        Raises:
+            DeadlineExceeded: If the revision couldn't be made in time
+        """
+        with self._tracked(operation, request, user_id):
+            targets = sorted(set(targets)) if targets else list(range(1, len(tweets) + 1))
+            logger.info(f"Revising tweets {targets} of thread on: {request['main']}")
+
+            route = self._route(operation, request)
+            system_prompt = self._system_prompt(request)
+            prompt = self._create_revision_prompt(request, tweets, feedback, targets)
+            logger.debug(f"Revision prompt: {prompt}")
+
+            try:
+                with self.breaker:
+                    estimated = await within(deadline, self._acquire(
+                        route.model, system_prompt, prompt, TOKENS_PER_TWEET * len(targets), user_id, on_queued
+                    ))
+                    async with self.semaphore:
+                        with metrics.OPENAI_SECONDS.labels('revise').time():
+                            response, model = await self.router.call(
+                                route,
+                                lambda model, temperature: self.client.chat.completions.create(
+                                    model=model,
+                                    messages=[
+                                        {"role": "system", "content": system_prompt},
+                                        {"role": "user", "content": prompt}
+                                    ],
+                                    temperature=temperature
+                                ),
+                                deadline,
+                                hedge=self._hedge(estimated, TOKENS_PER_TWEET * len(targets))
+                            )
+                logger.info(f"Received revision from OpenAI ({model})")
+                self._record_usage(estimated, response.usage, route, model)
+
+                with metrics.PARSE_SECONDS.time():
+                    revised = parse_numbered_thread(response.choices[0].message.content)
+                new_tweets = list(tweets)
+                if all(number is None for number, _ in revised) and len(revised) == len(targets):
+                    # Unnumbered output: match the tweets to the targets in order
+                    revised = list(zip(targets, (tweet for _, tweet in revised)))
+                for number, tweet in revised:
+                    if number in targets:
+                        new_tweets[number - 1] = tweet
+
+                changed = sum(1 for old, new in zip(tweets, new_tweets) if old != new)
+                logger.info(f"Revised {changed} of {len(targets)} targeted tweets")
+                return new_tweets
+
+            except Exception as e:
+                logger.error(f"Error revising tweets: {str(e)}")
+                metrics.record_error('openai', e)
+                raise
+
+    async def shorten_overlong(
+        self,
+        request: Dict,
+        tweets: List[str],
+        user_id: Optional[int] = None,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        deadline: Optional[Deadline] = None
+    ) -> List[str]:
+        """
+        Rewrite only the tweets over X's weighted length limit
+
+        A single revision pass is made; tweets that are still too long, or
+        that couldn't be shortened before the deadline, are returned as is
+        so the preview can flag them.
+
+        Returns:
+            The thread with the overlong tweets shortened
+        """
+        overlong = find_overlong_tweets(tweets)
+        if not overlong:
+            return tweets
+
+        logger.info(f"Shortening overlong tweets {overlong}")
+        metrics.SHORTENED_TWEETS.inc(len(overlong))
+        try:
+            return await self.revise_thread(
+                request, tweets, SHORTEN_FEEDBACK, overlong,
+                user_id=user_id, on_queued=on_queued, operation='shorten', deadline=deadline
+            )
+        except DeadlineExceeded:
+            logger.warning(f"Out of time, leaving tweets {overlong} too long")
+            return tweets
+
+    def _create_revision_prompt(self, request: Dict, tweets: List[str], feedback: str, targets: List[int]) -> str:
+        current = "\n".join(f"{i}. {tweet}" for i, tweet in enumerate(tweets, 1))
         prompt_parts = [
-            f"Create a Twitter thread with the following requirements:",
-            f"\nMain Topic: {request['main']}",
-            f"Context: {request['context']}",
-            f"Required Keywords: {', '.join(keywords)}"
+            "Here is the current Twitter thread:",
+            current,
+            f"\nUser feedback: {feedback}",
+            f"\nRewrite only tweet(s) {', '.join(str(t) for t in targets)} to address the feedback, "
+            "keeping them consistent with the rest of the thread.",
+            f"The thread must still mention: {', '.join((request.get('keywords') or []) + (request.get('tags') or []))}",
+            "Keep any links in these tweets unchanged."
         ]
+        prompt_parts.append(
+            "Reply with only the rewritten tweets as a numbered list using their original numbers, "
+            "each staying within 280 characters."
+        )
+        return "\n".join(prompt_parts)
 
-        if tags:
-            prompt_parts.append(f"Accounts to Tag: {', '.join(tags)}")
-            
-        if request.get('link'):
-            prompt_parts.append(f"Important Link to Include: {request['link']}")
-            prompt_parts.append("Note: Incorporate this link naturally into the most relevant tweet in the thread.")
+    async def estimate_tokens(self, request: Dict) -> int:
+        """Estimate the prompt plus completion tokens of a generation request"""
+        model = self._route('create', request).model
+        system_prompt = self._system_prompt(request)
+        return (
+            count_tokens(system_prompt, model)
+            + count_tokens(await self._create_prompt(request), model)
+            + estimate_completion_tokens(request)
+        )
+
+    def _route(self, operation: str, request: Dict) -> Route:
+        route = self.router.route(operation, request.get('tone', 'normal'), int(request['length']))
+        if operation == 'create' and request.get('model'):
+            # The guild or channel picked its own model for new threads
+            route = self.router.with_model(route, request['model'])
+        return route
+
+    @staticmethod
+    def _system_prompt(request: Dict) -> str:
+        return get_system_prompt(request.get('tone', 'normal'), request.get('tone_prompt'))
+
+    async def _acquire(
+        self,
+        model: str,
+        system_prompt: str,
+        prompt: str,
+        completion_tokens: int,
+        user_id: Optional[int],
+        on_queued: Optional[Callable[[int], Awaitable[None]]]
+    ) -> int:
+        """Wait for rate limit capacity, returning the estimated token usage"""
+        estimated = count_tokens(system_prompt, model) + count_tokens(prompt, model) + completion_tokens
+        await self.limiter.acquire(user_id, estimated, on_queued)
+        return estimated
+
+    def _hedge(self, estimated: int, completion_tokens: int) -> Hedge:
+        """
+        Let a request be hedged only with rate limit and concurrency
+        capacity of its own, and count the hedge's prompt tokens
+        """
+        async def reserve() -> bool:
+            if self.semaphore.locked() or not self.limiter.try_acquire(estimated):
+                return False
+            # A free semaphore is taken without waiting
+            await self.semaphore.acquire()
+            return True
+
+        def charge(prompt_tokens: int, cost: float):
+            tracked = _tracked_usage.get()
+            if tracked is not None:
+                tracked['prompt_tokens'] += prompt_tokens
+                tracked['cost'] += cost
+
+        return Hedge(estimated - completion_tokens, reserve, self.semaphore.release, charge)
 
-        prompt_parts.extend([
-            f"Approximate Thread Length: {request['length']} tweets",
-            "\nFormat the response as a list of tweets, with each tweet starting with a number and staying within 280 characters.",
-            "Make sure to include all required keywords and tags."
-        ])
+    def _record_usage(self, estimated: int, usage, route: Route, model: str):
+        """Reconcile the token budget with the usage reported by OpenAI"""
+        if usage is not None:
+            cost = self.router.record_usage(route, model, usage)
+            self.limiter.record_usage(estimated, usage.total_tokens)
+            tracked = _tracked_usage.get()
+            if tracked is not None:
+                tracked['prompt_tokens'] += usage.prompt_tokens
+                tracked['completion_tokens'] += usage.completion_tokens
+                tracked['cost'] += cost
+            metrics.OPENAI_TOKENS.labels('prompt').inc(usage.prompt_tokens)
+            metrics.OPENAI_TOKENS.labels('completion').inc(usage.completion_tokens)
+            # Prompt tokens served from OpenAI's prompt cache
+            details = getattr(usage, 'prompt_tokens_details', None)
+            cached = getattr(details, 'cached_tokens', None) or 0
+            metrics.OPENAI_TOKENS.labels('cached').inc(cached)
 
-        prompt = "\n".join(prompt_parts)
+    @contextlib.contextmanager
+    def _tracked(self, kind: str, request: Dict, user_id: Optional[int]):
+        """Record a call in the history with the tokens of every request made for it"""
+        if _tracked_usage.get() is not None:
+            # Made on behalf of a call that is already recorded
+            yield
+            return
+        usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0}
+        _tracked_usage.set(usage)
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            # Set rather than reset: a stream may be closed from another context
+            _tracked_usage.set(None)
+            self.history.record(
+                kind, user_id, request.get('tone'), time.perf_counter() - started, ok=ok, **usage
+            )
+
+    def _measure_prompt(self, request: Dict, prompt: str, model: str):
+        """Log and count the tokens of each prompt section"""
+        sections = measure_prompt(request.get('tone', 'normal'), prompt, model, request.get('tone_prompt'))
+        for section in ('tone', 'rules', 'request'):
+            metrics.PROMPT_TOKENS.labels(section).inc(sections[section])
+        metrics.PROMPT_TOKENS_SAVED.inc(sections['saved'])
+        logger.info(
+            f"Prompt tokens: {sections['tone'] + sections['rules']} static prefix "
+            f"(tone {sections['tone']}, rules {sections['rules']}) + {sections['request']} request; "
+            f"{sections['saved']} saved by normalization"
+        )
+
+    def _output_options(self, request: Dict) -> Dict:
+        """Extra completion arguments for the configured output mode"""
+        if self.output_mode != 'json':
+            return {}
+        function = thread_function(int(request['length']))
+        return {
+            'tools': [{"type": "function", "function": function}],
+            'tool_choice': {"type": "function", "function": {"name": function['name']}}
+        }
+
+    def _parse_message(self, message, length: int) -> List[str]:
+        """Extract tweets from a completion message, preferring structured output"""
+        if message.tool_calls:
+            arguments = message.tool_calls[0].function.arguments
+            try:
+                tweets = parse_thread_arguments(arguments)
+            except ValueError as e:
+                logger.warning(f"Invalid structured output ({str(e)}), salvaging complete tweets")
+                tweets = salvage_thread_arguments(arguments)
+        else:
+            tweets = self._parse_response(message.content or "")
+        if len(tweets) > length:
+            logger.warning(f"Got {len(tweets)} tweets for a {length} tweet thread, dropping the extras")
+            tweets = tweets[:length]
+        return tweets
+
+    async def _check(
+        self,
+        request: Dict,
+        tweets: List[str],
+        user_id: Optional[int] = None,
+        deadline: Optional[Deadline] = None
+    ) -> List[str]:
+        """Repair missing tweets, then shorten overlong ones, as far as the deadline allows"""
+        try:
+            tweets = await self._repair(request, tweets, user_id, deadline)
+        except DeadlineExceeded:
+            logger.warning(f"Out of time, returning {len(tweets)} of {request['length']} tweets unrepaired")
+            return tweets
+        return await self.shorten_overlong(request, tweets, user_id, deadline=deadline)
+
+    async def _repair(
+        self,
+        request: Dict,
+        tweets: List[str],
+        user_id: Optional[int] = None,
+        deadline: Optional[Deadline] = None
+    ) -> List[str]:
+        """
+        Regenerate only the tweets that are empty or missing
+
+        Raises:
+            ValueError: If the response contained no usable tweet at all
+        """
+        length = int(request['length'])
+        invalid = find_invalid_tweets(tweets, length)
+        if not invalid:
+            return tweets
+        if not any(tweet.strip() for tweet in tweets):
+            raise ValueError("OpenAI returned no usable tweets")
+
+        logger.warning(f"Repairing invalid tweets {invalid} of {length}")
+        metrics.REPAIRED_TWEETS.inc(len(invalid))
+        padded = list(tweets) + [""] * (length - len(tweets))
+        repaired = await self.revise_thread(
+            request, padded, REPAIR_FEEDBACK, invalid, user_id=user_id, operation='repair', deadline=deadline
+        )
+        return [tweet for tweet in repaired if tweet.strip()]
+
+    def _cache_key(self, route: Route, system_prompt: str, prompt: str, count: int = 1) -> str:
+        params = {'model': route.model, 'temperature': route.temperature, 'output': self.output_mode}
+        if count > 1:
+            params['n'] = count
+        return ResponseCache.make_key(system_prompt, prompt, params)
+
+    async def _create_prompt(self, request: Dict) -> str:
+        # Only the request-specific part; the shared instructions are in the system prompt
+        prompt = generation_prompt(request, await self._find_examples(request))
         logger.debug(f"Created prompt: {prompt}")
         return prompt
 
+    async def _find_examples(self, request: Dict) -> List[Dict]:
+        """Approved threads of the request's tone on the most similar topics"""
+        if config.THREAD_EXAMPLES <= 0:
+            return []
+        query = "\n".join([request['main'], request['context']] + list(request.get('keywords') or []))
+        try:
+            examples = await self.thread_index.search(
+                request.get('tone', 'normal'),
+                query,
+                config.THREAD_EXAMPLES,
+                min_similarity=config.THREAD_EXAMPLE_MIN_SIMILARITY
+            )
+        except Exception as e:
+            # The archive only improves the prompt; never fail a request over it
+            logger.warning(f"Thread index search failed: {str(e)}")
+            return []
+        if examples:
+            logger.debug(f"Using {len(examples)} example threads: {[round(e['similarity'], 2) for e in examples]}")
+        return examples
+
     def _parse_response(self, response: str) -> List[str]:
-        # Split response into individual tweets
-        tweets = [tweet.strip() for tweet in response.split('\n') if tweet.strip()]
-        
-        # Process each tweet
-        cleaned_tweets = []
-        for tweet in tweets:
-            # Remove numbering if present
-            if tweet[0].isdigit():
-                tweet = tweet[tweet.find(' ')+1:].strip()
-            
-            # Remove any surrounding quotes
-            tweet = tweet.strip('"').strip("'").strip()
-            
-            if tweet:  # Only add non-empty tweets
-                cleaned_tweets.append(tweet)
-                
-        return cleaned_tweets
+        # Split the numbered list into tweets, keeping multi-line tweets together
+        return parse_thread(response)
@@ -0,0 +1,97 @@
+import re
+from typing import Dict, List
+
+# X counts tweet length in weighted units (twitter-text v3 configuration):
+# code points in the ranges below weigh 1 character, everything else (CJK,
+# most symbols) weighs 2, every URL counts as 23 characters and an emoji
+# sequence counts as 2 however many code points it is made of.
+MAX_WEIGHTED_LENGTH = 280
+URL_LENGTH = 23
+DEFAULT_WEIGHT = 2
+LIGHT_RANGES = (
+    (0x0000, 0x10FF),
+    (0x2000, 0x200D),
+    (0x2010, 0x201F),
+    (0x2032, 0x2037)
+)
+
+URL_PATTERN = re.compile(r'https?://\S+|www\.\S+', re.IGNORECASE)
+
+# An emoji with any skin tone modifiers, variation selectors, keycaps and
+# zero width joined emoji that follow it
+EMOJI_SEQUENCE = re.compile(
+    '(?:[\U0001F000-\U0001FAFF\u2300-\u23FF\u2600-\u27BF\u2B00-\u2BFF]|[\U0001F1E6-\U0001F1FF]{2})'
+    '(?:[\U0001F3FB-\U0001F3FF\uFE0F\u20E3]|\u200D[\U0001F000-\U0001FAFF\u2600-\u27BF\uFE0F])*'
+)
+
+def _char_weight(char: str) -> int:
+    code = ord(char)
+    for start, end in LIGHT_RANGES:
+        if start <= code <= end:
+            return 1
+    return DEFAULT_WEIGHT
+
+def weighted_length(text: str) -> int:
+    """Length of a tweet the way X counts it"""
+    length = 0
+    position = 0
+    for match in URL_PATTERN.finditer(text):
+        length += _text_length(text[position:match.start()]) + URL_LENGTH
+        position = match.end()
+    return length + _text_length(text[position:])
+
+def _text_length(text: str) -> int:
+    length = 0
+    position = 0
+    for match in EMOJI_SEQUENCE.finditer(text):
+        length += sum(_char_weight(c) for c in text[position:match.start()]) + DEFAULT_WEIGHT
+        position = match.end()
+    return length + sum(_char_weight(c) for c in text[position:])
+
+def find_overlong_tweets(tweets: List[str], limit: int = MAX_WEIGHTED_LENGTH) -> List[int]:
+    """1-based numbers of the tweets longer than limit"""
+    return [i for i, tweet in enumerate(tweets, 1) if weighted_length(tweet) > limit]
+
+def _mentioned(handle: str, text: str) -> bool:
+    handle = handle.strip().lstrip('@').lower()
+    return not handle or re.search(rf'@{re.escape(handle)}\b', text) is not None
+
+def validate_thread(tweets: List[str], request: Dict) -> Dict:
+    """
+    Check a thread against X's length limit and the request's requirements
+
+    Args:
+        tweets: The tweets of the thread
+        request: The request the thread was generated from
+
+    Returns:
+        A report with:
+            - lengths: Weighted length of each tweet
+            - overlong: 1-based numbers of tweets over the limit
+            - missing_keywords: Required keywords not used anywhere in the thread
+            - missing_tags: Accounts to tag that are never mentioned
+    """
+    text = "\n".join(tweets).lower()
+    lengths = [weighted_length(tweet) for tweet in tweets]
+    return {
+        'lengths': lengths,
+        'overlong': [i for i, length in enumerate(lengths, 1) if length > MAX_WEIGHTED_LENGTH],
+        'missing_keywords': [
+            keyword for keyword in request.get('keywords') or []
+            if keyword.strip() and keyword.strip().lower() not in text
+        ],
+        'missing_tags': [tag for tag in request.get('tags') or [] if not _mentioned(tag, text)]
+    }
+
+def format_warnings(report: Dict) -> List[str]:
+    """Human readable warnings for a validate_thread report"""
+    warnings = []
+    for number in report['overlong']:
+        warnings.append(
+            f"Tweet {number} is {report['lengths'][number - 1]}/{MAX_WEIGHTED_LENGTH} characters"
+        )
+    if report['missing_keywords']:
+        warnings.append(f"Missing keywords: {', '.join(report['missing_keywords'])}")
+    if report['missing_tags']:
+        warnings.append(f"Missing tags: {', '.join(report['missing_tags'])}")
+    return warnings
@@ -0,0 +1,20 @@
+import asyncio
+
+from bench.run import Recorder, parse_args, run
+
+def test_bench_flows_succeed(tmp_path, monkeypatch):
+    """A few create/feedback/finalize flows against the stubs, with no latency or errors, all succeed"""
+    monkeypatch.chdir(tmp_path)
+    args = parse_args([
+        '--users', '3',
+        '--ramp', '0',
+        '--openai-latency', '0',
+        '--typefully-latency', '0',
+        '--discord-latency', '0'
+    ])
+    recorder = Recorder()
+
+    assert asyncio.run(run(args, recorder)) == 0
+    assert len(recorder.latencies['create']) == 3
+    assert len(recorder.latencies['finalize']) == 3
+    assert not any(recorder.failures.values()), dict(recorder.failures)